@@ -0,0 +1,399 @@
+"""
+Convergence benchmark of the forge pipeline over a golden corpus.
+
+Drives `POST /forge` (`agentic_sql_to_vql_forge_stream`) for every case of
+the corpus in `benchmarks/forge_corpus`: SQL that does not translate to
+valid VQL right away. The Denodo `DESC QUERYPLAN` checks and the LLM runs
+are replayed from the fixtures recorded in each case file, so a run is
+deterministic and needs neither Denodo nor an AI key, and changes of the
+fix rules, prompts or the loop can be compared on the same inputs.
+
+For each case the runner reports the outcome, the validation loops it took
+to reach valid VQL, the time per step, the total time and the LLM tokens;
+over the corpus the success rate and their percentiles. The report is
+compared with a stored baseline and the differences are printed.
+
+Query plans are looked up by their whitespace-normalized VQL; LLM runs by a
+hash of their system prompt and prompt. A run whose prompt changed replays
+the next unused response of the same agent and is counted as stale. A call
+without any fixture fails the case as a fixture miss. `--record` runs the
+corpus against the configured Denodo server and LLM provider instead and
+stores what they answered as the new fixtures of each case.
+
+The translation needs the Denodo dialect of the sqlglot fork.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_forge_convergence
+    python -m benchmarks.bench_forge_convergence --latency recorded --fail-on-regression
+    python -m benchmarks.bench_forge_convergence --record --update-baseline
+"""
+
+import argparse
+import asyncio
+import contextlib
+import datetime
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Optional
+from unittest import mock
+
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+from src.api.forge import agentic_sql_to_vql_forge_stream
+from src.config import settings
+from src.db import sqlite_session
+from src.db.session import init_db_engine
+from src.schemas.agent import AgenticModeRequest
+from src.services import validation_service
+from src.services.forge_runs import normalize_step_name, percentiles
+from src.utils import ai_analyzer
+
+BENCHMARK_DIR = Path(__file__).parent
+CORPUS_DIR = BENCHMARK_DIR / "forge_corpus"
+BASELINE_PATH = BENCHMARK_DIR / "baselines" / "forge_convergence.json"
+REPLAYED_ERRORS = {"OperationalError": OperationalError, "ProgrammingError": ProgrammingError}
+
+
+class FixtureMiss(Exception):
+    """A Denodo or LLM call of a replayed case has no recorded fixture."""
+
+
+def normalize_vql(vql: str) -> str:
+    return " ".join(vql.split())
+
+
+def prompt_hash(system_prompt: str, prompt: str) -> str:
+    return hashlib.sha256(f"{system_prompt}\n{prompt}".encode()).hexdigest()[:16]
+
+
+class CaseCalls:
+    """Replays or records the Denodo and LLM calls of one corpus case."""
+
+    def __init__(self, fixtures: dict[str, Any], record: bool, replay_latency: bool) -> None:
+        self.record = record
+        self.replay_latency = replay_latency
+        self.queryplans: dict[str, dict[str, Any]] = {} if record else dict(fixtures.get("queryplans", {}))
+        self.llm: list[dict[str, Any]] = [] if record else list(fixtures.get("llm", []))
+        self._used: set[int] = set()
+        self.tokens = 0
+        self.llm_runs = 0
+        self.stale = 0
+        self.misses: list[str] = []
+
+    def fixtures(self) -> dict[str, Any]:
+        return {"queryplans": self.queryplans, "llm": self.llm}
+
+    async def queryplan(self, run_queryplan, vql: str) -> Exception | None:
+        key = normalize_vql(vql)
+        if self.record:
+            started = time.monotonic()
+            error = await run_queryplan(vql)
+            self.queryplans[key] = {
+                "error": None if error is None else str(getattr(error, "orig", error)),
+                "error_type": None if error is None else type(error).__name__,
+                "seconds": round(time.monotonic() - started, 3),
+            }
+            return error
+
+        recorded = self.queryplans.get(key)
+        if recorded is None:
+            self.misses.append(f"queryplan: {key[:80]}")
+            raise FixtureMiss(f"No recorded query plan for: {key[:80]}")
+        if self.replay_latency:
+            await asyncio.sleep(recorded["seconds"])
+        if recorded["error"] is None:
+            return None
+        error_type = REPLAYED_ERRORS.get(recorded["error_type"])
+        if error_type is None:
+            return RuntimeError(recorded["error"])
+        return error_type(f"DESC QUERYPLAN {vql}", None, Exception(recorded["error"]))
+
+    def agent(self, real_factory, system_prompt: str, output_type: type, tools: list = []) -> Any:
+        return CaseAgent(self, real_factory, system_prompt, output_type, tools)
+
+    def take_llm_fixture(self, system_prompt: str, prompt: str) -> dict[str, Any]:
+        """Return the recorded response of a prompt, or the next unused one of the same agent."""
+        key = prompt_hash(system_prompt, prompt)
+        agent_key = prompt_hash(system_prompt, "")
+        fallback = None
+        for index, fixture in enumerate(self.llm):
+            if index in self._used:
+                continue
+            if fixture["prompt"] == key:
+                self._used.add(index)
+                return fixture
+            if fallback is None and fixture["agent"] == agent_key:
+                fallback = index
+        if fallback is None:
+            self.misses.append(f"llm: {system_prompt[:60]}")
+            raise FixtureMiss(f"No recorded LLM response for: {system_prompt[:60]}")
+        self._used.add(fallback)
+        self.stale += 1
+        return self.llm[fallback]
+
+
+class ReplayedUsage:
+    def __init__(self, total_tokens: int) -> None:
+        self.total_tokens = total_tokens
+
+
+class ReplayedRun:
+    """Stands in for a pydantic-ai run result."""
+
+    def __init__(self, output: Any, total_tokens: int) -> None:
+        self.output = output
+        self._usage = ReplayedUsage(total_tokens)
+
+    def usage(self) -> ReplayedUsage:
+        return self._usage
+
+
+class CaseAgent:
+    """An agent whose runs are replayed from, or recorded into, the fixtures of a case."""
+
+    def __init__(self, calls: CaseCalls, real_factory, system_prompt: str, output_type: type, tools: list) -> None:
+        self.calls = calls
+        self.system_prompt = system_prompt
+        self.output_type = output_type
+        self._agent = real_factory(system_prompt, output_type, tools=tools) if calls.record else None
+
+    async def run(self, prompt: str, deps: Any = None) -> Any:
+        calls = self.calls
+        if calls.record:
+            started = time.monotonic()
+            result = await self._agent.run(prompt, deps=deps)
+            tokens = getattr(result.usage(), "total_tokens", None) or 0
+            calls.llm.append({
+                "agent": prompt_hash(self.system_prompt, ""),
+                "prompt": prompt_hash(self.system_prompt, prompt),
+                "output": result.output.model_dump(mode="json") if result.output is not None else None,
+                "tokens": tokens,
+                "seconds": round(time.monotonic() - started, 3),
+            })
+        else:
+            fixture = calls.take_llm_fixture(self.system_prompt, prompt)
+            if calls.replay_latency:
+                await asyncio.sleep(fixture["seconds"])
+            output = None if fixture["output"] is None else self.output_type.model_validate(fixture["output"])
+            result = ReplayedRun(output, fixture["tokens"])
+            tokens = fixture["tokens"]
+        calls.tokens += tokens
+        calls.llm_runs += 1
+        return result
+
+
+class ConnectedRequest:
+    """The HTTP request of the benchmark client, which never disconnects."""
+
+    async def is_disconnected(self) -> bool:
+        return False
+
+
+async def read_sse(body: AsyncIterator[str]) -> AsyncIterator[tuple[float, str, dict[str, Any]]]:
+    """Yield the receive time, event name and payload of each SSE message; heartbeats are skipped."""
+    async for message in body:
+        event, data = "message", None
+        for line in message.strip().splitlines():
+            if line.startswith("event: "):
+                event = line.removeprefix("event: ")
+            elif line.startswith("data: "):
+                data = json.loads(line.removeprefix("data: "))
+        if data is not None:
+            yield time.monotonic(), event, data
+
+
+async def run_case(case: dict[str, Any], record: bool, replay_latency: bool) -> tuple[dict[str, Any], CaseCalls]:
+    """Forge one corpus case through the endpoint and measure it."""
+    calls = CaseCalls(case.get("fixtures", {}), record, replay_latency)
+    run_queryplan = validation_service._run_queryplan
+    real_factory = ai_analyzer._initialize_ai_agent
+    request = AgenticModeRequest(sql=case["sql"], dialect=case["dialect"], vdb=case.get("vdb", ""), vql="",
+                                 use_cache=False)
+
+    steps: dict[int, dict[str, Any]] = {}  # by step id
+    outcome, loops_to_valid = "error", None
+    with contextlib.ExitStack() as patches:
+        patches.enter_context(mock.patch.object(
+            validation_service, "_run_queryplan", lambda vql: calls.queryplan(run_queryplan, vql)))
+        patches.enter_context(mock.patch.object(
+            ai_analyzer, "_initialize_ai_agent", lambda *args, **kwargs: calls.agent(real_factory, *args, **kwargs)))
+        if not record:  # the replayed query plans need no Denodo connection
+            patches.enter_context(mock.patch.object(validation_service, "get_engine", lambda: object()))
+
+        started = time.monotonic()
+        response = await agentic_sql_to_vql_forge_stream(request, ConnectedRequest())
+        async for received, event, data in read_sse(response.body_iterator):
+            if event == "step":
+                step = steps.setdefault(data["id"], {"first": received})
+                step.update({name: value for name, value in data.items() if name != "id"}, last=received)
+            elif event == "result":
+                loops = sum(1 for step in steps.values() if normalize_step_name(step["step_name"]) == "Validate")
+                translated = next((step["success"] for step in steps.values() if step["step_name"] == "Translate"),
+                                  True)
+                outcome = "valid" if data["is_valid"] else "invalid" if translated else "untranslatable"
+                loops_to_valid = loops if data["is_valid"] else None
+        seconds = time.monotonic() - started
+
+    step_seconds: dict[str, float] = {}
+    for step in steps.values():
+        name = normalize_step_name(step["step_name"])
+        step_seconds[name] = round(step_seconds.get(name, 0.0) + step["last"] - step["first"], 3)
+    return {
+        "outcome": "fixture_miss" if calls.misses else outcome,
+        "loops": sum(1 for step in steps.values() if normalize_step_name(step["step_name"]) == "Validate"),
+        "loops_to_valid": loops_to_valid,
+        "seconds": round(seconds, 3),
+        "steps": step_seconds,
+        "tokens": calls.tokens,
+        "llm_runs": calls.llm_runs,
+        "stale_llm_fixtures": calls.stale,
+        "fixture_misses": calls.misses,
+    }, calls
+
+
+def summarize(cases: dict[str, dict[str, Any]]) -> dict[str, Any]:
+    results = list(cases.values())
+    valid = [result for result in results if result["outcome"] == "valid"]
+    step_names = {name for result in results for name in result["steps"]}
+    return {
+        "cases": len(results),
+        "success_rate": round(len(valid) / len(results), 3) if results else 0.0,
+        "fixture_misses": sum(1 for result in results if result["outcome"] == "fixture_miss"),
+        "loops_to_valid": percentiles(result["loops_to_valid"] for result in valid).model_dump(),
+        "seconds": percentiles(result["seconds"] for result in results).model_dump(),
+        "tokens": percentiles(result["tokens"] for result in results).model_dump(),
+        "total_tokens": sum(result["tokens"] for result in results),
+        "steps": {name: percentiles(result["steps"][name] for result in results if name in result["steps"])
+                  .model_dump() for name in sorted(step_names)},
+    }
+
+
+def load_corpus(corpus_dir: Path, case_ids: Optional[list[str]]) -> list[tuple[Path, dict[str, Any]]]:
+    corpus = [(path, json.loads(path.read_text())) for path in sorted(corpus_dir.glob("*.json"))]
+    if case_ids:
+        corpus = [(path, case) for path, case in corpus if case["id"] in case_ids]
+    return corpus
+
+
+def compare(report: dict[str, Any], baseline: dict[str, Any]) -> bool:
+    """Print the differences of a report to the baseline; return True if a case or the success rate regressed."""
+    now, before = report["summary"], baseline["summary"]
+    print(f"\nCompared with the baseline of {baseline['generated_at']}:")
+    print(f"{'metric':<24}{'baseline':>12}{'current':>12}{'change':>12}")
+    for label, old, new in [
+        ("success rate", before["success_rate"], now["success_rate"]),
+        ("loops to valid (mean)", before["loops_to_valid"]["mean"], now["loops_to_valid"]["mean"]),
+        ("seconds (p50)", before["seconds"]["p50"], now["seconds"]["p50"]),
+        ("seconds (p95)", before["seconds"]["p95"], now["seconds"]["p95"]),
+        ("tokens (mean)", before["tokens"]["mean"], now["tokens"]["mean"]),
+        ("tokens (total)", before["total_tokens"], now["total_tokens"]),
+    ]:
+        print(f"{label:<24}{old:>12}{new:>12}{new - old:>+12.3f}")
+
+    regressed = now["success_rate"] < before["success_rate"]
+    changes = []
+    for case_id, result in report["cases"].items():
+        old = baseline["cases"].get(case_id)
+        if old is None:
+            changes.append(f"  {case_id}: new case, {result['outcome']}")
+            continue
+        if result["outcome"] != old["outcome"]:
+            regressed = regressed or old["outcome"] == "valid"
+            changes.append(f"  {case_id}: {old['outcome']} -> {result['outcome']}")
+        elif result["loops_to_valid"] != old["loops_to_valid"]:
+            regressed = regressed or result["loops_to_valid"] > old["loops_to_valid"]
+            changes.append(f"  {case_id}: loops to valid {old['loops_to_valid']} -> {result['loops_to_valid']}")
+        if result["tokens"] != old["tokens"]:
+            changes.append(f"  {case_id}: tokens {old['tokens']} -> {result['tokens']}")
+    print("Changed cases:" if changes else "No case changed its outcome, loops or tokens.")
+    for change in changes:
+        print(change)
+    return regressed
+
+
+def print_report(report: dict[str, Any]) -> None:
+    print(f"{'case':<32}{'outcome':>16}{'loops':>7}{'seconds':>10}{'tokens':>9}")
+    for case_id, result in report["cases"].items():
+        print(f"{case_id:<32}{result['outcome']:>16}{result['loops']:>7}{result['seconds']:>10.3f}"
+              f"{result['tokens']:>9}")
+        for miss in result["fixture_misses"]:
+            print(f"    missing fixture: {miss}")
+    summary = report["summary"]
+    print(f"\nsuccess rate {summary['success_rate']:.1%} of {summary['cases']} cases, "
+          f"{summary['fixture_misses']} with missing fixtures")
+    print(f"loops to valid: mean {summary['loops_to_valid']['mean']}, p95 {summary['loops_to_valid']['p95']}")
+    print(f"seconds per case: p50 {summary['seconds']['p50']}, p95 {summary['seconds']['p95']}")
+    print(f"tokens: {summary['total_tokens']} in total, mean {summary['tokens']['mean']} per case")
+    for name, seconds in summary["steps"].items():
+        print(f"  {name:<22} p50 {seconds['p50']:>8.3f}s  p95 {seconds['p95']:>8.3f}s")
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    corpus = load_corpus(args.corpus, args.cases)
+    if args.record and init_db_engine() is None:
+        raise SystemExit("Recording needs a connection to Denodo.")
+
+    cases = {}
+    for path, case in corpus:
+        result, calls = await run_case(case, args.record, args.latency == "recorded")
+        cases[case["id"]] = result
+        if args.record:
+            case["fixtures"] = calls.fixtures()
+            path.write_text(json.dumps(case, indent=2) + "\n")
+    return {
+        "generated_at": datetime.datetime.utcnow().isoformat(timespec="seconds"),
+        "mode": "record" if args.record else f"replay ({args.latency} latency)",
+        "cases": cases,
+        "summary": summarize(cases),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", type=Path, default=CORPUS_DIR)
+    parser.add_argument("--cases", nargs="+", help="run only these case ids")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--record", action="store_true",
+                        help="call Denodo and the LLM provider and store their answers as the case fixtures")
+    parser.add_argument("--latency", choices=["none", "recorded"], default="none",
+                        help="replay calls instantly, or with the latency seen when they were recorded")
+    parser.add_argument("--report", type=Path, help="also write the report as JSON to this file")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="exit with 1 if a case or the success rate regressed against the baseline")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    with tempfile.TemporaryDirectory() as directory:
+        # An empty log database: no history in the prompts, no memoized steps, traces thrown away.
+        settings.SQLITE_DB_PATH = os.path.join(directory, "bench_forge.db")
+        sqlite_session.init_sqlite_db()
+        try:
+            report = asyncio.run(run(args))
+        finally:
+            sqlite_session.shutdown_sqlite_executor()
+
+    print_report(report)
+    if args.report:
+        args.report.write_text(json.dumps(report, indent=2) + "\n")
+    regressed = False
+    if args.baseline.exists():
+        regressed = compare(report, json.loads(args.baseline.read_text()))
+    else:
+        print(f"\nNo baseline at {args.baseline}.")
+    if args.update_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"Stored the baseline at {args.baseline}.")
+    if regressed and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Import-time profile of the application (cold start).
+
+Imports `src.main` in fresh interpreters with `-X importtime` and reports
+the total import time (the best of a few runs) and the slowest modules.
+Fails with exit code 1 if the import takes longer than `--max-seconds`, or
+if it loads an LLM provider SDK, which is only to be imported on first use
+for the configured provider. Meant to run in CI to catch cold start
+regressions.
+
+Needs the application environment (e.g. the `.env` file) for the settings.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_import_time --max-seconds 3 --runs 5
+"""
+
+import argparse
+import subprocess
+import sys
+
+# Modules that must not be imported at startup: the LLM provider SDKs.
+LAZY_MODULES = (
+    "openai",
+    "google.genai",
+    "pydantic_ai.models.openai",
+    "pydantic_ai.models.google",
+    "pydantic_ai.providers.azure",
+    "pydantic_ai.providers.google",
+)
+
+
+def profile_import(module: str) -> tuple[float, dict[str, tuple[int, int]]]:
+    """Import `module` in a fresh interpreter and return its import seconds and the
+    self and cumulative microseconds of every imported module."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True,
+    )
+    if completed.returncode != 0:
+        raise SystemExit(f"Importing {module} failed:\n{completed.stderr[-2000:]}")
+
+    timings: dict[str, tuple[int, int]] = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|", 2)
+        timings[name.strip()] = (int(self_us), int(cumulative_us))
+    if module not in timings:
+        raise SystemExit(f"No import time was reported for {module}.")
+    return timings[module][1] / 1e6, timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="src.main")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters; the fastest run counts")
+    parser.add_argument("--max-seconds", type=float, default=3.0, help="fail above this import time")
+    parser.add_argument("--top", type=int, default=15, help="slowest modules to list")
+    args = parser.parse_args()
+
+    profile_import(args.module)  # warm up the bytecode cache
+    runs = [profile_import(args.module) for _ in range(args.runs)]
+    seconds, timings = min(runs, key=lambda run: run[0])
+
+    print(f"import {args.module}: best {seconds:.3f}s of {args.runs} runs "
+          f"(worst {max(run[0] for run in runs):.3f}s), {len(timings)} modules")
+    print(f"{'module':<60}{'self [ms]':>12}{'cumulative [ms]':>18}")
+    top_level = {name: timing for name, timing in timings.items() if "." not in name}
+    for name, (self_us, cumulative_us) in sorted(top_level.items(), key=lambda item: -item[1][1])[:args.top]:
+        print(f"{name:<60}{self_us / 1000:>12.1f}{cumulative_us / 1000:>18.1f}")
+
+    failures = [f"{name} is imported at startup" for name in LAZY_MODULES if name in timings]
+    if seconds > args.max_seconds:
+        failures.append(f"the import took {seconds:.3f}s, more than {args.max_seconds:.3f}s")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Concurrency benchmark of the SQLite logging database.
+
+Runs writer threads that log accepted queries (one transaction per entry,
+like `POST /log/accepted`) while reader threads run history lookups, once
+against a default rollback-journal engine and once against the tuned WAL
+engine from `create_sqlite_engine`. Reports write and read throughput, read
+latency and lock errors.
+
+Needs the application environment (e.g. the `.env` file) for the settings.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_sqlite_concurrency --writers 4 --readers 8 --seconds 10
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from src.db.sqlite_session import create_sqlite_engine, sqlite_pragmas
+from src.schemas.db_log import AcceptedQuery, AcceptedQueryTable, Base
+
+DISTINCT_TABLES = 500
+
+
+def run_workload(engine, writers: int, readers: int, seconds: float) -> dict[str, float]:
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine, autoflush=False)
+    stop = threading.Event()
+    lock = threading.Lock()
+    results = {"writes": 0, "reads": 0, "lock_errors": 0}
+    read_latencies: list[float] = []
+
+    def writer(seed: int) -> None:
+        rng = random.Random(seed)
+        while not stop.is_set():
+            names = [f"table_{t}" for t in rng.sample(range(DISTINCT_TABLES), 2)]
+            try:
+                with session_factory() as db:
+                    entry = AcceptedQuery(source_dialect="oracle", source_sql=f"SELECT * FROM {names[0]}",
+                                          target_vql=f"SELECT * FROM {names[0]}", tables=json.dumps(names))
+                    db.add(entry)
+                    db.flush()
+                    db.add_all(AcceptedQueryTable(query_id=entry.id, table_name=name) for name in names)
+                    db.commit()
+                with lock:
+                    results["writes"] += 1
+            except OperationalError:
+                with lock:
+                    results["lock_errors"] += 1
+
+    def reader(seed: int) -> None:
+        rng = random.Random(seed)
+        while not stop.is_set():
+            table = f"table_{rng.randrange(DISTINCT_TABLES)}"
+            matching_ids = select(AcceptedQueryTable.query_id).where(AcceptedQueryTable.table_name == table)
+            started = time.perf_counter()
+            try:
+                with session_factory() as db:
+                    db.query(AcceptedQuery).filter(AcceptedQuery.id.in_(matching_ids)) \
+                        .order_by(AcceptedQuery.timestamp.desc()).limit(10).all()
+                with lock:
+                    results["reads"] += 1
+                    read_latencies.append((time.perf_counter() - started) * 1000)
+            except OperationalError:
+                with lock:
+                    results["lock_errors"] += 1
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    threads += [threading.Thread(target=reader, args=(1000 + i,)) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    latencies = sorted(read_latencies) or [0.0]
+    return {
+        "writes_per_second": results["writes"] / seconds,
+        "reads_per_second": results["reads"] / seconds,
+        "read_p50_ms": statistics.median(latencies),
+        "read_p95_ms": latencies[int(len(latencies) * 0.95) - 1 if len(latencies) > 1 else 0],
+        "lock_errors": results["lock_errors"],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    args = parser.parse_args()
+
+    configurations = {
+        "default (rollback journal)": lambda path: create_engine(
+            f"sqlite:///{path}", connect_args={"check_same_thread": False}),
+        "tuned (WAL + pragmas)": lambda path: create_sqlite_engine(path, sqlite_pragmas()),
+    }
+    for name, make_engine in configurations.items():
+        with tempfile.TemporaryDirectory() as directory:
+            engine = make_engine(os.path.join(directory, "bench.db"))
+            result = run_workload(engine, args.writers, args.readers, args.seconds)
+            engine.dispose()
+        print(f"{name}:")
+        for key, value in result.items():
+            print(f"  {key:<18} {value:10.2f}")
+
+
+if __name__ == "__main__":
+    main()
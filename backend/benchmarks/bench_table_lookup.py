@@ -0,0 +1,107 @@
+"""
+Benchmark of accepted-query lookups by table name.
+
+Compares the JSON-based lookups (`json_each` EXISTS subquery used by
+`/log/filter`, `LIKE '%"t"%'` OR-chain used by the history tool) against the
+indexed `accepted_query_tables` junction on a synthetic log database.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_table_lookup --rows 100000 1000000
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import String, column, create_engine, func, insert, or_, select
+
+from src.db.migrations import run_migrations
+from src.schemas.db_log import AcceptedQuery, AcceptedQueryTable, Base
+
+DISTINCT_TABLES = 5000
+BATCH_SIZE = 50000
+REPETITIONS = 20
+
+
+def populate(engine, rows: int) -> None:
+    rng = random.Random(42)
+    start = datetime.datetime(2024, 1, 1)
+    with engine.begin() as connection:
+        for offset in range(0, rows, BATCH_SIZE):
+            queries, junction = [], []
+            for query_id in range(offset + 1, min(offset + BATCH_SIZE, rows) + 1):
+                tables = rng.sample(range(DISTINCT_TABLES), rng.randint(1, 4))
+                names = [f"table_{t}" for t in tables]
+                queries.append({
+                    "id": query_id,
+                    "timestamp": start + datetime.timedelta(seconds=query_id),
+                    "source_dialect": rng.choice(["oracle", "bigquery", "snowflake"]),
+                    "source_sql": f"SELECT * FROM {', '.join(names)}",
+                    "target_vql": f"SELECT * FROM {', '.join(names)}",
+                    "tables": json.dumps(names),
+                })
+                junction.extend({"query_id": query_id, "table_name": name, "vdb": None} for name in names)
+            connection.execute(insert(AcceptedQuery), queries)
+            connection.execute(insert(AcceptedQueryTable), junction)
+
+
+def json_each_lookup(tables):
+    json_table = func.json_each(AcceptedQuery.tables).table_valued(column("value", String), name="json_table")
+    return (select(AcceptedQuery.id)
+            .where(select(1).where(json_table.c.value.in_(tables)).exists())
+            .order_by(AcceptedQuery.timestamp.desc()).limit(10))
+
+
+def like_lookup(tables):
+    return (select(AcceptedQuery.id)
+            .where(or_(*(AcceptedQuery.tables.like(f'%"{table}"%') for table in tables)))
+            .order_by(AcceptedQuery.timestamp.desc()).limit(10))
+
+
+def junction_lookup(tables):
+    matching_ids = select(AcceptedQueryTable.query_id).where(AcceptedQueryTable.table_name.in_(tables))
+    return (select(AcceptedQuery.id)
+            .where(AcceptedQuery.id.in_(matching_ids))
+            .order_by(AcceptedQuery.timestamp.desc()).limit(10))
+
+
+def measure(engine, build_query) -> tuple[float, float]:
+    rng = random.Random(7)
+    timings = []
+    with engine.connect() as connection:
+        for _ in range(REPETITIONS):
+            tables = [f"table_{t}" for t in rng.sample(range(DISTINCT_TABLES), 2)]
+            started = time.perf_counter()
+            connection.execute(build_query(tables)).all()
+            timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), max(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as directory:
+            engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+            Base.metadata.create_all(bind=engine)
+            run_migrations(engine)
+            started = time.perf_counter()
+            populate(engine, rows)
+            print(f"\n{rows:,} accepted queries (populated in {time.perf_counter() - started:.1f}s)")
+            for name, build_query in (("json_each EXISTS", json_each_lookup),
+                                      ("LIKE OR-chain", like_lookup),
+                                      ("junction index", junction_lookup)):
+                median, worst = measure(engine, build_query)
+                print(f"  {name:<18} median {median:9.2f} ms   max {worst:9.2f} ms")
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
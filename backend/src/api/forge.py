@@ -3,219 +3,293 @@ API routes for the VQL Forge agentic process.
 
 This module provides a FastAPI endpoint for converting SQL to VQL in an
 iterative, agent-like process. It uses Server-Sent Events (SSE) to stream
-progress back to the client.
+progress back to the client, in the compact step delta protocol described
+in `src.utils.sse`. If the client disconnects, the process is cancelled,
+together with its pending AI runs and Denodo statements.
+
+Many queries can be forged over one stream as a batch. Long runs can
+instead be queued as durable jobs, which keep running without
+a connected client; clients poll a job or attach to its event stream.
 """
 
+import asyncio
+import datetime
 import logging
-import json
-from fastapi import APIRouter
+import time
+from typing import AsyncIterator, Callable, Optional
+from fastapi import APIRouter, Header, HTTPException, Query, Request
 from fastapi.responses import StreamingResponse
 
-from src.schemas.validation import VqlValidationApiResponse
-from src.schemas.agent import AgenticModeRequest, AgenticModeResponse, AgentStep
-from src.schemas.validation import VqlValidateRequest
-from src.services.translation_service import run_translation
-from src.services.validation_service import run_validation
-from src.utils.ai_analyzer import explain_vql_differences
+from src.schemas.agent import (
+    AgenticModeRequest,
+    ForgeBatchRequest,
+    ForgeJobCreatedResponse,
+    ForgeJobResponse,
+    ForgeStatsResponse,
+)
+from src.db.sqlite_session import run_sqlite
+from src.services.forge_jobs import create_job, forge_job_workers, read_job, read_job_events
+from src.services.forge_runs import compute_forge_stats
+from src.services.forge_service import ForgeEvent, run_forge_batch, run_forge_pipeline
+from src.utils.metrics import metrics
+from src.utils.sse import HEARTBEAT_MESSAGE, SSE_HEADERS, StepDeltaEncoder, format_sse
 from src.config import settings
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
-async def format_sse(data: dict, event: str | None = None) -> str:
-    """Format a dictionary into a Server-Sent Event (SSE) message string.
+def _record_cancellation(elapsed: float) -> None:
+    """Count a forge run cancelled by its client and estimate the time it would still have taken."""
+    completed = metrics.timing("forge.seconds")
+    expected = completed["sum"] / completed["count"] if completed["count"] else 0.0
+    reclaimed = max(0.0, expected - elapsed)
+    metrics.increment("forge.cancelled")
+    metrics.observe("forge.cancelled_after_seconds", elapsed)
+    metrics.increment("forge.reclaimed_seconds", reclaimed)
+    logger.info(f"Client disconnected, cancelled the forge process after {elapsed:.1f}s "
+                f"(about {reclaimed:.1f}s of remaining work reclaimed).")
+
+
+async def compact_forge_messages(events: AsyncIterator[ForgeEvent]) -> AsyncIterator[str]:
+    """Encode forge events as SSE messages of the compact step delta protocol."""
+    encoder = StepDeltaEncoder()
+    async for event, data in events:
+        encoded = encoder.encode(event, data)
+        if encoded is not None:
+            yield format_sse(encoded[1], event=encoded[0])
+
+
+async def stream_until_disconnect(
+    http_request: Request,
+    messages: AsyncIterator[str],
+    on_cancel: Callable[[float], None] | None = _record_cancellation,
+) -> AsyncIterator[str]:
+    """Stream SSE messages with heartbeats and cancel the producer when the client disconnects.
+
+    The messages are produced in a separate task, so a disconnect is noticed
+    every `FORGE_DISCONNECT_POLL_SECONDS` even while the producer waits for
+    an AI run or a Denodo statement. The producer is also cancelled when the
+    server closes the stream, e.g. because it saw the disconnect first. A
+    heartbeat comment is sent after `SSE_HEARTBEAT_SECONDS` without a message.
 
     Args:
-        data: The dictionary payload to send.
-        event: An optional event name for the SSE message.
+        http_request: The request of the streaming response.
+        messages: The SSE messages to send.
+        on_cancel: Called with the elapsed seconds when the producer is cancelled.
 
-    Returns:
-        A string formatted as a compliant SSE message.
+    Yields:
+        SSE messages.
     """
-    payload = json.dumps(data)
-    if event:
-        return f"event: {event}\ndata: {payload}\n\n"
-    return f"data: {payload}\n\n"
+    queue: asyncio.Queue[str | None] = asyncio.Queue()
 
+    async def produce() -> None:
+        try:
+            async for message in messages:
+                queue.put_nowait(message)
+        finally:
+            queue.put_nowait(None)
+
+    started = last_sent = time.monotonic()
+    poll_seconds = min(settings.FORGE_DISCONNECT_POLL_SECONDS, settings.SSE_HEARTBEAT_SECONDS)
+    producer = asyncio.create_task(produce(), name="sse-producer")
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), timeout=poll_seconds)
+            except asyncio.TimeoutError:
+                if await http_request.is_disconnected():
+                    return
+                if time.monotonic() - last_sent < settings.SSE_HEARTBEAT_SECONDS:
+                    continue
+                message = HEARTBEAT_MESSAGE
+            if message is None:
+                break
+            last_sent = time.monotonic()
+            yield message
+        await producer  # re-raise anything the producer did not turn into an error event
+    finally:
+        if not producer.done():
+            producer.cancel()
+            if on_cancel is not None:
+                on_cancel(time.monotonic() - started)
 
-def format_explanation_as_markdown(explanation: str) -> str:
-    """Format the AI explanation into better structured markdown.
 
-    This function enhances a plain text explanation by attempting to structure
-    it as markdown. If markdown markers like '##' or '-' are already present,
-    it returns the original string to avoid double formatting.
+@router.post("/forge", tags=["VQL Forge"])
+async def agentic_sql_to_vql_forge_stream(request: AgenticModeRequest, http_request: Request) -> StreamingResponse:
+    """Handle the agentic SQL-to-VQL process via a streaming response.
+
+    This endpoint uses Server-Sent Events (SSE) to provide real-time updates
+    of the agent's progress. The process involves an initial translation,
+    followed by a series of validation and correction loops until the VQL is
+    valid or the maximum number of attempts is reached. If the client
+    disconnects, the process is cancelled.
 
     Args:
-        explanation: The raw explanation string from the AI.
+        request: The request containing the SQL query, its dialect, and the VDB.
+        http_request: The underlying HTTP request, used to detect a disconnect.
 
     Returns:
-        A markdown-formatted explanation string.
+        A StreamingResponse that sends SSE events to the client.
     """
-    if not explanation:
-        return explanation
+    messages = compact_forge_messages(run_forge_pipeline(request))
+    return StreamingResponse(stream_until_disconnect(http_request, messages),
+                             media_type="text/event-stream", headers=SSE_HEADERS)
 
-    # If the explanation is already well-formatted, return as-is
-    if any(marker in explanation for marker in ['##', '- ', '* ', '\n- ', '\n* ']):
-        return explanation
 
-    # Otherwise, try to structure it better
-    lines = explanation.split('\n')
-    formatted_lines = []
+@router.post("/forge/batch", tags=["VQL Forge"])
+async def agentic_sql_to_vql_forge_batch_stream(request: ForgeBatchRequest, http_request: Request) -> StreamingResponse:
+    """Run the agentic SQL-to-VQL process for many queries over a single event stream.
 
-    for line in lines:
-        line = line.strip()
-        if not line:
-            formatted_lines.append('')
-            continue
-        else:
-            formatted_lines.append(line)
+    Up to `concurrency` items are forged at the same time. Every "step",
+    "result" and "error" event carries the `item_id` of its item; the stream
+    ends with a "summary" event with the valid and invalid counts, the
+    validation loops used and the total time. If the client disconnects,
+    the whole batch is cancelled.
 
-    return '\n'.join(formatted_lines)
+    Args:
+        request: The items to forge and the optional concurrency.
+        http_request: The underlying HTTP request, used to detect a disconnect.
 
+    Raises:
+        HTTPException: 400 if the batch is too large or item ids are not unique.
 
-@router.post("/forge", tags=["VQL Forge"])
-async def agentic_sql_to_vql_forge_stream(request: AgenticModeRequest,) -> StreamingResponse:
-    """Handle the agentic SQL-to-VQL process via a streaming response.
+    Returns:
+        A StreamingResponse that sends SSE events to the client.
+    """
+    if len(request.items) > settings.FORGE_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400, detail=f"A batch can contain at most {settings.FORGE_BATCH_MAX_ITEMS} items.")
+    item_ids = [item.id or str(position) for position, item in enumerate(request.items)]
+    if len(set(item_ids)) != len(item_ids):
+        raise HTTPException(status_code=400, detail="The item ids of a batch must be unique.")
+    concurrency = min(request.concurrency or settings.FORGE_BATCH_CONCURRENCY, settings.FORGE_BATCH_CONCURRENCY)
+    messages = compact_forge_messages(run_forge_batch(request.items, concurrency))
+    return StreamingResponse(stream_until_disconnect(http_request, messages),
+                             media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@router.get("/forge/stats", response_model=ForgeStatsResponse, tags=["VQL Forge"])
+async def get_forge_stats(
+    days: int = Query(settings.FORGE_STATS_WINDOW_DAYS, ge=1, description="Aggregate the runs of the last days."),
+    dialect: Optional[str] = Query(None, description="Only runs of this source dialect."),
+    vdb: Optional[str] = Query(None, description="Only runs against this VDB."),
+) -> ForgeStatsResponse:
+    """Aggregate the traces of finished forge runs into latency and convergence statistics.
+
+    Returns the run count, the share of runs that converged to valid VQL,
+    the outcomes, percentiles of the validation loops, total seconds, LLM
+    tokens and tool calls, the share of runs that used up their token
+    budget and the most frequent error categories. These are given overall,
+    by dialect and by VDB, together with duration and token percentiles per
+    step.
 
-    This endpoint uses Server-Sent Events (SSE) to provide real-time updates
-    of the agent's progress. The process involves an initial translation,
-    followed by a series of validation and correction loops until the VQL is
-    valid or the maximum number of attempts is reached.
+    Args:
+        days: The time window in days.
+        dialect: Restrict the statistics to one source dialect.
+        vdb: Restrict the statistics to one VDB.
+
+    Raises:
+        HTTPException: 500 if the traces cannot be read.
+
+    Returns:
+        The aggregated statistics.
+    """
+    since = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    try:
+        return await run_sqlite(lambda db: compute_forge_stats(db, since, dialect, vdb))
+    except Exception as e:
+        logger.error(f"Failed to compute forge statistics: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to compute forge statistics.")
+
+
+@router.post("/forge/jobs", status_code=202, response_model=ForgeJobCreatedResponse, tags=["VQL Forge"])
+async def create_forge_job(request: AgenticModeRequest) -> ForgeJobCreatedResponse:
+    """Queue the agentic SQL-to-VQL process as a durable background job.
+
+    The job is stored in the SQLite job table and executed by the forge job
+    workers, independent of any client connection, so it survives proxy
+    timeouts and is resumed after a server restart.
 
     Args:
         request: The request containing the SQL query, its dialect, and the VDB.
 
+    Raises:
+        HTTPException: 503 if the job table or the job workers are unavailable.
+
     Returns:
-        A StreamingResponse that sends SSE events to the client.
+        The job id and the URLs to poll the job and to attach to its events.
     """
-    async def event_generator():
-        process_log: list[AgentStep] = []
+    if not forge_job_workers.running:
+        raise HTTPException(status_code=503, detail="Forge jobs are currently not accepted.")
+    try:
+        job_id = await run_sqlite(lambda db: create_job(db, request))
+    except Exception as e:
+        logger.error(f"Failed to queue forge job: {e}", exc_info=True)
+        raise HTTPException(status_code=503, detail="Forge jobs are currently not accepted.")
+    forge_job_workers.notify()
+    return ForgeJobCreatedResponse(
+        job_id=job_id,
+        status="queued",
+        status_url=f"/forge/jobs/{job_id}",
+        events_url=f"/forge/jobs/{job_id}/events",
+    )
+
+
+@router.get("/forge/jobs/{job_id}", response_model=ForgeJobResponse, tags=["VQL Forge"])
+async def get_forge_job(job_id: str) -> ForgeJobResponse:
+    """Poll a forge job for its status, its steps so far and, once finished, its result.
 
-        try:
-            # Step 1: Initial Translation (occurs once)
-            step1 = AgentStep(step_name="Translate", details=f"Translating {request.dialect} to VQL...", success=True)
-            process_log.append(step1)
-            yield await format_sse(step1.model_dump(), event="step")
-
-            translation_result = await run_translation(request.sql, request.dialect, request.vdb)
-
-            if translation_result.error_analysis:
-                step1.success = False
-                category = translation_result.error_analysis.error_category or "Translation Error"
-                step1.details = f"Initial SQL translation failed: {category}."
-                yield await format_sse(step1.model_dump(), event="step")
-                final_error_result = AgenticModeResponse(
-                    final_vql=None, is_valid=False, process_log=process_log, final_message="Could not translate source SQL.",
-                    error_analysis=translation_result.error_analysis
-                )
-                yield await format_sse(final_error_result.model_dump(), event="result")
-                return
-
-            current_vql = translation_result.vql
-            step1.details = "Translation successful."
-            step1.output = current_vql
-            yield await format_sse(step1.model_dump(), event="step")
-
-            # Correction Loop
-            for i in range(settings.AGENTIC_MAX_LOOPS):
-                loop_count = i + 1
-
-                # Validation Step
-                validation_step_name = "Validate" if i == 0 else f"Re-Validate (Step {loop_count})"
-                validation_step = AgentStep(step_name=validation_step_name,
-                                            details=f"Validating VQL (Step {loop_count})...", success=True)
-                process_log.append(validation_step)
-                yield await format_sse(validation_step.model_dump(), event="step")
-
-                validation_request: VqlValidateRequest = VqlValidateRequest(
-                    sql=request.sql, vql=current_vql, vdb=request.vdb, dialect=request.dialect)
-                validation_result: VqlValidationApiResponse = await run_validation(validation_request)
-
-                if validation_result.validated:
-                    validation_step.details = "Validation successful."
-                    yield await format_sse(validation_step.model_dump(), event="step")
-
-                    # Explain Differences
-                    explain_step = AgentStep(
-                        step_name="Explain",
-                        details="Analyzing differences between source SQL and final VQL...",
-                        success=True
-                    )
-                    process_log.append(explain_step)
-                    yield await format_sse(explain_step.model_dump(), event="step")
-
-                    raw_explanation = await explain_vql_differences(
-                        source_sql=request.sql,
-                        source_dialect=request.dialect,
-                        final_vql=current_vql
-                    )
-
-                    # Format the explanation with better structure
-                    formatted_explanation = format_explanation_as_markdown(raw_explanation)
-
-                    final_explanation = f"## Key Differences Between Source SQL and Final VQL\n\n{formatted_explanation}"
-
-                    explain_step.details = final_explanation
-                    yield await format_sse(explain_step.model_dump(), event="step")
-
-                    final_success_result = AgenticModeResponse(
-                        final_vql=current_vql, is_valid=True, process_log=process_log,
-                        final_message="Agentic process complete. The VQL is valid."
-                    )
-                    yield await format_sse(final_success_result.model_dump(), event="result")
-                    return  # Exit the generator on success
-
-                # If validation fails
-                error_analysis = validation_result.error_analysis
-                validation_step.success = False
-                category = error_analysis.error_category if error_analysis else "Unknown Error"
-                validation_step.details = f"Validation failed: {category}."
-                yield await format_sse(validation_step.model_dump(), event="step")
-
-                if not error_analysis or not error_analysis.sql_suggestion:
-                    final_no_suggestion_result = AgenticModeResponse(
-                        final_vql=current_vql, is_valid=False, process_log=process_log,
-                        final_message="Validation failed. AI provided an explanation but no automatic correction.",
-                        error_analysis=error_analysis
-                    )
-                    yield await format_sse(final_no_suggestion_result.model_dump(), event="result")
-                    return
+    Args:
+        job_id: The id returned by `POST /forge/jobs`.
 
-                # Check if we are on the last loop iteration
-                if loop_count >= settings.AGENTIC_MAX_LOOPS:
-                    # Don't try to correct on the last iteration, just fail.
-                    final_max_loops_result = AgenticModeResponse(
-                        final_vql=current_vql, is_valid=False, process_log=process_log,
-                        final_message=f"Agentic process failed. Reached maximum correction loops ({settings.AGENTIC_MAX_LOOPS}). The VQL is still invalid.",
-                        error_analysis=error_analysis
-                    )
-                    yield await format_sse(final_max_loops_result.model_dump(), event="result")
-                    return
+    Raises:
+        HTTPException: 404 if the job does not exist.
+
+    Returns:
+        The job status.
+    """
+    job = await run_sqlite(lambda db: read_job(db, job_id))
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Forge job '{job_id}' not found.")
+    return job
+
+
+@router.get("/forge/jobs/{job_id}/events", tags=["VQL Forge"])
+async def stream_forge_job_events(
+    job_id: str,
+    http_request: Request,
+    after: int = Query(0, ge=0, description="Replay only the events after this event id."),
+    last_event_id: int | None = Header(None, description="Set by a reconnecting EventSource; overrides `after`."),
+) -> StreamingResponse:
+    """Attach to the event stream of a forge job.
+
+    The stored events are replayed first, then new events are streamed as
+    the job progresses; the stream ends with the job's result or error
+    event. Every message carries its event id, so a reconnecting client
+    continues where it left off. Disconnecting does not cancel the job.
 
-                # AI Analysis & Correction Step
-                analysis_step = AgentStep(
-                    step_name=f"Analyze (Step {loop_count})",
-                    details="AI is analyzing the error to find a correction...",
-                    success=True
-                )
-                process_log.append(analysis_step)
-                yield await format_sse(analysis_step.model_dump(), event="step")
-
-                correction_step = AgentStep(
-                    step_name=f"Correct (Step {loop_count})",
-                    details="AI provided a corrected VQL.",
-                    success=True,
-                    output=error_analysis.sql_suggestion
-                )
-                process_log.append(correction_step)
-                yield await format_sse(correction_step.model_dump(), event="step")
-
-                current_vql = error_analysis.sql_suggestion
-
-        except Exception as e:
-            logger.error(f"Error during agentic stream: {e}", exc_info=True)
-            error_payload = {"detail": f"An unexpected error occurred in the agentic process: {e}"}
-            yield await format_sse(error_payload, event="error")
-
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+    Args:
+        job_id: The id returned by `POST /forge/jobs`.
+        http_request: The underlying HTTP request, used to detect a disconnect.
+        after: Replay only the events after this event id.
+        last_event_id: The `Last-Event-ID` header of a reconnecting client.
+
+    Raises:
+        HTTPException: 404 if the job does not exist.
+
+    Returns:
+        A StreamingResponse that sends SSE events to the client.
+    """
+    after_id = last_event_id if last_event_id is not None else after
+    status, _ = await run_sqlite(lambda db: read_job_events(db, job_id, after_id))
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Forge job '{job_id}' not found.")
+
+    async def event_generator() -> AsyncIterator[str]:
+        async for event_id, event, data in forge_job_workers.stream_events(job_id, after_id):
+            yield format_sse(data, event=event, event_id=event_id)
+
+    # Only the stream is cancelled on a disconnect; the job keeps running.
+    return StreamingResponse(stream_until_disconnect(http_request, event_generator(), on_cancel=None),
+                             media_type="text/event-stream", headers=SSE_HEADERS)
@@ -1,5 +1,6 @@
-from fastapi import APIRouter, status
-from src.schemas.common import HealthCheck
+from fastapi import APIRouter, Response, status
+from src.schemas.common import HealthCheck, ReadinessResponse
+from src.services.readiness import readiness_prober
 
 router = APIRouter()
 
@@ -14,3 +15,22 @@ router = APIRouter()
 )
 def get_health_status() -> HealthCheck:
     return HealthCheck(status="OK")
+
+
+@router.get(
+    "/ready",
+    tags=["healthcheck"],
+    summary="Perform a Readiness Check",
+    response_description="Return HTTP Status Code 200 if ready, 503 otherwise",
+    response_model=ReadinessResponse,
+    responses={status.HTTP_503_SERVICE_UNAVAILABLE: {"model": ReadinessResponse}},
+)
+def get_readiness_status(response: Response) -> ReadinessResponse:
+    """Return the cached dependency probes; 503 while Denodo or the log database is down.
+
+    The probes run in the background, so this never opens a connection.
+    """
+    report = readiness_prober.report()
+    if not report.ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return report
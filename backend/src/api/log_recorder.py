@@ -1,91 +1,99 @@
 """
 API endpoints for logging and retrieving validated SQL-to-VQL query pairs.
 
-This module provides routes to log accepted queries and to retrieve those logs
-based on various filtering criteria, such as the tables they reference.
+This module provides routes to log accepted queries, to retrieve those logs
+page by page based on various filtering criteria, such as the tables they
+reference, to search them by full text, and to bulk import and export the
+whole log.
 """
 
-import json
+import asyncio
+import io
 import logging
-from typing import Any, Dict, List
+from typing import Any, List, Literal, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy import select, func, column, String
+from fastapi import APIRouter, File, HTTPException, Query, UploadFile
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from sqlalchemy.sql.selectable import LateralFromClause
-from sqlglot import exp, parse_one
 
 # Assuming these schemas are defined in the specified paths
 from src.schemas.db_log import (
     AcceptedQuery,
+    AcceptedQueryTable,
     AcceptedQueryLogListResponse,
     AcceptedQueryLogRequest,
+    AcceptedQuerySearchResponse,
+    LogImportReport,
 )
-from src.db.sqlite_session import get_sqlite_session
+from src.config import settings
+from src.db.sqlite_session import run_sqlite
+from src.services.log_store import export_accepted_queries, paginate_accepted_queries, search_accepted_queries
+from src.services.log_import import guess_import_format, import_accepted_queries
+from src.services.log_writer import LogWriterClosedError, accepted_query_writer
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
-@router.post("/log/accepted", status_code=201, tags=["Logging"])
-async def log_accepted_query(request: AcceptedQueryLogRequest,
-                             db: Session = Depends(get_sqlite_session)) -> dict[str, Any]:
-    """Log a successfully validated and accepted SQL-to-VQL pair.
+@router.post("/log/accepted", status_code=202, tags=["Logging"])
+async def log_accepted_query(request: AcceptedQueryLogRequest) -> dict[str, Any]:
+    """Queue a successfully validated and accepted SQL-to-VQL pair for logging.
 
-    This endpoint uses sqlglot to parse the source SQL, extracts the table
-    names, and stores the entire entry in the database.
+    The entry is written in the background by the accepted query log writer,
+    which parses the source SQL for its tables and stores queued entries in
+    batched transactions. The response is sent before the entry is written.
 
     Args:
         request: The request body containing the source SQL, dialect, and target VQL.
-        db: The SQLAlchemy database session, injected as a dependency.
 
     Raises:
-        HTTPException: A 500 error if the database write operation fails.
+        HTTPException: A 503 error if the log writer is not running or its queue is full.
 
     Returns:
-        A confirmation message and the ID of the newly created log entry.
+        A confirmation message and the number of entries waiting to be written.
     """
     try:
-        source_tables = json.dumps([table.name for table in parse_one(request.source_sql).find_all(exp.Table)])
-
-        db_log_entry = AcceptedQuery(
-            source_sql=request.source_sql,
-            source_dialect=request.source_dialect,
-            target_vql=request.target_vql,
-            tables=source_tables
-        )
-        db.add(db_log_entry)
-        db.commit()
-        db.refresh(db_log_entry)
-        logger.info(f"Successfully logged accepted query ID: {db_log_entry.id}")
-        return {"message": "Log entry created successfully.", "id": db_log_entry.id}
-    except Exception as e:
-        logger.error(f"Failed to log accepted query: {e}", exc_info=True)
-        db.rollback()
-        raise HTTPException(status_code=500, detail=f"Failed to write log to database: {str(e)}")
+        queued = accepted_query_writer.enqueue(request)
+    except (LogWriterClosedError, asyncio.QueueFull) as e:
+        logger.error(f"Failed to queue accepted query for logging: {e}")
+        raise HTTPException(status_code=503, detail="The query log is currently not accepting entries.")
+    return {"message": "Log entry queued.", "queued": queued}
 
 
 @router.get("/log/all", response_model=AcceptedQueryLogListResponse, tags=["Logging"])
-async def get_all_logs(db: Session = Depends(get_sqlite_session)) -> AcceptedQueryLogListResponse:
-    """Retrieve all accepted query logs from the database.
-    The logs are ordered by timestamp, with the most recent entries first.
+async def get_all_logs(
+    cursor: Optional[str] = Query(None, description="The `next_cursor` of the previous page."),
+    limit: int = Query(settings.LOG_PAGE_SIZE, ge=1, le=settings.LOG_MAX_PAGE_SIZE, description="The page size."),
+) -> AcceptedQueryLogListResponse:
+    """Retrieve accepted query logs page by page, most recent entries first.
+
+    Pages are addressed with a (timestamp, id) keyset cursor, so reading deep
+    into the log does not scan the skipped entries. Use `/log/export` to
+    download the whole log. The query runs on the SQLite thread pool to keep
+    the event loop free.
 
     Args:
-        db: The SQLAlchemy database session, injected as a dependency.
+        cursor: The `next_cursor` of the previous page, or None for the first page.
+        limit: The maximum number of entries in the page.
 
     Raises:
-        HTTPException: A 500 error if the database read operation fails.
+        HTTPException: 400 if the cursor is malformed.
+        HTTPException: 500 if the database read operation fails.
 
     Returns:
-        A response object containing a list of all log entries.
+        A response object containing the page of log entries and the next cursor.
     """
+    def read_logs(db: Session) -> AcceptedQueryLogListResponse:
+        logs, next_cursor = paginate_accepted_queries(db.query(AcceptedQuery), cursor, limit)
+        return AcceptedQueryLogListResponse(results=logs, next_cursor=next_cursor)
+
     try:
-        logs: List[AcceptedQuery] = db.query(AcceptedQuery).order_by(AcceptedQuery.timestamp.desc()).all()
-        return AcceptedQueryLogListResponse(results=logs)
+        return await run_sqlite(read_logs)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Failed to fetch all logs: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to retrieve logs from the database.")
-    finally:
-        db.close()
 
 
 @router.get("/log/filter", response_model=AcceptedQueryLogListResponse, tags=["Logging"])
@@ -95,59 +103,139 @@ async def get_logs_by_tables(
         description="A list of table names to filter by.",
         example=["customers", "orders"],
     ),
-    db: Session = Depends(get_sqlite_session),
+    cursor: Optional[str] = Query(None, description="The `next_cursor` of the previous page."),
+    limit: int = Query(10, ge=1, le=settings.LOG_MAX_PAGE_SIZE, description="The page size."),
 ) -> AcceptedQueryLogListResponse:
-    """Retrieve logs by tables using a correctly formed lateral subquery.
+    """Retrieve the most recent logs that reference any of the given tables.
 
-    This function filters records where the 'tables' JSON array contains any of
-    the specified table names. It works by creating a LATERAL subquery that
-    unnests the JSON array for each row and checks for a match. This is the
-    idiomatic SQLAlchemy approach for this type of query against SQLite.
+    The lookup uses the indexed `accepted_query_tables` junction instead of
+    unnesting the JSON `tables` column of every row. Further pages are
+    fetched with the returned keyset cursor.
 
     Args:
         tables: A list of table names provided as query parameters.
-        db: The SQLAlchemy database session.
+        cursor: The `next_cursor` of the previous page, or None for the first page.
+        limit: The maximum number of entries in the page.
 
     Raises:
-        HTTPException: 400 if 'tables' is empty.
+        HTTPException: 400 if 'tables' is empty or the cursor is malformed.
         HTTPException: 500 if the database query fails.
 
     Returns:
-        A response object containing matching log entries.
+        A response object containing matching log entries and the next cursor.
     """
     if not tables:
         raise HTTPException(
             status_code=400, detail="The 'tables' query parameter cannot be empty."
         )
 
-    try:
-        # 1. Explicitly define the output columns of the `json_each` function.
-        #    We only need the 'value' column, which contains the table names.
-        json_table_def = func.json_each(AcceptedQuery.tables).table_valued(
-            column("value", String),
-            name="json_table"
-        )
-
-        # 2. Create the correlated EXISTS subquery.
-        #    Because we defined the columns, accessing `.c.value` now works
-        #    correctly and returns a Column object with the `.in_()` method.
-        subquery = (
-            select(1)
-            .where(json_table_def.c.value.in_(tables))
-        ).exists()
-
-        # 3. Apply the filter to the main query.
-        query = (
-            db.query(AcceptedQuery)
-            .filter(subquery)
-            .order_by(AcceptedQuery.timestamp.desc())
-            .limit(10)
-        )
+    def read_logs(db: Session) -> AcceptedQueryLogListResponse:
+        matching_ids = select(AcceptedQueryTable.query_id).where(AcceptedQueryTable.table_name.in_(tables))
+        query = db.query(AcceptedQuery).filter(AcceptedQuery.id.in_(matching_ids))
+        logs, next_cursor = paginate_accepted_queries(query, cursor, limit)
+        return AcceptedQueryLogListResponse(results=logs, next_cursor=next_cursor)
 
-        logs: List[AcceptedQuery] = query.all()
-        return AcceptedQueryLogListResponse(results=logs)
+    try:
+        return await run_sqlite(read_logs)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Failed to fetch logs by tables: {e}", exc_info=True)
         raise HTTPException(
             status_code=500, detail="Failed to retrieve logs from the database."
         )
+
+
+@router.get("/log/search", response_model=AcceptedQuerySearchResponse, tags=["Logging"])
+async def search_logs(
+    q: str = Query(..., min_length=1, description="Search terms, e.g. a column or function name. A trailing * searches by prefix."),
+    dialect: Optional[str] = Query(None, description="Only search entries of this source dialect."),
+    limit: int = Query(20, ge=1, le=settings.LOG_MAX_PAGE_SIZE, description="The maximum number of results."),
+) -> AcceptedQuerySearchResponse:
+    """Full-text search over the source SQL, target VQL and tables of the accepted queries.
+
+    Results must contain all search terms and are ranked by bm25 relevance,
+    with matches highlighted in `<mark>` tags in the returned snippets.
+
+    Args:
+        q: The search terms.
+        dialect: Only search entries of this source dialect, if given.
+        limit: The maximum number of results.
+
+    Raises:
+        HTTPException: 500 if the search fails.
+
+    Returns:
+        A response object containing the ranked matches.
+    """
+    try:
+        results = await run_sqlite(lambda db: search_accepted_queries(db, q, dialect, limit))
+        return AcceptedQuerySearchResponse(results=results)
+    except Exception as e:
+        logger.error(f"Failed to search logs for '{q}': {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to search logs in the database.")
+
+
+@router.post("/log/import", response_model=LogImportReport, tags=["Logging"])
+async def import_logs(
+    file: UploadFile = File(..., description="NDJSON or CSV file with source_sql, source_dialect and target_vql."),
+    format: Optional[Literal["ndjson", "csv"]] = Query(None, description="File format, guessed from the file name if omitted."),
+    dialect: Optional[str] = Query(None, description="Source dialect of records without a source_dialect field."),
+) -> LogImportReport:
+    """Bulk import known-good SQL-to-VQL pairs into the accepted query log.
+
+    The records are prepared across worker processes and written in large
+    transactions on a worker thread. Records that are incomplete or whose
+    source SQL cannot be parsed are rejected and listed in the report.
+
+    Args:
+        file: The uploaded NDJSON or CSV file.
+        format: Either "ndjson" or "csv"; guessed from the file name if omitted.
+        dialect: The source dialect of records without `source_dialect`.
+
+    Raises:
+        HTTPException: 500 if the import fails.
+
+    Returns:
+        The import report with counts, rows per second and the first rejects.
+    """
+    import_format = format or guess_import_format(file.filename)
+    stream = io.TextIOWrapper(file.file, encoding="utf-8", newline="")
+    try:
+        report = await asyncio.to_thread(import_accepted_queries, stream, import_format, dialect)
+    except Exception as e:
+        logger.error(f"Failed to import logs from '{file.filename}': {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Failed to import logs: {str(e)}")
+    finally:
+        stream.detach()
+    logger.info(f"Imported {report.total} records from '{file.filename}' "
+                f"at {report.rows_per_second} rows/s ({report.rejected} rejected).")
+    return report
+
+
+_EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+@router.get("/log/export", tags=["Logging"])
+def export_logs(
+    format: Literal["ndjson", "csv"] = Query("ndjson", description="The export file format."),
+    dialect: Optional[str] = Query(None, description="Only export entries of this source dialect."),
+) -> StreamingResponse:
+    """Stream the whole accepted query log as NDJSON or CSV, oldest entries first.
+
+    The rows are streamed from a database cursor as they are read, without
+    loading the log into memory. The export generator is synchronous, so it
+    is iterated on a worker thread rather than on the event loop.
+
+    Args:
+        format: Either "ndjson" (one JSON object per line) or "csv".
+        dialect: Only export entries of this source dialect, if given.
+
+    Returns:
+        A streaming response with the export file as an attachment.
+    """
+    return StreamingResponse(
+        export_accepted_queries(format, dialect),
+        media_type=_EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="vqlforge_log.{format}"'},
+    )
@@ -0,0 +1,11 @@
+from fastapi import APIRouter
+from src.schemas.common import MetricsResponse
+from src.utils.metrics import metrics
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_model=MetricsResponse, tags=["healthcheck"])
+def get_metrics() -> MetricsResponse:
+    """Return the in-process counters, gauges and timings of this worker."""
+    return MetricsResponse(**metrics.snapshot())
@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from src.api import health, translate, validate, vdb_list, forge, log_recorder
+from src.api import health, translate, validate, vdb_list, forge, log_recorder, metrics
 
 api_router = APIRouter()
 api_router.include_router(health.router)  # /health
@@ -8,3 +8,4 @@ api_router.include_router(validate.router)  # /validate
 api_router.include_router(vdb_list.router)  # /vdbs
 api_router.include_router(forge.router)  # /forge
 api_router.include_router(log_recorder.router)  # /log
+api_router.include_router(metrics.router)  # /metrics
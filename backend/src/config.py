@@ -16,13 +16,93 @@ class Settings(BaseSettings):
     AI_MODEL_NAME: str
 
     DATABASE_URL: str | None = None
+    # maximum concurrent statements sent to Denodo; further work waits and can be abandoned
+    DENODO_MAX_CONCURRENCY: int = 8
+    DENODO_CANCEL_TIMEOUT_SECONDS: float = 5.0  # how long a cancelled request waits for the server-side cancel
+    # seconds before the first retry of a failed Denodo connection at startup, doubled up to the maximum
+    DENODO_CONNECT_RETRY_SECONDS: float = 2.0
+    DENODO_CONNECT_MAX_RETRY_SECONDS: float = 60.0
+    # background probes of Denodo, SQLite and the LLM provider behind /ready
+    READINESS_PROBE_INTERVAL_SECONDS: float = 10.0
+    READINESS_PROBE_TIMEOUT_SECONDS: float = 5.0
+    READINESS_REQUIRE_LLM: bool = False  # an unreachable LLM provider makes the service unready
     APP_VDB_CONF: str
 
     # agentic loop limit
     AGENTIC_MAX_LOOPS: int = 3
+    # candidate corrections requested per forge loop and validated concurrently; 1 is the serial loop
+    AGENTIC_CANDIDATES: int = 1
+    AGENTIC_MAX_CANDIDATES: int = 5
+    # seconds between checks whether a forge client has disconnected
+    FORGE_DISCONNECT_POLL_SECONDS: float = 1.0
+    # seconds without a message after which an SSE stream sends a heartbeat comment
+    SSE_HEARTBEAT_SECONDS: float = 15.0
+    # async workers executing queued forge jobs (POST /forge/jobs); 0 disables job execution
+    FORGE_JOB_WORKERS: int = 2
+    FORGE_JOB_POLL_SECONDS: float = 5.0  # idle workers and attached clients re-check the job table
+    # seconds a running job stays leased to its process without a renewal; expired jobs are queued again
+    FORGE_JOB_LEASE_SECONDS: float = 60.0
+    FORGE_JOB_MAX_ATTEMPTS: int = 3  # a job interrupted this often is failed instead of queued again
+    FORGE_JOB_RETENTION_DAYS: int = 7  # days finished jobs and their events are kept; 0 keeps them forever
+    # items of a POST /forge/batch request forged at the same time, and the maximum batch size
+    FORGE_BATCH_CONCURRENCY: int = 4
+    FORGE_BATCH_MAX_ITEMS: int = 500
+    # seconds a memoized forge step (translate, validate/correct, explain) is replayed; 0 disables memoization
+    FORGE_STEP_CACHE_TTL_SECONDS: int = 86400
+    # days forge run traces are kept for /forge/stats; 0 keeps them forever
+    FORGE_RUN_RETENTION_DAYS: int = 90
+    FORGE_STATS_WINDOW_DAYS: int = 30  # default time window of /forge/stats
+    # add an AI explanation on top of the deterministic VQL diff
+    AI_EXPLANATION_ENRICHMENT: bool = False
+    # approximate token budget per AI tool result
+    AI_TOOL_TOKEN_BUDGET: int = 2000
+    # try deterministic fix rules before asking the AI to analyze a validation error
+    AUTOFIX_ENABLED: bool = True
+
+    # LLM request scheduling per provider, a rate limit of 0 disables it
+    LLM_MAX_CONCURRENCY: int = 4
+    LLM_RPM_LIMIT: int = 60
+    LLM_TPM_LIMIT: int = 100000
+    LLM_RESPONSE_TOKEN_ALLOWANCE: int = 1000
+    LLM_MAX_RETRIES: int = 3
+    LLM_RETRY_BASE_DELAY: float = 2.0
+    # LLM token budgets, 0 disables a limit. Once one is used up, AI error analyses and
+    # explanations are skipped, which also ends the forge correction loop early.
+    LLM_REQUEST_TOKEN_BUDGET: int = 0  # per HTTP request, and per forge run or batch item
+    LLM_DAILY_TOKEN_BUDGET: int = 0  # per worker process and UTC day
 
     # SQLite logging database
     SQLITE_DB_PATH: str = "/data/vqlforge_log.db"
+    SQLITE_SYNCHRONOUS: str = "NORMAL"  # safe with WAL, one fsync per checkpoint instead of per commit
+    SQLITE_CACHE_SIZE_KB: int = 65536
+    SQLITE_MMAP_SIZE: int = 268435456
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    SQLITE_BUSY_RETRIES: int = 3
+    SQLITE_EXECUTOR_WORKERS: int = 4
+    LOG_WRITE_BATCH_SIZE: int = 100
+    LOG_WRITE_FLUSH_INTERVAL: float = 1.0  # seconds an accepted query may wait for its batch
+    LOG_WRITE_QUEUE_SIZE: int = 10000
+    LOG_PAGE_SIZE: int = 50
+    LOG_MAX_PAGE_SIZE: int = 500
+    LOG_IMPORT_BATCH_SIZE: int = 5000  # entries per bulk import transaction
+    LOG_IMPORT_WORKERS: int = 0  # processes preparing bulk imports, 0 uses all CPUs
+    LOG_IMPORT_MAX_WORKERS: int = 4  # upper bound of the bulk import processes, spawned per import
+    # Retention of accepted queries, by last use; 0 disables a limit
+    LOG_RETENTION_DAYS: int = 0
+    LOG_RETENTION_MAX_ROWS: int = 0
+    LOG_RETENTION_DIALECT_MAX_ROWS: dict[str, int] = {}  # e.g. {"oracle": 50000}
+    LOG_ARCHIVE_DIR: str = "/data/archive"
+    LOG_COMPACTION_INTERVAL_SECONDS: int = 3600  # 0 disables the background compaction job
+    LOG_COMPACTION_BATCH_SIZE: int = 5000  # rows per archive segment and delete transaction
+    # let the compaction convert a database created without incremental auto-vacuum (one-time full VACUUM
+    # that locks the database); otherwise run `python -m src.services.log_retention --convert-auto-vacuum`
+    LOG_CONVERT_AUTO_VACUUM: bool = False
+    # number of past translations the history tool returns
+    HISTORY_TOP_K: int = 10
+    # minimum estimated Jaccard similarity of a structurally similar past translation
+    HISTORY_MIN_SIMILARITY: float = 0.2
+    # days after which an accepted query's occurrences count half in history ranking
+    HISTORY_RECENCY_HALF_LIFE_DAYS: float = 30.0
 
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
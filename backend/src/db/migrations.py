@@ -0,0 +1,194 @@
+"""
+One-time data migrations for the SQLite logging database.
+
+`Base.metadata.create_all` creates missing tables and indexes, but it does
+not fill new tables from existing data. Each migration in `MIGRATIONS` runs
+exactly once per database file; applied migrations are recorded in the
+`schema_migrations` table.
+"""
+
+import datetime
+import logging
+from typing import Callable
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger(__name__)
+
+
+def _backfill_accepted_query_tables(connection: Connection) -> None:
+    """Fill the table junction from the JSON `tables` column of existing accepted queries."""
+    connection.execute(text("""
+        INSERT INTO accepted_query_tables (query_id, table_name, vdb)
+        SELECT accepted_queries.id, json_table.value, NULL
+        FROM accepted_queries, json_each(accepted_queries.tables) AS json_table
+        WHERE json_valid(accepted_queries.tables)
+          AND NOT EXISTS (
+              SELECT 1 FROM accepted_query_tables
+              WHERE accepted_query_tables.query_id = accepted_queries.id
+          )
+    """))
+
+
+def _index_accepted_queries_timestamp(connection: Connection) -> None:
+    """Add the (timestamp, id) index used for keyset pagination to existing databases."""
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_accepted_queries_timestamp_id ON accepted_queries (timestamp, id)"
+    ))
+
+
+def _create_accepted_queries_fts(connection: Connection) -> None:
+    """Create the FTS5 index over accepted queries, keep it in sync with triggers and fill it."""
+    connection.execute(text("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS accepted_queries_fts USING fts5(
+            source_sql, target_vql, tables,
+            content='accepted_queries', content_rowid='id'
+        )
+    """))
+    connection.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS accepted_queries_fts_insert AFTER INSERT ON accepted_queries BEGIN
+            INSERT INTO accepted_queries_fts (rowid, source_sql, target_vql, tables)
+            VALUES (new.id, new.source_sql, new.target_vql, new.tables);
+        END
+    """))
+    connection.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS accepted_queries_fts_delete AFTER DELETE ON accepted_queries BEGIN
+            INSERT INTO accepted_queries_fts (accepted_queries_fts, rowid, source_sql, target_vql, tables)
+            VALUES ('delete', old.id, old.source_sql, old.target_vql, old.tables);
+        END
+    """))
+    connection.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS accepted_queries_fts_update AFTER UPDATE ON accepted_queries BEGIN
+            INSERT INTO accepted_queries_fts (accepted_queries_fts, rowid, source_sql, target_vql, tables)
+            VALUES ('delete', old.id, old.source_sql, old.target_vql, old.tables);
+            INSERT INTO accepted_queries_fts (rowid, source_sql, target_vql, tables)
+            VALUES (new.id, new.source_sql, new.target_vql, new.tables);
+        END
+    """))
+    connection.execute(text("INSERT INTO accepted_queries_fts (accepted_queries_fts) VALUES ('rebuild')"))
+
+
+def _deduplicate_accepted_queries(connection: Connection) -> None:
+    """Add the dedup columns, fingerprint existing entries and merge duplicates into one row each.
+
+    The surviving row of a group of duplicates is the oldest one; it takes
+    the summed occurrence count and the latest `last_seen`. The deleted rows'
+    junction, signature and full-text entries go with them via cascades and triggers.
+    """
+    from src.utils.query_similarity import accepted_query_fingerprint
+
+    # Only content changes need a reindex; occurrence bumps must not rewrite the FTS entry.
+    connection.execute(text("DROP TRIGGER IF EXISTS accepted_queries_fts_update"))
+    connection.execute(text("""
+        CREATE TRIGGER accepted_queries_fts_update
+        AFTER UPDATE OF source_sql, target_vql, tables ON accepted_queries BEGIN
+            INSERT INTO accepted_queries_fts (accepted_queries_fts, rowid, source_sql, target_vql, tables)
+            VALUES ('delete', old.id, old.source_sql, old.target_vql, old.tables);
+            INSERT INTO accepted_queries_fts (rowid, source_sql, target_vql, tables)
+            VALUES (new.id, new.source_sql, new.target_vql, new.tables);
+        END
+    """))
+
+    columns = {row[1] for row in connection.execute(text("PRAGMA table_info(accepted_queries)"))}
+    if "content_hash" not in columns:
+        connection.execute(text("ALTER TABLE accepted_queries ADD COLUMN content_hash VARCHAR"))
+    if "occurrence_count" not in columns:
+        connection.execute(text("ALTER TABLE accepted_queries ADD COLUMN occurrence_count INTEGER NOT NULL DEFAULT 1"))
+    if "last_seen" not in columns:
+        connection.execute(text("ALTER TABLE accepted_queries ADD COLUMN last_seen DATETIME"))
+    connection.execute(text("UPDATE accepted_queries SET last_seen = timestamp WHERE last_seen IS NULL"))
+
+    rows = connection.execute(text(
+        "SELECT id, source_dialect, source_sql, target_vql FROM accepted_queries WHERE content_hash IS NULL"
+    )).all()
+    if rows:
+        connection.execute(
+            text("UPDATE accepted_queries SET content_hash = :content_hash WHERE id = :id"),
+            [{"id": row.id, "content_hash": accepted_query_fingerprint(
+                row.source_dialect or "", row.source_sql or "", row.target_vql or "")} for row in rows],
+        )
+
+    connection.execute(text("""
+        UPDATE accepted_queries SET
+            occurrence_count = (SELECT SUM(duplicate.occurrence_count) FROM accepted_queries AS duplicate
+                                WHERE duplicate.content_hash = accepted_queries.content_hash),
+            last_seen = (SELECT MAX(duplicate.last_seen) FROM accepted_queries AS duplicate
+                         WHERE duplicate.content_hash = accepted_queries.content_hash)
+        WHERE id IN (SELECT MIN(id) FROM accepted_queries GROUP BY content_hash HAVING COUNT(*) > 1)
+    """))
+    deleted = connection.execute(text(
+        "DELETE FROM accepted_queries WHERE id NOT IN (SELECT MIN(id) FROM accepted_queries GROUP BY content_hash)"
+    )).rowcount
+    connection.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_accepted_queries_content_hash ON accepted_queries (content_hash)"
+    ))
+    logger.info(f"Merged {deleted} duplicate accepted queries.")
+
+
+def _index_accepted_queries_last_seen(connection: Connection) -> None:
+    """Add the indexes used by the retention policies to select the least recently used entries."""
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_accepted_queries_last_seen ON accepted_queries (last_seen)"
+    ))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_accepted_queries_dialect_last_seen ON accepted_queries (source_dialect, last_seen)"
+    ))
+
+
+def _add_forge_run_usage_columns(connection: Connection) -> None:
+    """Add the LLM usage columns to forge run traces stored before they were accounted."""
+    run_columns = {row[1] for row in connection.execute(text("PRAGMA table_info(forge_runs)"))}
+    for column in ("request_tokens", "response_tokens", "tool_calls"):
+        if column not in run_columns:
+            connection.execute(text(f"ALTER TABLE forge_runs ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0"))
+    if "budget_exhausted" not in run_columns:
+        connection.execute(text("ALTER TABLE forge_runs ADD COLUMN budget_exhausted BOOLEAN NOT NULL DEFAULT 0"))
+    step_columns = {row[1] for row in connection.execute(text("PRAGMA table_info(forge_run_steps)"))}
+    if "tokens" not in step_columns:
+        connection.execute(text("ALTER TABLE forge_run_steps ADD COLUMN tokens INTEGER NOT NULL DEFAULT 0"))
+
+
+def _add_forge_job_leases(connection: Connection) -> None:
+    """Add the lease columns to forge jobs stored before jobs were leased."""
+    columns = {row[1] for row in connection.execute(text("PRAGMA table_info(forge_jobs)"))}
+    if "owner" not in columns:
+        connection.execute(text("ALTER TABLE forge_jobs ADD COLUMN owner VARCHAR"))
+    if "lease_expires_at" not in columns:
+        connection.execute(text("ALTER TABLE forge_jobs ADD COLUMN lease_expires_at DATETIME"))
+
+
+MIGRATIONS: list[tuple[str, Callable[[Connection], None]]] = [
+    ("0001_backfill_accepted_query_tables", _backfill_accepted_query_tables),
+    ("0002_index_accepted_queries_timestamp", _index_accepted_queries_timestamp),
+    ("0003_create_accepted_queries_fts", _create_accepted_queries_fts),
+    ("0004_deduplicate_accepted_queries", _deduplicate_accepted_queries),
+    ("0005_index_accepted_queries_last_seen", _index_accepted_queries_last_seen),
+    ("0006_add_forge_run_usage_columns", _add_forge_run_usage_columns),
+    ("0007_add_forge_job_leases", _add_forge_job_leases),
+]
+
+
+def run_migrations(engine: Engine) -> None:
+    """Apply all migrations that have not been applied to the database yet.
+
+    Each migration runs in its own transaction together with its entry in
+    `schema_migrations`, so a failed migration is retried on the next start.
+    """
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations (name TEXT PRIMARY KEY, applied_at TIMESTAMP NOT NULL)"
+        ))
+        applied: set[str] = {row[0] for row in connection.execute(text("SELECT name FROM schema_migrations"))}
+
+    for name, migration in MIGRATIONS:
+        if name in applied:
+            continue
+        logger.info(f"Applying SQLite migration '{name}'...")
+        with engine.begin() as connection:
+            migration(connection)
+            connection.execute(
+                text("INSERT INTO schema_migrations (name, applied_at) VALUES (:name, :applied_at)"),
+                {"name": name, "applied_at": datetime.datetime.utcnow()},
+            )
+        logger.info(f"Applied SQLite migration '{name}'.")
@@ -4,17 +4,36 @@ Database engine management for the application.
 This module is responsible for creating, managing, and providing access to the
 global SQLAlchemy engine that connects to the Denodo database. It includes
 functions for initialization and retrieval of the engine instance.
+
+At application startup the engine is created by `denodo_connector` in a
+background task, so a slow or unreachable Denodo server does not delay the
+start. The connector retries with exponential backoff until it succeeds;
+until then, Denodo-backed endpoints answer 503.
+
+Async code runs its Denodo statements through `run_denodo`, which limits the
+number of concurrent statements. Work still waiting for a slot is abandoned
+when its caller is cancelled, e.g. because the client disconnected, and a
+statement that is already running is cancelled on the server.
 """
 
+import asyncio
+import datetime
 import logging
+import time
+from typing import Any, Callable, Optional, TypeVar
+
 import sqlalchemy as db
-from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.engine import Engine
+from sqlalchemy.exc import NoSuchModuleError, SQLAlchemyError
+from sqlalchemy.engine import Connection, Engine
 
 from src.config import settings
+from src.utils.metrics import metrics
 
 logger = logging.getLogger(__name__)
 engine: Engine | None = None
+_denodo_semaphore: asyncio.Semaphore | None = None
+
+T = TypeVar("T")
 
 
 def init_db_engine() -> Engine | None:
@@ -37,9 +56,7 @@ def init_db_engine() -> Engine | None:
         logger.fatal("DATABASE_URL is not configured.")
         return None
     try:
-        engine = db.create_engine(settings.DATABASE_URL)
-        with engine.connect():
-            logger.info("Successfully connected to Denodo.")
+        engine = _connect_db_engine()
         return engine
     except ImportError as e:
         logger.fatal(f"Could not import Denodo driver. Make sure it's installed. ImportError: {e}")
@@ -51,6 +68,94 @@ def init_db_engine() -> Engine | None:
         return None
 
 
+def _connect_db_engine() -> Engine:
+    """Create an engine for `DATABASE_URL` and check that it connects; raises if it does not."""
+    new_engine = db.create_engine(settings.DATABASE_URL)
+    try:
+        with new_engine.connect():
+            logger.info("Successfully connected to Denodo.")
+    except BaseException:
+        new_engine.dispose()
+        raise
+    return new_engine
+
+
+def dispose_db_engine() -> None:
+    """Close the pooled connections of the global engine, if there is one."""
+    global engine
+    if engine is not None:
+        engine.dispose()
+        engine = None
+        logger.info("Denodo DB engine disposed.")
+
+
+class DenodoConnector:
+    """Creates the global engine in a background task, retrying until Denodo is reachable."""
+
+    def __init__(self, retry_seconds: float, max_retry_seconds: float) -> None:
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self.attempts = 0
+        self.last_error: Optional[str] = None
+        self.connected_at: Optional[datetime.datetime] = None
+        self._task: asyncio.Task | None = None
+
+    @property
+    def connected(self) -> bool:
+        return engine is not None
+
+    def status(self) -> dict[str, Any]:
+        """Return whether the engine is connected, the connection attempts and the last error."""
+        return {"connected": self.connected, "attempts": self.attempts, "last_error": self.last_error,
+                "connected_at": self.connected_at}
+
+    def start(self) -> None:
+        """Start connecting on the running event loop, unless connected or connecting already."""
+        if self.connected or (self._task is not None and not self._task.done()):
+            return
+        if settings.DATABASE_URL is None:
+            logger.fatal("DATABASE_URL is not configured.")
+            return
+        self._task = asyncio.create_task(self._connect(), name="denodo-connector")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _connect(self) -> None:
+        global engine
+        delay = self.retry_seconds
+        metrics.set_gauge("denodo.connected", 0)
+        while True:
+            self.attempts += 1
+            metrics.increment("denodo.connect_attempts")
+            try:
+                engine = await asyncio.to_thread(_connect_db_engine)
+            except (ImportError, NoSuchModuleError) as e:
+                # Retrying cannot help without the driver or its SQLAlchemy dialect.
+                self.last_error = str(e)
+                logger.fatal(f"Could not load the Denodo driver. Make sure it's installed: {e}")
+                return
+            except Exception as e:
+                # Connection errors, but also anything unexpected: the connector must not stop silently.
+                self.last_error = str(e) or type(e).__name__
+                if isinstance(e, SQLAlchemyError):
+                    logger.error(f"Could not connect to Denodo (attempt {self.attempts}), retrying in {delay:.0f}s: {e}")
+                else:
+                    logger.error(f"Unexpected error connecting to Denodo (attempt {self.attempts}), "
+                                 f"retrying in {delay:.0f}s: {e}", exc_info=True)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_seconds)
+                continue
+            self.last_error = None
+            self.connected_at = datetime.datetime.utcnow()
+            metrics.set_gauge("denodo.connected", 1)
+            logger.info(f"Denodo DB engine initialized after {self.attempts} connection attempts.")
+            return
+
+
 def get_engine() -> Engine:
     """Retrieve the initialized SQLAlchemy database engine.
 
@@ -68,3 +173,87 @@ def get_engine() -> Engine:
     if engine is None:
         raise ConnectionError("Database engine is not initialized.")
     return engine
+
+
+def _get_denodo_semaphore() -> asyncio.Semaphore:
+    global _denodo_semaphore
+    if _denodo_semaphore is None:
+        _denodo_semaphore = asyncio.Semaphore(settings.DENODO_MAX_CONCURRENCY)
+    return _denodo_semaphore
+
+
+def _cancel_statement(dbapi_connection) -> None:
+    """Ask the server to cancel the statement running on a DBAPI connection, if the driver supports it."""
+    cancel = getattr(dbapi_connection, "cancel", None)
+    if cancel is None:
+        return
+    try:
+        cancel()
+    except Exception as e:
+        logger.warning(f"Could not cancel the running Denodo statement: {e}")
+
+
+async def run_denodo(work: Callable[[Connection], T]) -> T:
+    """Run a unit of work on a Denodo connection in a worker thread, limited by `DENODO_MAX_CONCURRENCY`.
+
+    If the caller is cancelled while the work waits for a slot, the work is
+    abandoned without touching Denodo. If it is cancelled while the work
+    runs, the statement is cancelled on the server, from a worker thread and
+    for at most `DENODO_CANCEL_TIMEOUT_SECONDS` since the driver call blocks,
+    and the slot is released once the worker thread has finished.
+
+    Args:
+        work: Receives the connection and executes the statements.
+
+    Returns:
+        The return value of `work`.
+
+    Raises:
+        ConnectionError: If the database engine has not been initialized.
+    """
+    denodo_engine = get_engine()
+    semaphore = _get_denodo_semaphore()
+    queued_at = time.monotonic()
+    try:
+        await semaphore.acquire()
+    except asyncio.CancelledError:
+        metrics.increment("denodo.abandoned")
+        raise
+    metrics.observe("denodo.wait_seconds", time.monotonic() - queued_at)
+
+    dbapi_connections: list = []
+
+    def call() -> T:
+        with denodo_engine.connect() as connection:
+            dbapi_connections.append(connection.connection.driver_connection)
+            return work(connection)
+
+    started = time.monotonic()
+    future = asyncio.get_running_loop().run_in_executor(None, call)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        metrics.increment("denodo.cancelled")
+
+        def release(finished: asyncio.Future) -> None:
+            if not finished.cancelled():
+                finished.exception()  # retrieved, so it is not reported as unhandled
+            metrics.observe("denodo.cancelled_statement_seconds", time.monotonic() - started)
+            semaphore.release()
+
+        future.add_done_callback(release)
+        future = None
+        if dbapi_connections:
+            try:
+                await asyncio.wait_for(asyncio.to_thread(_cancel_statement, dbapi_connections[0]),
+                                       timeout=settings.DENODO_CANCEL_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                logger.warning(f"The Denodo server did not confirm the cancel within "
+                               f"{settings.DENODO_CANCEL_TIMEOUT_SECONDS:g}s.")
+        raise
+    finally:
+        if future is not None:
+            semaphore.release()
+
+
+denodo_connector = DenodoConnector(settings.DENODO_CONNECT_RETRY_SECONDS, settings.DENODO_CONNECT_MAX_RETRY_SECONDS)
@@ -4,20 +4,84 @@ Manages the connection and session for the application's SQLite database.
 This module is responsible for initializing the SQLite database engine, ensuring
 the database file and necessary tables exist, and providing a mechanism for
 FastAPI endpoints to acquire a database session for logging purposes.
+
+The engine runs in WAL journal mode with tuned pragmas, so history reads from
+the agent tools do not block on concurrent log writes, and a single session
+factory is shared by the whole application. Async code runs its SQLite work
+through `run_sqlite`, which executes it on a dedicated thread pool so that
+slow disk I/O never blocks the event loop.
 """
 
+import asyncio
 import logging
-import os  # <-- Import the os module
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Iterator, TypeVar
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.engine import Engine
-from sqlalchemy.orm.session import Session
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker, Session
 from src.config import settings
 from src.schemas.db_log import Base
+from src.db.migrations import run_migrations
 
 logger = logging.getLogger(__name__)
 
 sqlite_engine: Engine | None = None
+SqliteSessionLocal: sessionmaker[Session] | None = None
+_sqlite_executor: ThreadPoolExecutor | None = None
+
+T = TypeVar("T")
+
+
+def sqlite_pragmas() -> dict[str, str | int]:
+    """Return the pragmas applied to every new SQLite connection, based on the settings."""
+    return {
+        # Only takes effect for new database files; see `log_retention` for converting existing ones.
+        "auto_vacuum": "INCREMENTAL",
+        "journal_mode": "WAL",
+        "synchronous": settings.SQLITE_SYNCHRONOUS,
+        "cache_size": -settings.SQLITE_CACHE_SIZE_KB,  # negative values are KiB, not pages
+        "mmap_size": settings.SQLITE_MMAP_SIZE,
+        "busy_timeout": settings.SQLITE_BUSY_TIMEOUT_MS,
+        "temp_store": "MEMORY",
+        "foreign_keys": "ON",
+    }
+
+
+def create_sqlite_engine(db_path: str, pragmas: dict[str, str | int]) -> Engine:
+    """Create a SQLite engine that applies the given pragmas on every new connection.
+
+    Args:
+        db_path: Path of the database file.
+        pragmas: Pragma names and values, e.g. from `sqlite_pragmas()`.
+
+    Returns:
+        The configured SQLAlchemy engine.
+    """
+    busy_timeout_ms = int(pragmas.get("busy_timeout", 5000))
+    engine = create_engine(
+        f"sqlite:///{db_path}",
+        connect_args={
+            "check_same_thread": False,  # Required for SQLite with FastAPI
+            "timeout": busy_timeout_ms / 1000,
+        },
+    )
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+    return engine
 
 
 def init_sqlite_db() -> None:
@@ -26,16 +90,17 @@ def init_sqlite_db() -> None:
     This function performs the following setup actions:
     1. Reads the database file path from the application settings.
     2. Ensures the directory for the database file exists, creating it if necessary.
-    3. Creates a global SQLAlchemy engine for the SQLite database.
-    4. Sets `check_same_thread` to False, which is required for using SQLite in a
-       multi-threaded environment like FastAPI.
+    3. Creates a global SQLAlchemy engine for the SQLite database, which sets
+       WAL journal mode and the tuned pragmas on every new connection.
+    4. Creates the global session factory shared by all requests.
     5. Creates all tables defined in the SQLAlchemy declarative `Base` metadata.
+    6. Applies pending one-time data migrations.
 
     This function should be called once at application startup to prepare the
     database for use. If it fails, it logs a fatal error, and the engine will
     remain `None`.
     """
-    global sqlite_engine
+    global sqlite_engine, SqliteSessionLocal
     try:
         # ensure the directory exists
         db_path: str = settings.SQLITE_DB_PATH
@@ -44,38 +109,129 @@ def init_sqlite_db() -> None:
             os.makedirs(db_directory, exist_ok=True)
             logger.info(f"Ensured database directory exists at: {db_directory}")
 
-        sqlite_engine = create_engine(
-            f"sqlite:///{db_path}",
-            connect_args={"check_same_thread": False},  # Required for SQLite with FastAPI
-        )
+        sqlite_engine = create_sqlite_engine(db_path, sqlite_pragmas())
+        SqliteSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=sqlite_engine)
         # Create tables
         Base.metadata.create_all(bind=sqlite_engine)
+        run_migrations(sqlite_engine)
         logger.info(f"Successfully connected to SQLite DB at {db_path} and ensured tables exist.")
     except Exception as e:
         logger.fatal(f"Could not connect to or initialize SQLite database: {e}", exc_info=True)
         sqlite_engine = None
+        SqliteSessionLocal = None
+
+
+def new_sqlite_session() -> Session:
+    """Create a new session from the shared SQLite session factory.
+
+    The caller is responsible for closing the session; prefer
+    `sqlite_session_scope` or the `get_sqlite_session` dependency.
 
+    Raises:
+        ConnectionError: If the SQLite database engine has not been
+                         initialized before this function is called.
+    """
+    if SqliteSessionLocal is None:
+        raise ConnectionError("SQLite database engine is not initialized.")
+    return SqliteSessionLocal()
 
-def get_sqlite_session() -> Session:
-    """Create and return a new SQLAlchemy session for the SQLite database.
 
-    This function is intended to be used as a FastAPI dependency to provide
-    a database session to an API endpoint. It relies on the global `sqlite_engine`
-    having been successfully initialized by `init_sqlite_db`.
+def get_sqlite_session() -> Iterator[Session]:
+    """Provide a SQLite session to a FastAPI endpoint and always close it afterwards.
 
-    Note: This function creates and returns a new session. In a typical FastAPI
-    pattern, the endpoint that receives this session is responsible for closing it
-    (e.g., within a `finally` block) to prevent resource leaks. A generator-based
-    dependency (`yield session`) is often preferred for automatic session cleanup.
+    This function is intended to be used as a FastAPI dependency
+    (`Depends(get_sqlite_session)`). The session is closed once the response
+    has been sent, even if the endpoint raised an exception.
 
     Raises:
         ConnectionError: If the SQLite database engine has not been
                          initialized before this function is called.
 
+    Yields:
+        A SQLAlchemy `Session` connected to the SQLite database.
+    """
+    db = new_sqlite_session()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+@contextmanager
+def sqlite_session_scope() -> Iterator[Session]:
+    """Context manager variant of `get_sqlite_session` for use outside of endpoints."""
+    db = new_sqlite_session()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def _is_busy_error(error: OperationalError) -> bool:
+    message = str(error.orig).lower()
+    return "database is locked" in message or "database is busy" in message
+
+
+def run_with_busy_retry(work: Callable[[Session], T], retries: int | None = None) -> T:
+    """Run a unit of work in its own session and retry it when SQLite reports a lock.
+
+    The `busy_timeout` pragma already makes SQLite wait for locks; this is the
+    fallback for lock errors that SQLite does not wait for, e.g. when a read
+    transaction cannot be upgraded to a write transaction. The whole unit of
+    work is repeated in a fresh session with a jittered backoff.
+
+    Args:
+        work: Receives the session, performs the reads/writes and commits.
+        retries: Maximum number of retries, defaults to `SQLITE_BUSY_RETRIES`.
+
     Returns:
-        A new SQLAlchemy `Session` instance connected to the SQLite database.
+        The return value of `work`.
     """
-    if sqlite_engine is None:
-        raise ConnectionError("SQLite database engine is not initialized.")
-    SessionLocal: sessionmaker[Session] = sessionmaker(autocommit=False, autoflush=False, bind=sqlite_engine)
-    return SessionLocal()
+    retries = settings.SQLITE_BUSY_RETRIES if retries is None else retries
+    for attempt in range(retries + 1):
+        with sqlite_session_scope() as db:
+            try:
+                return work(db)
+            except OperationalError as e:
+                db.rollback()
+                if not _is_busy_error(e) or attempt >= retries:
+                    raise
+        delay = 0.05 * (2 ** attempt) * (1 + random.random())
+        logger.warning(f"SQLite database is locked, retrying in {delay:.2f}s (attempt {attempt + 1}/{retries}).")
+        time.sleep(delay)
+    raise RuntimeError("SQLite busy retry loop exited unexpectedly.")  # unreachable
+
+
+def _get_sqlite_executor() -> ThreadPoolExecutor:
+    global _sqlite_executor
+    if _sqlite_executor is None:
+        _sqlite_executor = ThreadPoolExecutor(
+            max_workers=settings.SQLITE_EXECUTOR_WORKERS, thread_name_prefix="sqlite"
+        )
+    return _sqlite_executor
+
+
+async def run_sqlite(work: Callable[[Session], T]) -> T:
+    """Run a unit of work on the dedicated SQLite thread pool without blocking the event loop.
+
+    The work receives its own session, which is closed afterwards, and is
+    retried on lock errors like `run_with_busy_retry`. ORM objects must be
+    converted (e.g. into Pydantic models) inside `work`, before the session
+    is closed.
+
+    Args:
+        work: Receives the session and performs the reads/writes.
+
+    Returns:
+        The return value of `work`.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_sqlite_executor(), run_with_busy_retry, work)
+
+
+def shutdown_sqlite_executor() -> None:
+    """Wait for pending SQLite work and stop the thread pool. Called at application shutdown."""
+    global _sqlite_executor
+    if _sqlite_executor is not None:
+        _sqlite_executor.shutdown(wait=True)
+        _sqlite_executor = None
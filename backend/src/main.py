@@ -1,19 +1,36 @@
 # src/main.py
 
+import asyncio
 import logging
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 
 from src.api.router import api_router
-from src.db.session import init_db_engine, engine
+from src.db.session import denodo_connector, dispose_db_engine
+from src.utils.llm_scheduler import LLMUsageMiddleware
 from src.utils.logging_config import setup_logging
-from src.db.sqlite_session import init_sqlite_db
+from src.db.sqlite_session import init_sqlite_db, run_sqlite, shutdown_sqlite_executor
+from src.services.forge_jobs import forge_job_workers
+from src.services.log_retention import log_compaction_job
+from src.services.log_writer import accepted_query_writer
+from src.services.readiness import readiness_prober
+from src.utils.query_similarity import backfill_similarity_index
 
 # Configure logging first
 setup_logging()
 logger = logging.getLogger(__name__)
 
 
+async def backfill_query_index() -> None:
+    """Add accepted queries logged before the similarity index existed to the index."""
+    try:
+        await run_sqlite(backfill_similarity_index)
+    except ConnectionError:
+        return
+    except Exception as e:
+        logger.error(f"Failed to backfill the query similarity index: {e}", exc_info=True)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # --- Startup Logic ---
@@ -21,22 +38,29 @@ async def lifespan(app: FastAPI):
 
     # Initialize SQLite DB and tables
     init_sqlite_db()
+    # Indexing a large legacy log can take a while; the service starts meanwhile.
+    backfill_task = asyncio.create_task(backfill_query_index(), name="similarity-index-backfill")
+    accepted_query_writer.start()
+    log_compaction_job.start()
+    await forge_job_workers.start()
 
-    # Initialize the Denodo database engine
-    if init_db_engine() is None:
-        logger.fatal("Application startup failed: Could not connect to the Denodo database.")
-        # The application will start but endpoints requiring the DB will fail.
-        # This prevents a hard crash on startup.
-    else:
-        logger.info("Denodo DB engine initialized successfully.")
+    # Connect to Denodo in the background; endpoints requiring the DB answer 503 until it is connected.
+    denodo_connector.start()
+    readiness_prober.start()
 
     yield
 
     # --- Shutdown Logic ---
     logger.info("Application shutdown...")
-    if engine:
-        engine.dispose()
-        logger.info("Denodo DB engine disposed.")
+    await readiness_prober.stop()
+    backfill_task.cancel()
+    await asyncio.gather(backfill_task, return_exceptions=True)
+    await denodo_connector.stop()
+    await forge_job_workers.stop()
+    await log_compaction_job.stop()
+    await accepted_query_writer.drain()
+    shutdown_sqlite_executor()
+    dispose_db_engine()
 
 
 app = FastAPI(
@@ -46,6 +70,9 @@ app = FastAPI(
     lifespan=lifespan  # Use the new lifespan manager
 )
 
+# Account the LLM usage of every request
+app.add_middleware(LLMUsageMiddleware)
+
 # Include the main API router
 app.include_router(api_router)
 
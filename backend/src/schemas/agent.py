@@ -1,4 +1,5 @@
-from typing import List, Optional
+import datetime
+from typing import List, Literal, Optional
 from pydantic import BaseModel, Field
 from src.schemas.translation import AIAnalysis
 
@@ -8,6 +9,11 @@ class AgenticModeRequest(BaseModel):
     dialect: str
     vdb: str
     vql: str
+    candidates: Optional[int] = Field(
+        None, ge=1, description="Candidate corrections validated concurrently per loop; defaults to AGENTIC_CANDIDATES.")
+    use_cache: bool = Field(True, description="Replay memoized steps of earlier runs with the same inputs.")
+    token_budget: Optional[int] = Field(
+        None, ge=1, description="LLM tokens the run may use; at most LLM_REQUEST_TOKEN_BUDGET if that is set.")
 
 
 class AgentStep(BaseModel):
@@ -15,6 +21,9 @@ class AgentStep(BaseModel):
     details: str
     success: bool
     output: Optional[str] = None
+    cached: bool = False  # replayed from a memoized run with the same inputs
+    error_category: Optional[str] = None  # why the step failed, if it did
+    tokens: int = 0  # LLM tokens used by the step
 
 
 class AgenticModeResponse(BaseModel):
@@ -23,3 +32,90 @@ class AgenticModeResponse(BaseModel):
     process_log: List[AgentStep]
     final_message: str
     error_analysis: Optional[AIAnalysis] = None
+
+
+ForgeJobStatus = Literal["queued", "running", "completed", "failed"]
+
+
+class ForgeJobCreatedResponse(BaseModel):
+    job_id: str
+    status: ForgeJobStatus
+    status_url: str  # poll for the job status
+    events_url: str  # attach to the SSE stream of the job's events
+
+
+class ForgeJobResponse(BaseModel):
+    job_id: str
+    status: ForgeJobStatus
+    attempts: int
+    created_at: datetime.datetime
+    started_at: Optional[datetime.datetime] = None
+    finished_at: Optional[datetime.datetime] = None
+    steps: List[AgentStep]  # latest state of each step so far
+    last_event_id: Optional[int] = None  # pass as `after` to attach to the events from here on
+    result: Optional[AgenticModeResponse] = None
+    error: Optional[str] = None
+
+
+class ForgeBatchItem(AgenticModeRequest):
+    id: Optional[str] = Field(None, description="Tags the item's events; defaults to its position in the batch.")
+    vql: str = ""
+
+
+class ForgeBatchRequest(BaseModel):
+    items: List[ForgeBatchItem] = Field(..., min_length=1)
+    concurrency: Optional[int] = Field(
+        None, ge=1, description="Items forged at the same time; defaults to FORGE_BATCH_CONCURRENCY.")
+
+
+class ForgeBatchItemSummary(BaseModel):
+    item_id: str
+    is_valid: bool
+    loops: int  # validation loops used
+    error: Optional[str] = None
+
+
+class ForgeBatchSummary(BaseModel):
+    total: int
+    valid: int
+    invalid: int
+    failed: int  # items that ended with an error instead of a result
+    loops_used: int
+    seconds: float
+    items: List[ForgeBatchItemSummary]
+
+
+class ForgePercentiles(BaseModel):
+    mean: float
+    p50: float
+    p95: float
+    p99: float
+
+
+class ForgeStatsGroup(BaseModel):
+    key: str  # the dialect or VDB, "all" for the overall group
+    runs: int
+    convergence_rate: float  # share of runs that ended with valid VQL
+    outcomes: dict[str, int]
+    loops: ForgePercentiles
+    seconds: ForgePercentiles
+    tokens: ForgePercentiles
+    tool_calls: ForgePercentiles
+    budget_exhausted_rate: float  # share of runs that used up their LLM token budget
+    error_categories: dict[str, int]  # most frequent first
+
+
+class ForgeStepStats(BaseModel):
+    step: str  # e.g. "Validate" for all validation loops
+    count: int
+    cached_rate: float
+    seconds: ForgePercentiles
+    tokens: ForgePercentiles
+
+
+class ForgeStatsResponse(BaseModel):
+    since: datetime.datetime
+    overall: ForgeStatsGroup
+    by_dialect: List[ForgeStatsGroup]
+    by_vdb: List[ForgeStatsGroup]
+    steps: List[ForgeStepStats]
@@ -1,4 +1,5 @@
-from typing import List, Dict, Any
+import datetime
+from typing import List, Dict, Any, Optional
 from pydantic import BaseModel, Field
 
 
@@ -6,6 +7,20 @@ class HealthCheck(BaseModel):
     status: str = "OK"
 
 
+class DependencyStatus(BaseModel):
+    name: str  # denodo, sqlite or llm
+    ok: bool
+    critical: bool  # whether the service is unready while this dependency is down
+    detail: Optional[str] = None  # why the probe failed
+    latency_ms: Optional[float] = None
+    checked_at: Optional[datetime.datetime] = None
+
+
+class ReadinessResponse(BaseModel):
+    ready: bool
+    checks: List[DependencyStatus]
+
+
 class QueryResultRow(BaseModel):
     row: Dict[str, Any]
 
@@ -27,3 +42,9 @@ class VDBResponseItem(BaseModel):
 
 class VDBResponse(BaseModel):
     results: List[VDBResponseItem]
+
+
+class MetricsResponse(BaseModel):
+    counters: Dict[str, float]
+    gauges: Dict[str, float]
+    timings: Dict[str, Dict[str, float]]
@@ -1,8 +1,8 @@
 from pydantic import BaseModel, Field, ConfigDict
-from sqlalchemy import Column, Integer, String, Text, DateTime
+from sqlalchemy import Boolean, Column, Float, Integer, String, Text, DateTime, LargeBinary, ForeignKey, Index
 from sqlalchemy.orm import declarative_base
 import datetime
-from typing import List
+from typing import List, Optional
 
 # SQLAlchemy ORM Model
 Base = declarative_base()
@@ -10,6 +10,12 @@ Base = declarative_base()
 
 class AcceptedQuery(Base):
     __tablename__ = "accepted_queries"
+    __table_args__ = (
+        Index("ix_accepted_queries_timestamp_id", "timestamp", "id"),
+        Index("ux_accepted_queries_content_hash", "content_hash", unique=True),
+        Index("ix_accepted_queries_dialect_last_seen", "source_dialect", "last_seen"),
+        Index("ix_accepted_queries_last_seen", "last_seen"),
+    )
 
     id: Column[int] = Column(Integer, primary_key=True, index=True)
     timestamp: Column[datetime.datetime] = Column(DateTime, default=datetime.datetime.utcnow)
@@ -17,6 +23,119 @@ class AcceptedQuery(Base):
     source_sql: Column[str] = Column(Text)
     target_vql: Column[str] = Column(Text)
     tables: Column[str] = Column(Text)
+    # Fingerprint of dialect, source SQL AST and target VQL; repeated acceptances update the existing row.
+    content_hash: Column[str] = Column(String)
+    occurrence_count: Column[int] = Column(Integer, nullable=False, default=1)
+    last_seen: Column[datetime.datetime] = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+class AcceptedQueryTable(Base):
+    """A table referenced by an accepted query, normalized out of the JSON `tables` column for indexed lookups."""
+    __tablename__ = "accepted_query_tables"
+    __table_args__ = (
+        Index("ix_accepted_query_tables_table_vdb", "table_name", "vdb", "query_id"),
+        Index("ix_accepted_query_tables_query", "query_id", "table_name"),
+    )
+
+    id: Column[int] = Column(Integer, primary_key=True)
+    query_id: Column[int] = Column(Integer, ForeignKey("accepted_queries.id", ondelete="CASCADE"), nullable=False)
+    table_name: Column[str] = Column(String, nullable=False)
+    vdb: Column[str] = Column(String, nullable=True)
+
+
+class QuerySignature(Base):
+    """MinHash signature of an accepted query's source SQL AST."""
+    __tablename__ = "query_signatures"
+
+    query_id: Column[int] = Column(Integer, ForeignKey("accepted_queries.id", ondelete="CASCADE"), primary_key=True)
+    signature: Column[bytes] = Column(LargeBinary, nullable=False)
+
+
+class QueryLshBucket(Base):
+    """LSH band bucket of a query signature, used to find similar queries via an index lookup."""
+    __tablename__ = "query_lsh_buckets"
+    __table_args__ = (Index("ix_query_lsh_buckets_band_bucket", "band", "bucket", "query_id"),)
+
+    id: Column[int] = Column(Integer, primary_key=True)
+    query_id: Column[int] = Column(Integer, ForeignKey("accepted_queries.id", ondelete="CASCADE"), nullable=False, index=True)
+    band: Column[int] = Column(Integer, nullable=False)
+    bucket: Column[int] = Column(Integer, nullable=False)
+
+
+class ForgeJob(Base):
+    """A forge run queued through `POST /forge/jobs` and executed by the job workers."""
+    __tablename__ = "forge_jobs"
+    __table_args__ = (Index("ix_forge_jobs_status_created_at", "status", "created_at"),)
+
+    id: Column[str] = Column(String, primary_key=True)
+    status: Column[str] = Column(String, nullable=False, default="queued")
+    request: Column[str] = Column(Text, nullable=False)  # the AgenticModeRequest as JSON
+    result: Column[str] = Column(Text, nullable=True)  # payload of the final result or error event as JSON
+    attempts: Column[int] = Column(Integer, nullable=False, default=0)
+    owner: Column[str] = Column(String, nullable=True)  # the worker pool holding the lease of a running job
+    lease_expires_at: Column[datetime.datetime] = Column(DateTime, nullable=True)
+    created_at: Column[datetime.datetime] = Column(DateTime, default=datetime.datetime.utcnow)
+    started_at: Column[datetime.datetime] = Column(DateTime, nullable=True)
+    finished_at: Column[datetime.datetime] = Column(DateTime, nullable=True)
+
+
+class ForgeJobEvent(Base):
+    """A progress event of a forge job, kept so clients can replay the steps they missed."""
+    __tablename__ = "forge_job_events"
+    __table_args__ = (Index("ix_forge_job_events_job_id_id", "job_id", "id"),)
+
+    id: Column[int] = Column(Integer, primary_key=True)
+    job_id: Column[str] = Column(String, ForeignKey("forge_jobs.id", ondelete="CASCADE"), nullable=False)
+    event: Column[str] = Column(String, nullable=False)
+    data: Column[str] = Column(Text, nullable=False)
+    created_at: Column[datetime.datetime] = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+class ForgeRun(Base):
+    """The trace of a finished forge run, kept for latency and convergence analytics."""
+    __tablename__ = "forge_runs"
+    __table_args__ = (Index("ix_forge_runs_started_at", "started_at"),)
+
+    id: Column[int] = Column(Integer, primary_key=True)
+    started_at: Column[datetime.datetime] = Column(DateTime, nullable=False)
+    source_dialect: Column[str] = Column(String, nullable=False)
+    vdb: Column[str] = Column(String, nullable=True)
+    outcome: Column[str] = Column(String, nullable=False)  # valid, invalid, untranslatable or error
+    loops: Column[int] = Column(Integer, nullable=False)  # validation loops used
+    seconds: Column[float] = Column(Float, nullable=False)
+    tokens: Column[int] = Column(Integer, nullable=False, default=0)
+    request_tokens: Column[int] = Column(Integer, nullable=False, default=0)
+    response_tokens: Column[int] = Column(Integer, nullable=False, default=0)
+    llm_runs: Column[int] = Column(Integer, nullable=False, default=0)
+    tool_calls: Column[int] = Column(Integer, nullable=False, default=0)
+    budget_exhausted: Column[bool] = Column(Boolean, nullable=False, default=False)
+    error_categories: Column[str] = Column(Text, nullable=False, default="[]")  # JSON list, in order of occurrence
+
+
+class ForgeRunStep(Base):
+    """A step of a traced forge run with its duration."""
+    __tablename__ = "forge_run_steps"
+
+    id: Column[int] = Column(Integer, primary_key=True)
+    run_id: Column[int] = Column(Integer, ForeignKey("forge_runs.id", ondelete="CASCADE"), nullable=False, index=True)
+    position: Column[int] = Column(Integer, nullable=False)
+    step_name: Column[str] = Column(String, nullable=False)
+    success: Column[bool] = Column(Boolean, nullable=False)
+    cached: Column[bool] = Column(Boolean, nullable=False, default=False)
+    error_category: Column[str] = Column(String, nullable=True)
+    seconds: Column[float] = Column(Float, nullable=False)
+    tokens: Column[int] = Column(Integer, nullable=False, default=0)
+
+
+class ForgeStepCacheEntry(Base):
+    """The memoized output of a forge pipeline step, keyed by a hash of the step and its inputs."""
+    __tablename__ = "forge_step_cache"
+
+    key: Column[str] = Column(String, primary_key=True)
+    step: Column[str] = Column(String, nullable=False)
+    value: Column[str] = Column(Text, nullable=False)  # the step output as JSON
+    created_at: Column[datetime.datetime] = Column(DateTime, default=datetime.datetime.utcnow)
+    expires_at: Column[datetime.datetime] = Column(DateTime, nullable=False, index=True)
 
 # Pydantic Model for API request
 
@@ -36,9 +155,37 @@ class AcceptedQueryLogResponse(BaseModel):
     source_sql: str
     target_vql: str
     tables: str  # The 'tables' field is a JSON string
+    occurrence_count: int = 1
+    last_seen: Optional[datetime.datetime] = None
     model_config = ConfigDict(from_attributes=True)
 
 
 # Pydantic model for a list of log entries
 class AcceptedQueryLogListResponse(BaseModel):
     results: List[AcceptedQueryLogResponse]
+    next_cursor: Optional[str] = None  # pass as `cursor` to fetch the next page; None on the last page
+
+
+class AcceptedQuerySearchResult(AcceptedQueryLogResponse):
+    rank: float  # bm25 score, lower is a better match
+    source_snippet: str
+    target_snippet: str
+
+
+class AcceptedQuerySearchResponse(BaseModel):
+    results: List[AcceptedQuerySearchResult]
+
+
+class LogImportReject(BaseModel):
+    line: int  # line (NDJSON) or row (CSV) number in the import file
+    reason: str
+
+
+class LogImportReport(BaseModel):
+    total: int
+    added: int
+    merged: int  # duplicates of already logged pairs, counted as further occurrences
+    rejected: int
+    seconds: float
+    rows_per_second: float
+    rejects: List[LogImportReject]  # the first rejects, capped
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel, Field
 
 
@@ -16,6 +16,8 @@ class AIAnalysis(BaseModel):
     explanation: str
     sql_suggestion: str
     error_category: Optional[str] = None
+    fix_rule: Optional[str] = None  # set when a deterministic fix rule produced the suggestion
+    alternative_suggestions: List[str] = []  # further candidate corrections, most likely first
 
 
 class TranslateApiResponse(BaseModel):
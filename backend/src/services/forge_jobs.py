@@ -0,0 +1,418 @@
+"""
+Durable background forge jobs.
+
+`POST /forge/jobs` stores the forge request in the SQLite `forge_jobs` table
+and returns a job id right away. A pool of async workers claims queued jobs
+in creation order and runs them through the same translate, validate and
+correct pipeline as `/forge`. Every progress event is stored in
+`forge_job_events` before it is published to attached clients, so a client
+can poll the job, attach to its event stream at any time and replay the
+events it missed.
+
+A claimed job is leased to the worker pool of one process, which renews the
+lease with every event and with a heartbeat every third of
+`FORGE_JOB_LEASE_SECONDS`. Only jobs whose lease expired, e.g. because their
+process died, are queued again, so several processes can share the job
+table. A job whose lease expired after `FORGE_JOB_MAX_ATTEMPTS` attempts is
+failed instead. On a clean shutdown the pool queues its running jobs again
+right away. Finished jobs and their events are deleted after
+`FORGE_JOB_RETENTION_DAYS` by the log compaction job.
+"""
+
+import asyncio
+import datetime
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import AsyncIterator, List, Optional
+
+from sqlalchemy import delete, func, or_, select, text, update
+from sqlalchemy.orm import Session
+
+from src.config import settings
+from src.db import sqlite_session
+from src.db.sqlite_session import run_sqlite
+from src.schemas.agent import AgenticModeRequest, AgenticModeResponse, AgentStep, ForgeJobResponse
+from src.schemas.db_log import ForgeJob, ForgeJobEvent
+from src.services.forge_service import run_forge_pipeline
+from src.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+TERMINAL_EVENTS = ("result", "error")
+
+# A stored job event: its id, the event name and the payload.
+StoredJobEvent = tuple[int, str, dict]
+
+
+def create_job(db: Session, request: AgenticModeRequest) -> str:
+    """Store a new queued forge job and return its id."""
+    job_id = uuid.uuid4().hex
+    db.add(ForgeJob(id=job_id, status=JOB_QUEUED, request=request.model_dump_json()))
+    db.commit()
+    return job_id
+
+
+class JobLeaseLost(Exception):
+    """The job is no longer leased to this worker pool, e.g. because its lease expired and it was taken over."""
+
+
+def _lease_until(lease_seconds: float) -> datetime.datetime:
+    return datetime.datetime.utcnow() + datetime.timedelta(seconds=lease_seconds)
+
+
+def claim_next_job(db: Session, owner: str, lease_seconds: float) -> Optional[tuple[str, str, datetime.datetime]]:
+    """Lease the oldest queued job to `owner`, in one statement so no two workers claim the same job.
+
+    Returns:
+        The job id, its request JSON and its creation time, or None if no job is queued.
+    """
+    row = db.execute(text("""
+        UPDATE forge_jobs SET status = :running, owner = :owner, lease_expires_at = :lease_expires_at,
+            started_at = :now, attempts = attempts + 1
+        WHERE id = (SELECT id FROM forge_jobs WHERE status = :queued ORDER BY created_at, id LIMIT 1)
+        RETURNING id, request, created_at
+    """), {"running": JOB_RUNNING, "queued": JOB_QUEUED, "owner": owner,
+           "lease_expires_at": _lease_until(lease_seconds), "now": datetime.datetime.utcnow()}).first()
+    db.commit()
+    if row is None:
+        return None
+    created_at = row.created_at
+    if isinstance(created_at, str):  # raw SQL returns the stored text
+        created_at = datetime.datetime.fromisoformat(created_at)
+    return row.id, row.request, created_at
+
+
+def renew_job_lease(db: Session, job_id: str, owner: str, lease_seconds: float) -> bool:
+    """Extend the lease of a running job; False if `owner` no longer holds it."""
+    renewed = db.execute(
+        update(ForgeJob).where(ForgeJob.id == job_id, ForgeJob.owner == owner, ForgeJob.status == JOB_RUNNING)
+        .values(lease_expires_at=_lease_until(lease_seconds))
+    ).rowcount
+    db.commit()
+    return renewed == 1
+
+
+def record_job_event(db: Session, job_id: str, owner: str, lease_seconds: float, event: str, data: dict) -> int:
+    """Store a job event and renew the job's lease; a result or error event also finishes the job.
+
+    Returns:
+        The id of the stored event.
+
+    Raises:
+        JobLeaseLost: If `owner` no longer holds the lease of the job; nothing is stored.
+    """
+    if not renew_job_lease(db, job_id, owner, lease_seconds):
+        raise JobLeaseLost(job_id)
+    job_event = ForgeJobEvent(job_id=job_id, event=event, data=json.dumps(data))
+    db.add(job_event)
+    if event in TERMINAL_EVENTS:
+        db.execute(update(ForgeJob).where(ForgeJob.id == job_id).values(
+            status=JOB_COMPLETED if event == "result" else JOB_FAILED,
+            result=json.dumps(data),
+            finished_at=datetime.datetime.utcnow(),
+            owner=None,
+            lease_expires_at=None,
+        ))
+    db.flush()
+    event_id = job_event.id
+    db.commit()
+    return event_id
+
+
+def recover_expired_jobs(db: Session, max_attempts: int) -> tuple[int, int]:
+    """Queue running jobs whose lease expired again and drop their partial events.
+
+    Jobs that already had `max_attempts` attempts are failed instead, with
+    a final error event, since they may be what brings their worker down.
+
+    Returns:
+        The number of queued and of failed jobs.
+    """
+    now = datetime.datetime.utcnow()
+    expired = (ForgeJob.status == JOB_RUNNING,
+               or_(ForgeJob.lease_expires_at.is_(None), ForgeJob.lease_expires_at < now))
+    exhausted_ids = list(db.scalars(select(ForgeJob.id).where(*expired, ForgeJob.attempts >= max_attempts)))
+    for job_id in exhausted_ids:
+        detail = {"detail": f"The forge job was given up after {max_attempts} interrupted attempts."}
+        db.add(ForgeJobEvent(job_id=job_id, event="error", data=json.dumps(detail)))
+        db.execute(update(ForgeJob).where(ForgeJob.id == job_id).values(
+            status=JOB_FAILED, result=json.dumps(detail), finished_at=now, owner=None, lease_expires_at=None))
+
+    db.execute(delete(ForgeJobEvent).where(ForgeJobEvent.job_id.in_(select(ForgeJob.id).where(*expired))))
+    requeued = db.execute(update(ForgeJob).where(*expired).values(
+        status=JOB_QUEUED, started_at=None, owner=None, lease_expires_at=None)).rowcount
+    db.commit()
+    return requeued, len(exhausted_ids)
+
+
+def release_jobs(db: Session, owner: str) -> int:
+    """Queue the running jobs of `owner` again at a shutdown; the interrupted attempt does not count.
+
+    Returns:
+        The number of queued jobs.
+    """
+    owned = (ForgeJob.status == JOB_RUNNING, ForgeJob.owner == owner)
+    db.execute(delete(ForgeJobEvent).where(ForgeJobEvent.job_id.in_(select(ForgeJob.id).where(*owned))))
+    released = db.execute(update(ForgeJob).where(*owned).values(
+        status=JOB_QUEUED, started_at=None, owner=None, lease_expires_at=None,
+        attempts=func.max(ForgeJob.attempts - 1, 0))).rowcount
+    db.commit()
+    return released
+
+
+def purge_finished_jobs(db: Session, retention_days: int) -> int:
+    """Delete jobs that finished more than `retention_days` ago and return their number."""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=retention_days)
+    # Events go via ON DELETE CASCADE.
+    deleted = db.execute(delete(ForgeJob).where(
+        ForgeJob.status.in_((JOB_COMPLETED, JOB_FAILED)), ForgeJob.finished_at < cutoff)).rowcount
+    db.commit()
+    return deleted
+
+
+def read_job_events(db: Session, job_id: str, after_id: int = 0) -> tuple[Optional[str], List[StoredJobEvent]]:
+    """Return the status of a job and its events after `after_id`; the status is None for an unknown job."""
+    status = db.scalar(select(ForgeJob.status).where(ForgeJob.id == job_id))
+    if status is None:
+        return None, []
+    rows = db.execute(
+        select(ForgeJobEvent.id, ForgeJobEvent.event, ForgeJobEvent.data)
+        .where(ForgeJobEvent.job_id == job_id, ForgeJobEvent.id > after_id)
+        .order_by(ForgeJobEvent.id)
+    )
+    return status, [(row.id, row.event, json.loads(row.data)) for row in rows]
+
+
+def read_job(db: Session, job_id: str) -> Optional[ForgeJobResponse]:
+    """Return the status of a job with the latest state of each step, or None for an unknown job."""
+    job = db.get(ForgeJob, job_id)
+    if job is None:
+        return None
+    steps: dict[str, AgentStep] = {}
+    last_event_id = None
+    for row in db.execute(
+            select(ForgeJobEvent.id, ForgeJobEvent.event, ForgeJobEvent.data)
+            .where(ForgeJobEvent.job_id == job_id).order_by(ForgeJobEvent.id)):
+        last_event_id = row.id
+        if row.event == "step":
+            step = AgentStep.model_validate_json(row.data)
+            steps[step.step_name] = step  # a step is sent again whenever it changes
+
+    result = error = None
+    if job.result is not None:
+        payload = json.loads(job.result)
+        if job.status == JOB_COMPLETED:
+            result = AgenticModeResponse.model_validate(payload)
+        else:
+            error = payload.get("detail")
+    return ForgeJobResponse(
+        job_id=job.id,
+        status=job.status,
+        attempts=job.attempts,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+        steps=list(steps.values()),
+        last_event_id=last_event_id,
+        result=result,
+        error=error,
+    )
+
+
+class ForgeJobWorkers:
+    """A pool of async workers executing queued forge jobs, and the subscribers of their events."""
+
+    def __init__(self, worker_count: int, poll_interval: float, lease_seconds: float, max_attempts: int) -> None:
+        self.worker_count = worker_count
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # Identifies this process's pool as the holder of job leases.
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup: asyncio.Event | None = None
+        self._subscribers: dict[str, set[asyncio.Queue[StoredJobEvent]]] = {}
+
+    @property
+    def running(self) -> bool:
+        return any(not task.done() for task in self._tasks)
+
+    async def start(self) -> None:
+        """Recover jobs with an expired lease and start the workers on the running event loop."""
+        if self.running:
+            return
+        if self.worker_count <= 0 or sqlite_session.sqlite_engine is None:
+            logger.info("Forge job workers are disabled.")
+            return
+        await self._recover()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._work(), name=f"forge-job-worker-{number}")
+                       for number in range(self.worker_count)]
+        logger.info(f"Started {self.worker_count} forge job workers as '{self.owner}'.")
+
+    async def stop(self) -> None:
+        """Cancel the workers and queue the jobs they were running again."""
+        if not self._tasks:
+            return
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        try:
+            released = await run_sqlite(lambda db: release_jobs(db, self.owner))
+        except Exception as e:
+            logger.error(f"Could not queue the running forge jobs again, they resume once their lease expires: {e}")
+            return
+        if released:
+            logger.info(f"Queued {released} interrupted forge jobs again.")
+
+    def notify(self) -> None:
+        """Wake up idle workers after a job was queued."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def subscribe(self, job_id: str) -> asyncio.Queue[StoredJobEvent]:
+        """Return a queue receiving the events of a job as they are stored."""
+        queue: asyncio.Queue[StoredJobEvent] = asyncio.Queue()
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue[StoredJobEvent]) -> None:
+        subscribers = self._subscribers.get(job_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[job_id]
+
+    def _publish(self, job_id: str, stored_event: StoredJobEvent) -> None:
+        for queue in self._subscribers.get(job_id, ()):
+            queue.put_nowait(stored_event)
+
+    async def _recover(self) -> None:
+        try:
+            requeued, failed = await run_sqlite(lambda db: recover_expired_jobs(db, self.max_attempts))
+        except Exception as e:
+            logger.error(f"Failed to recover forge jobs with an expired lease: {e}", exc_info=True)
+            return
+        if requeued or failed:
+            metrics.increment("forge_jobs.requeued", requeued)
+            metrics.increment("forge_jobs.abandoned", failed)
+            logger.info(f"Queued {requeued} forge jobs with an expired lease again, gave up {failed}.")
+
+    async def _work(self) -> None:
+        assert self._wakeup is not None
+        while True:
+            self._wakeup.clear()
+            try:
+                claimed = await run_sqlite(lambda db: claim_next_job(db, self.owner, self.lease_seconds))
+            except Exception as e:
+                logger.error(f"Failed to claim a forge job: {e}", exc_info=True)
+                claimed = None
+            if claimed is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    await self._recover()  # jobs of processes that died
+                continue
+            await self._execute(*claimed)
+
+    async def _record(self, job_id: str, event: str, data: dict) -> None:
+        event_id = await run_sqlite(
+            lambda db: record_job_event(db, job_id, self.owner, self.lease_seconds, event, data))
+        self._publish(job_id, (event_id, event, data))
+
+    async def _keep_lease(self, job_id: str, runner: asyncio.Task) -> None:
+        """Renew the lease of a running job between its events; stop the job if the lease was lost."""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                renewed = await run_sqlite(lambda db: renew_job_lease(db, job_id, self.owner, self.lease_seconds))
+            except Exception as e:
+                logger.warning(f"Could not renew the lease of forge job {job_id}: {e}")
+                continue
+            if not renewed:
+                logger.warning(f"Lost the lease of forge job {job_id}, stopping it.")
+                runner.cancel()
+                return
+
+    async def _execute(self, job_id: str, request_json: str, created_at: datetime.datetime) -> None:
+        metrics.observe("forge_jobs.wait_seconds", (datetime.datetime.utcnow() - created_at).total_seconds())
+        started = time.monotonic()
+        logger.info(f"Running forge job {job_id}...")
+        runner = asyncio.create_task(self._run_job(job_id, request_json), name=f"forge-job-{job_id}")
+        heartbeat = asyncio.create_task(self._keep_lease(job_id, runner), name=f"forge-job-lease-{job_id}")
+        try:
+            await runner
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                raise  # shutting down; `stop` queues the job again
+            metrics.increment("forge_jobs.lease_lost")
+        finally:
+            heartbeat.cancel()
+        metrics.observe("forge_jobs.run_seconds", time.monotonic() - started)
+        logger.info(f"Forge job {job_id} finished.")
+
+    async def _run_job(self, job_id: str, request_json: str) -> None:
+        finished = False
+        try:
+            request = AgenticModeRequest.model_validate_json(request_json)
+            async for event, data in run_forge_pipeline(request):
+                await self._record(job_id, event, data)
+                finished = finished or event in TERMINAL_EVENTS
+            if not finished:
+                await self._record(job_id, "error", {"detail": "The forge process ended without a result."})
+            metrics.increment("forge_jobs.completed")
+        except JobLeaseLost:
+            metrics.increment("forge_jobs.lease_lost")
+            logger.warning(f"Forge job {job_id} was taken over after its lease expired, stopping it.")
+        except Exception as e:
+            metrics.increment("forge_jobs.failed")
+            logger.error(f"Forge job {job_id} failed: {e}", exc_info=True)
+            try:
+                await self._record(job_id, "error", {"detail": f"An unexpected error occurred in the forge job: {e}"})
+            except Exception:
+                logger.error(f"Could not record the failure of forge job {job_id}.", exc_info=True)
+
+    async def stream_events(self, job_id: str, after_id: int = 0) -> AsyncIterator[StoredJobEvent]:
+        """Yield the stored events of a job after `after_id`, then its new events until it finishes.
+
+        The stored events are re-read every `poll_interval` as well, so jobs
+        run by another server process are followed, too.
+
+        Raises:
+            KeyError: If the job does not exist.
+        """
+        queue = self.subscribe(job_id)
+        try:
+            last_id = after_id
+            status, stored_events = await run_sqlite(lambda db: read_job_events(db, job_id, last_id))
+            if status is None:
+                raise KeyError(job_id)
+            while True:
+                for event_id, event, data in stored_events:
+                    if event_id <= last_id:
+                        continue
+                    last_id = event_id
+                    yield event_id, event, data
+                    if event in TERMINAL_EVENTS:
+                        return
+                if status in (None, JOB_COMPLETED, JOB_FAILED):
+                    return
+                try:
+                    stored_events = [await asyncio.wait_for(queue.get(), timeout=self.poll_interval)]
+                except asyncio.TimeoutError:
+                    status, stored_events = await run_sqlite(lambda db: read_job_events(db, job_id, last_id))
+        finally:
+            self.unsubscribe(job_id, queue)
+
+
+forge_job_workers = ForgeJobWorkers(settings.FORGE_JOB_WORKERS, settings.FORGE_JOB_POLL_SECONDS,
+                                    settings.FORGE_JOB_LEASE_SECONDS, settings.FORGE_JOB_MAX_ATTEMPTS)
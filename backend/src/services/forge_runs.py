@@ -0,0 +1,215 @@
+"""
+Traces and latency analytics of forge runs.
+
+Every forge run that finishes, whether through `/forge`, a batch or a job,
+is stored in the SQLite `forge_runs` table. The trace holds the outcome,
+the validation loops used, the total time, the LLM token usage and tool
+calls and the error categories in the order they occurred. Each step with
+its duration and tokens goes to `forge_run_steps`. A step's duration is the time from its first
+event to its last update. `/forge/stats` aggregates the traces of a time
+window into percentiles and convergence rates by dialect and VDB. Runs
+cancelled by their client are not traced.
+"""
+
+import contextlib
+import datetime
+import json
+import logging
+import re
+import time
+from collections import Counter, defaultdict
+from typing import Any, AsyncIterator, Iterable, List, Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from src.config import settings
+from src.db.sqlite_session import run_sqlite
+from src.schemas.agent import (
+    AgenticModeRequest,
+    ForgePercentiles,
+    ForgeStatsGroup,
+    ForgeStatsResponse,
+    ForgeStepStats,
+)
+from src.schemas.db_log import ForgeRun, ForgeRunStep
+from src.utils.llm_scheduler import TokenUsage, current_usage
+from src.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_STEP_LOOP_SUFFIX = re.compile(r" \(Step \d+\)$")
+
+
+def normalize_step_name(step_name: str) -> str:
+    """Map the step names of all loops to one name, e.g. "Re-Validate (Step 2)" to "Validate"."""
+    return _STEP_LOOP_SUFFIX.sub("", step_name).removeprefix("Re-")
+
+
+def percentiles(values: Iterable[float]) -> ForgePercentiles:
+    """Return the mean and the linearly interpolated 50th, 95th and 99th percentiles."""
+    ordered = sorted(values)
+    if not ordered:
+        return ForgePercentiles(mean=0.0, p50=0.0, p95=0.0, p99=0.0)
+
+    def percentile(fraction: float) -> float:
+        position = (len(ordered) - 1) * fraction
+        lower = int(position)
+        upper = min(lower + 1, len(ordered) - 1)
+        return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+    return ForgePercentiles(
+        mean=round(sum(ordered) / len(ordered), 3),
+        p50=round(percentile(0.5), 3),
+        p95=round(percentile(0.95), 3),
+        p99=round(percentile(0.99), 3),
+    )
+
+
+def write_forge_run(db: Session, run: ForgeRun, steps: List[ForgeRunStep]) -> int:
+    """Store a forge run trace with its steps and return its id."""
+    db.add(run)
+    db.flush()
+    for step in steps:
+        step.run_id = run.id
+    db.add_all(steps)
+    db.commit()
+    return run.id
+
+
+def purge_old_forge_runs(db: Session, retention_days: int) -> int:
+    """Delete forge run traces older than `retention_days` and return their number."""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=retention_days)
+    # Steps go via ON DELETE CASCADE.
+    deleted = db.execute(delete(ForgeRun).where(ForgeRun.started_at < cutoff)).rowcount
+    db.commit()
+    return deleted
+
+
+def _stats_group(key: str, runs: List[Any]) -> ForgeStatsGroup:
+    categories: Counter[str] = Counter()
+    for run in runs:
+        categories.update(json.loads(run.error_categories))
+    return ForgeStatsGroup(
+        key=key,
+        runs=len(runs),
+        convergence_rate=round(sum(1 for run in runs if run.outcome == "valid") / len(runs), 3) if runs else 0.0,
+        outcomes=dict(Counter(run.outcome for run in runs).most_common()),
+        loops=percentiles(run.loops for run in runs),
+        seconds=percentiles(run.seconds for run in runs),
+        tokens=percentiles(run.tokens for run in runs),
+        tool_calls=percentiles(run.tool_calls for run in runs),
+        budget_exhausted_rate=round(sum(1 for run in runs if run.budget_exhausted) / len(runs), 3) if runs else 0.0,
+        error_categories=dict(categories.most_common()),
+    )
+
+
+def compute_forge_stats(
+    db: Session, since: datetime.datetime, dialect: Optional[str] = None, vdb: Optional[str] = None
+) -> ForgeStatsResponse:
+    """Aggregate the forge runs started since `since`, optionally of one dialect and/or VDB."""
+    filters = [ForgeRun.started_at >= since]
+    if dialect:
+        filters.append(ForgeRun.source_dialect == dialect)
+    if vdb:
+        filters.append(ForgeRun.vdb == vdb)
+    runs = db.execute(select(
+        ForgeRun.source_dialect, ForgeRun.vdb, ForgeRun.outcome, ForgeRun.loops,
+        ForgeRun.seconds, ForgeRun.tokens, ForgeRun.tool_calls, ForgeRun.budget_exhausted, ForgeRun.error_categories,
+    ).where(*filters)).all()
+
+    by_dialect: dict[str, list] = defaultdict(list)
+    by_vdb: dict[str, list] = defaultdict(list)
+    for run in runs:
+        by_dialect[run.source_dialect].append(run)
+        by_vdb[run.vdb or ""].append(run)
+
+    step_rows = db.execute(
+        select(ForgeRunStep.step_name, ForgeRunStep.cached, ForgeRunStep.seconds, ForgeRunStep.tokens)
+        .join(ForgeRun, ForgeRun.id == ForgeRunStep.run_id).where(*filters)
+    ).all()
+    steps: dict[str, list] = defaultdict(list)
+    for step in step_rows:
+        steps[normalize_step_name(step.step_name)].append(step)
+
+    return ForgeStatsResponse(
+        since=since,
+        overall=_stats_group("all", runs),
+        by_dialect=[_stats_group(key, group) for key, group in sorted(by_dialect.items())],
+        by_vdb=[_stats_group(key, group) for key, group in sorted(by_vdb.items())],
+        steps=[
+            ForgeStepStats(
+                step=name,
+                count=len(group),
+                cached_rate=round(sum(1 for step in group if step.cached) / len(group), 3),
+                seconds=percentiles(step.seconds for step in group),
+                tokens=percentiles(step.tokens for step in group),
+            )
+            for name, group in steps.items()
+        ],
+    )
+
+
+async def record_forge_run(
+    request: AgenticModeRequest, events: AsyncIterator[tuple[str, dict[str, Any]]]
+) -> AsyncIterator[tuple[str, dict[str, Any]]]:
+    """Pass the events of a forge run through and store its trace once the run has finished.
+
+    The LLM usage of the run is collected via the scheduler's
+    `current_usage`, which also holds the token budget of the run: the
+    request's `token_budget`, at most `LLM_REQUEST_TOKEN_BUDGET`. A failure
+    to store the trace is logged and does not affect the run.
+    """
+    budgets = [budget for budget in (request.token_budget, settings.LLM_REQUEST_TOKEN_BUDGET) if budget]
+    outer_usage = current_usage.get()
+    usage = TokenUsage(endpoint=outer_usage.endpoint if outer_usage else "forge_jobs", vdb=request.vdb,
+                       budget=min(budgets) if budgets else None)
+    usage_token = current_usage.set(usage)
+    started_at = datetime.datetime.utcnow()
+    started = time.monotonic()
+    steps: dict[str, dict[str, Any]] = {}  # by step name, in order of appearance
+    outcome = "error"
+    try:
+        async for event, data in events:
+            now = time.monotonic()
+            if event == "step":
+                step = steps.setdefault(data["step_name"], {"first": now})
+                step.update(last=now, success=data["success"], cached=data.get("cached", False),
+                            error_category=data.get("error_category"), tokens=data.get("tokens", 0))
+            elif event == "result":
+                translated = steps.get("Translate", {}).get("success", True)
+                outcome = "valid" if data["is_valid"] else "invalid" if translated else "untranslatable"
+            yield event, data
+    finally:
+        with contextlib.suppress(ValueError):  # closed from another context
+            current_usage.reset(usage_token)
+
+    seconds = time.monotonic() - started
+    run = ForgeRun(
+        started_at=started_at,
+        source_dialect=request.dialect,
+        vdb=request.vdb or None,
+        outcome=outcome,
+        loops=sum(1 for name in steps if normalize_step_name(name) == "Validate"),
+        seconds=round(seconds, 3),
+        tokens=usage.tokens,
+        request_tokens=usage.request_tokens,
+        response_tokens=usage.response_tokens,
+        llm_runs=usage.runs,
+        tool_calls=usage.tool_calls,
+        budget_exhausted=usage.exhausted,
+        error_categories=json.dumps([step["error_category"] for step in steps.values() if step["error_category"]]),
+    )
+    run_steps = [
+        ForgeRunStep(position=position, step_name=name, success=step["success"], cached=step["cached"],
+                     error_category=step["error_category"], seconds=round(step["last"] - step["first"], 3),
+                     tokens=step["tokens"])
+        for position, (name, step) in enumerate(steps.items())
+    ]
+    metrics.increment(f"forge.outcome.{outcome}")
+    logger.info(f"Forge run ended {outcome} after {seconds:.1f}s, using {usage.tokens} LLM tokens in {usage.runs} runs "
+                f"with {usage.tool_calls} tool calls{' (token budget used up)' if usage.exhausted else ''}.")
+    try:
+        await run_sqlite(lambda db: write_forge_run(db, run, run_steps))
+    except Exception as e:
+        logger.error(f"Failed to store the forge run trace: {e}", exc_info=True)
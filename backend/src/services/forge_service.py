@@ -0,0 +1,394 @@
+"""
+The VQL Forge agentic pipeline.
+
+Translates SQL to VQL in an iterative, agent-like process: an initial
+translation, followed by validation and correction loops until the VQL is
+valid or the maximum number of attempts is reached. Progress is reported as
+a stream of events, which the API layer sends to the client as Server-Sent
+Events. A batch runs many pipelines at once and multiplexes their events
+onto one stream.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, List
+
+from src.schemas.validation import VqlValidationApiResponse
+from src.schemas.agent import (
+    AgenticModeRequest,
+    AgenticModeResponse,
+    AgentStep,
+    ForgeBatchItem,
+    ForgeBatchItemSummary,
+    ForgeBatchSummary,
+)
+from src.schemas.validation import VqlValidateRequest
+from src.schemas.translation import TranslateApiResponse
+from src.services.forge_runs import record_forge_run
+from src.services.step_cache import memoize_step
+from src.services.translation_service import run_translation
+from src.services.validation_service import find_first_valid_candidate, run_validation
+from src.utils.ai_analyzer import EXPLANATION_FAILURE_MESSAGES, explain_vql_differences
+from src.utils.llm_scheduler import Priority, TokenUsage, current_priority, current_usage, over_token_budget
+from src.utils.metrics import metrics
+from src.utils.vql_diff import describe_vql_differences
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+# An event name ("step", "result" or "error") and its payload.
+ForgeEvent = tuple[str, dict[str, Any]]
+
+
+def format_explanation_as_markdown(explanation: str) -> str:
+    """Format the AI explanation into better structured markdown.
+
+    This function enhances a plain text explanation by attempting to structure
+    it as markdown. If markdown markers like '##' or '-' are already present,
+    it returns the original string to avoid double formatting.
+
+    Args:
+        explanation: The raw explanation string from the AI.
+
+    Returns:
+        A markdown-formatted explanation string.
+    """
+    if not explanation:
+        return explanation
+
+    # If the explanation is already well-formatted, return as-is
+    if any(marker in explanation for marker in ['##', '- ', '* ', '\n- ', '\n* ']):
+        return explanation
+
+    # Otherwise, try to structure it better
+    lines = explanation.split('\n')
+    formatted_lines = []
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            formatted_lines.append('')
+            continue
+        else:
+            formatted_lines.append(line)
+
+    return '\n'.join(formatted_lines)
+
+
+async def run_forge_pipeline(request: AgenticModeRequest) -> AsyncIterator[ForgeEvent]:
+    """Run the agentic SQL-to-VQL process and yield its progress events.
+
+    The process involves an initial translation, followed by a series of
+    validation and correction loops until the VQL is valid or the maximum
+    number of attempts is reached. With more than one candidate per loop,
+    the AI suggests several corrections, which are validated concurrently;
+    the first valid one ends the loop. The translation, each validation with
+    its correction and the explanation are memoized by their inputs, so a
+    rerun replays the unchanged steps instead of recomputing them. Once the
+    run's LLM token budget is used up, AI error analyses and explanations are
+    skipped, which ends the correction loop early. Finished runs are traced
+    for `/forge/stats`, with the LLM tokens of each step.
+
+    Args:
+        request: The request containing the SQL query, its dialect, and the VDB.
+
+    Yields:
+        "step" events with an updated `AgentStep`, one final "result" event
+        with an `AgenticModeResponse`, or an "error" event.
+    """
+    async for event in record_forge_run(request, _run_forge_steps(request)):
+        yield event
+
+
+async def _run_forge_steps(request: AgenticModeRequest) -> AsyncIterator[ForgeEvent]:
+    """Run the translation and the validation and correction loops; see `run_forge_pipeline`."""
+    started = time.monotonic()
+    aborted = False
+    process_log: list[AgentStep] = []
+    candidate_count = min(request.candidates or settings.AGENTIC_CANDIDATES, settings.AGENTIC_MAX_CANDIDATES)
+    validated_vql: str | None = None  # a fix or candidate that already passed validation
+    candidate_errors: dict[str, Exception] = {}  # candidates that failed the concurrent validation
+    usage = current_usage.get() or TokenUsage()
+
+    try:
+        # Step 1: Initial Translation (occurs once)
+        step1 = AgentStep(step_name="Translate", details=f"Translating {request.dialect} to VQL...", success=True)
+        process_log.append(step1)
+        yield "step", step1.model_dump()
+
+        tokens_before = usage.tokens
+        translation_result, step1.cached = await memoize_step(
+            "translate",
+            {"sql": request.sql, "dialect": request.dialect, "vdb": request.vdb, "model": settings.AI_MODEL_NAME},
+            lambda: run_translation(request.sql, request.dialect, request.vdb),
+            TranslateApiResponse,
+            cacheable=lambda result: result.vql is not None or result.error_analysis is not None,
+            enabled=request.use_cache,
+        )
+        step1.tokens = usage.tokens - tokens_before
+
+        if translation_result.error_analysis or translation_result.vql is None:
+            step1.success = False
+            category = (translation_result.error_analysis and translation_result.error_analysis.error_category
+                        or "Translation Error")
+            step1.details = f"Initial SQL translation failed: {category}."
+            step1.error_category = category
+            yield "step", step1.model_dump()
+            final_error_result = AgenticModeResponse(
+                final_vql=None, is_valid=False, process_log=process_log,
+                final_message=translation_result.message or "Could not translate source SQL.",
+                error_analysis=translation_result.error_analysis
+            )
+            yield "result", final_error_result.model_dump()
+            return
+
+        current_vql = translation_result.vql
+        step1.details = "Translation successful."
+        step1.output = current_vql
+        yield "step", step1.model_dump()
+
+        # Correction Loop
+        for i in range(settings.AGENTIC_MAX_LOOPS):
+            loop_count = i + 1
+
+            # Validation Step
+            validation_step_name = "Validate" if i == 0 else f"Re-Validate (Step {loop_count})"
+            validation_step = AgentStep(step_name=validation_step_name,
+                                        details=f"Validating VQL (Step {loop_count})...", success=True)
+            process_log.append(validation_step)
+            yield "step", validation_step.model_dump()
+
+            validation_request: VqlValidateRequest = VqlValidateRequest(
+                sql=request.sql, vql=current_vql, vdb=request.vdb, dialect=request.dialect)
+            tokens_before = usage.tokens
+            if validated_vql is not None and current_vql == validated_vql:
+                validation_result = VqlValidationApiResponse(validated=True, message="VQL syntax check successful!")
+            else:
+                # Memoizes the correction, too: it is derived from the validation error of this VQL.
+                validation_result, validation_step.cached = await memoize_step(
+                    "validate",
+                    {"vql": current_vql, "sql": request.sql, "dialect": request.dialect, "vdb": request.vdb,
+                     "candidates": candidate_count, "autofix": settings.AUTOFIX_ENABLED,
+                     "model": settings.AI_MODEL_NAME},
+                    lambda: run_validation(validation_request, candidates=candidate_count,
+                                           error=candidate_errors.get(current_vql)),
+                    VqlValidationApiResponse,
+                    cacheable=lambda result: result.validated or result.error_analysis is not None,
+                    enabled=request.use_cache,
+                )
+            validation_step.tokens = usage.tokens - tokens_before  # the AI analysis of a failed validation
+
+            if validation_result.validated:
+                validation_step.details = "Validation successful."
+                yield "step", validation_step.model_dump()
+
+                # Explain Differences
+                explain_step = AgentStep(
+                    step_name="Explain",
+                    details="Analyzing differences between source SQL and final VQL...",
+                    success=True
+                )
+                process_log.append(explain_step)
+                yield "step", explain_step.model_dump()
+
+                # Deterministic AST diff first; the AI only enriches it when enabled
+                # or when the queries could not be compared locally, and the token budget allows.
+                raw_explanation = describe_vql_differences(
+                    source_sql=request.sql,
+                    source_dialect=request.dialect,
+                    final_vql=current_vql
+                )
+                tokens_before = usage.tokens
+                if (settings.AI_EXPLANATION_ENRICHMENT or not raw_explanation) and over_token_budget("explanation"):
+                    raw_explanation = raw_explanation or "No explanation available, the LLM token budget is used up."
+                elif settings.AI_EXPLANATION_ENRICHMENT or not raw_explanation:
+                    final_vql, detected_changes = current_vql, raw_explanation
+                    ai_explanation, explain_step.cached = await memoize_step(
+                        "explain",
+                        {"sql": request.sql, "dialect": request.dialect, "vql": final_vql,
+                         "detected_changes": detected_changes, "model": settings.AI_MODEL_NAME},
+                        lambda: explain_vql_differences(
+                            source_sql=request.sql,
+                            source_dialect=request.dialect,
+                            final_vql=final_vql,
+                            detected_changes=detected_changes
+                        ),
+                        str,
+                        cacheable=lambda explanation: bool(explanation) and
+                        explanation not in EXPLANATION_FAILURE_MESSAGES,
+                        enabled=request.use_cache,
+                    )
+                    raw_explanation = f"{raw_explanation}\n{ai_explanation}" if raw_explanation else ai_explanation
+
+                # Format the explanation with better structure
+                formatted_explanation = format_explanation_as_markdown(raw_explanation)
+
+                final_explanation = f"## Key Differences Between Source SQL and Final VQL\n\n{formatted_explanation}"
+
+                explain_step.details = final_explanation
+                explain_step.tokens = usage.tokens - tokens_before
+                yield "step", explain_step.model_dump()
+
+                final_success_result = AgenticModeResponse(
+                    final_vql=current_vql, is_valid=True, process_log=process_log,
+                    final_message="Agentic process complete. The VQL is valid."
+                )
+                yield "result", final_success_result.model_dump()
+                return  # Exit the generator on success
+
+            # If validation fails
+            error_analysis = validation_result.error_analysis
+            validation_step.success = False
+            category = error_analysis.error_category if error_analysis else "Unknown Error"
+            validation_step.details = f"Validation failed: {category}."
+            validation_step.error_category = category
+            yield "step", validation_step.model_dump()
+
+            if not error_analysis or not error_analysis.sql_suggestion:
+                final_no_suggestion_result = AgenticModeResponse(
+                    final_vql=current_vql, is_valid=False, process_log=process_log,
+                    final_message=(validation_result.message if not error_analysis and validation_result.message
+                                   else "Validation failed. AI provided an explanation but no automatic correction."),
+                    error_analysis=error_analysis
+                )
+                yield "result", final_no_suggestion_result.model_dump()
+                return
+
+            # Check if we are on the last loop iteration
+            if loop_count >= settings.AGENTIC_MAX_LOOPS:
+                # Don't try to correct on the last iteration, just fail.
+                final_max_loops_result = AgenticModeResponse(
+                    final_vql=current_vql, is_valid=False, process_log=process_log,
+                    final_message=f"Agentic process failed. Reached maximum correction loops ({settings.AGENTIC_MAX_LOOPS}). The VQL is still invalid.",
+                    error_analysis=error_analysis
+                )
+                yield "result", final_max_loops_result.model_dump()
+                return
+
+            # AI Analysis & Correction Step
+            analysis_step = AgentStep(
+                step_name=f"Analyze (Step {loop_count})",
+                details="AI is analyzing the error to find a correction...",
+                success=True,
+                cached=validation_step.cached
+            )
+            process_log.append(analysis_step)
+            yield "step", analysis_step.model_dump()
+
+            correction_step = AgentStep(
+                step_name=f"Correct (Step {loop_count})",
+                details=(f"Fix rule '{error_analysis.fix_rule}' provided a corrected VQL."
+                         if error_analysis.fix_rule else "AI provided a corrected VQL."),
+                success=True,
+                output=error_analysis.sql_suggestion,
+                cached=validation_step.cached
+            )
+            process_log.append(correction_step)
+            yield "step", correction_step.model_dump()
+
+            failed_vql, current_vql = current_vql, error_analysis.sql_suggestion
+            if error_analysis.fix_rule:
+                validated_vql = current_vql  # fix rules only suggest rewrites that passed validation
+            candidates = list(dict.fromkeys([current_vql, *error_analysis.alternative_suggestions]))
+            if len(candidates) > 1:
+                correction_step.details = (f"AI provided {len(candidates)} candidate corrections, "
+                                           "validating them concurrently...")
+                yield "step", correction_step.model_dump()
+                winner = await find_first_valid_candidate(
+                    candidates, known_invalid={failed_vql, *candidate_errors}, errors=candidate_errors)
+                if winner is not None:
+                    current_vql = validated_vql = candidates[winner]
+                    correction_step.details = f"Candidate {winner + 1} of {len(candidates)} is valid."
+                else:
+                    correction_step.details = (f"None of the {len(candidates)} candidate corrections is valid, "
+                                               "continuing with the first one.")
+                correction_step.output = current_vql
+                yield "step", correction_step.model_dump()
+
+    except Exception as e:
+        logger.error(f"Error during agentic stream: {e}", exc_info=True)
+        error_payload = {"detail": f"An unexpected error occurred in the agentic process: {e}"}
+        yield "error", error_payload
+    except BaseException:  # cancelled, or closed early by the consumer
+        aborted = True
+        raise
+    finally:
+        if not aborted:
+            metrics.observe("forge.seconds", time.monotonic() - started)
+
+
+async def run_forge_batch(items: List[ForgeBatchItem], concurrency: int) -> AsyncIterator[ForgeEvent]:
+    """Run the forge pipeline for many items and multiplex their events onto one stream.
+
+    At most `concurrency` items are forged at the same time. Their Denodo
+    statements and AI runs share the application-wide limits with all other
+    requests, and the AI runs are scheduled with batch priority, so
+    interactive users are served first.
+
+    Args:
+        items: The items to forge; items without an id are tagged with their position.
+        concurrency: The number of items forged at the same time.
+
+    Yields:
+        The "step", "result" and "error" events of the items, with an
+        `item_id` added to each payload, and finally a "summary" event with a
+        `ForgeBatchSummary`.
+    """
+    started = time.monotonic()
+    events: asyncio.Queue[tuple[str, dict[str, Any]] | None] = asyncio.Queue()
+    pending = iter([(item.id or str(position), item) for position, item in enumerate(items)])
+    summaries: dict[str, ForgeBatchItemSummary] = {}
+
+    async def forge_item(item_id: str, item: ForgeBatchItem) -> None:
+        summary = ForgeBatchItemSummary(item_id=item_id, is_valid=False, loops=0)
+        validation_steps: set[str] = set()
+        try:
+            async for event, data in run_forge_pipeline(item):
+                if event == "step" and data["step_name"].startswith(("Validate", "Re-Validate")):
+                    validation_steps.add(data["step_name"])
+                elif event == "result":
+                    summary.is_valid = data["is_valid"]
+                elif event == "error":
+                    summary.error = data.get("detail")
+                events.put_nowait((event, {"item_id": item_id, **data}))
+        except Exception as e:
+            logger.error(f"Error while forging batch item '{item_id}': {e}", exc_info=True)
+            summary.error = f"An unexpected error occurred in the agentic process: {e}"
+            events.put_nowait(("error", {"item_id": item_id, "detail": summary.error}))
+        summary.loops = len(validation_steps)
+        summaries[item_id] = summary
+
+    async def work() -> None:
+        current_priority.set(Priority.BATCH)
+        for item_id, item in pending:  # shared by all workers, each item is taken once
+            await forge_item(item_id, item)
+
+    async def run_workers() -> None:
+        try:
+            await asyncio.gather(*(work() for _ in range(min(concurrency, len(items)))))
+        finally:
+            events.put_nowait(None)
+
+    runner = asyncio.create_task(run_workers(), name="forge-batch")
+    try:
+        while (item := await events.get()) is not None:
+            yield item
+        await runner
+    finally:
+        runner.cancel()
+
+    ordered = [summaries[item.id or str(position)] for position, item in enumerate(items)]
+    summary = ForgeBatchSummary(
+        total=len(ordered),
+        valid=sum(1 for item in ordered if item.is_valid),
+        invalid=sum(1 for item in ordered if not item.is_valid and item.error is None),
+        failed=sum(1 for item in ordered if item.error is not None),
+        loops_used=sum(item.loops for item in ordered),
+        seconds=round(time.monotonic() - started, 3),
+        items=ordered,
+    )
+    metrics.increment("forge_batch.items", summary.total)
+    metrics.increment("forge_batch.valid", summary.valid)
+    metrics.observe("forge_batch.seconds", summary.seconds)
+    yield "summary", summary.model_dump()
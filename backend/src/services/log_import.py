@@ -0,0 +1,197 @@
+"""
+Bulk import of known-good SQL-to-VQL pairs into the accepted query log.
+
+Pairs are read from NDJSON (one object per line) or CSV (with a header row)
+with the fields `source_sql`, `source_dialect` and `target_vql`. Parsing
+the source SQL, the CPU-heavy part, runs across worker processes, which are
+spawned fresh rather than forked since the server process runs threads and
+an event loop; the prepared entries are written with executemany in large
+transactions.
+Duplicates are merged like repeated acceptances.
+
+Besides `POST /log/import`, the import can be run from the command line:
+
+    python -m src.services.log_import pairs.ndjson [--format csv] [--dialect oracle]
+"""
+
+import argparse
+import contextlib
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Iterable, Iterator, List, Literal, Optional, TextIO, Tuple
+
+from src.config import settings
+from src.db.sqlite_session import init_sqlite_db, run_with_busy_retry
+from src.schemas.db_log import LogImportReject, LogImportReport
+from src.services.log_store import PreparedAcceptedQuery, prepare_accepted_query, write_prepared_accepted_queries
+from src.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+ImportFormat = Literal["ndjson", "csv"]
+# A numbered input record, or the reason why the line could not be read.
+_ImportRecord = Tuple[int, dict[str, Any] | str, Optional[str]]
+
+REQUIRED_FIELDS = ("source_sql", "source_dialect", "target_vql")
+MAX_REPORTED_REJECTS = 100
+
+
+def guess_import_format(filename: str | None) -> ImportFormat:
+    """Guess the import format from a file name; anything but `.csv` is read as NDJSON."""
+    return "csv" if filename and filename.lower().endswith(".csv") else "ndjson"
+
+
+def read_import_records(stream: TextIO, import_format: ImportFormat) -> Iterator[Tuple[int, dict[str, Any] | str]]:
+    """Read numbered records from an NDJSON or CSV stream.
+
+    Yields:
+        The line (NDJSON) or row (CSV) number and the record, or the reason
+        why the line could not be read.
+    """
+    if import_format == "csv":
+        reader = csv.DictReader(stream)
+        for row_number, row in enumerate(reader, 1):
+            yield row_number, row
+        return
+
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, f"Invalid JSON: {e}"
+            continue
+        yield line_number, record if isinstance(record, dict) else "Expected a JSON object."
+
+
+def _prepare_record(item: _ImportRecord) -> PreparedAcceptedQuery | LogImportReject:
+    """Validate and prepare one import record; runs in a worker process."""
+    line, record, default_dialect = item
+    if isinstance(record, str):
+        return LogImportReject(line=line, reason=record)
+    values = {name: str(record.get(name) or "").strip() for name in REQUIRED_FIELDS}
+    values["source_dialect"] = values["source_dialect"] or (default_dialect or "")
+    missing = [name for name, value in values.items() if not value]
+    if missing:
+        return LogImportReject(line=line, reason=f"Missing field(s): {', '.join(missing)}.")
+    try:
+        return prepare_accepted_query(values["source_sql"], values["source_dialect"], values["target_vql"])
+    except Exception as e:
+        return LogImportReject(line=line, reason=f"Could not parse source SQL: {e}")
+
+
+def _chunks(items: Iterable[_ImportRecord], size: int) -> Iterator[List[_ImportRecord]]:
+    chunk: List[_ImportRecord] = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_accepted_queries(
+    stream: TextIO,
+    import_format: ImportFormat,
+    default_dialect: Optional[str] = None,
+    workers: Optional[int] = None,
+    batch_size: Optional[int] = None,
+) -> LogImportReport:
+    """Import SQL-to-VQL pairs from an NDJSON or CSV stream into the accepted query log.
+
+    The stream is read in batches; each batch is prepared across worker
+    processes and written in its own transaction, so a failing batch does
+    not roll back the ones already imported. This function blocks and is
+    meant for the CLI or a worker thread.
+
+    Args:
+        stream: The text stream to read.
+        import_format: Either "ndjson" or "csv".
+        default_dialect: The source dialect of records without `source_dialect`.
+        workers: Number of worker processes, defaults to `LOG_IMPORT_WORKERS`
+                 (all CPUs if 0); at most `LOG_IMPORT_MAX_WORKERS`. 1 prepares
+                 in the calling process.
+        batch_size: Entries per transaction, defaults to `LOG_IMPORT_BATCH_SIZE`.
+
+    Returns:
+        The import report with counts, throughput and the first rejects.
+    """
+    workers = min(workers or settings.LOG_IMPORT_WORKERS or os.cpu_count() or 1, settings.LOG_IMPORT_MAX_WORKERS)
+    batch_size = batch_size or settings.LOG_IMPORT_BATCH_SIZE
+    started = time.monotonic()
+    total = added = merged = rejected = 0
+    rejects: List[LogImportReject] = []
+
+    records = ((line, record, default_dialect) for line, record in read_import_records(stream, import_format))
+    with contextlib.ExitStack() as stack:
+        pool = None
+        if workers > 1:
+            # Forking a process that runs threads can copy held locks into the children.
+            pool = stack.enter_context(
+                ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")))
+        for chunk in _chunks(records, batch_size):
+            if pool is not None:
+                results = pool.map(_prepare_record, chunk, chunksize=max(1, len(chunk) // (workers * 4)))
+            else:
+                results = map(_prepare_record, chunk)
+
+            batch: List[PreparedAcceptedQuery] = []
+            for result in results:
+                if isinstance(result, LogImportReject):
+                    rejected += 1
+                    if len(rejects) < MAX_REPORTED_REJECTS:
+                        rejects.append(result)
+                else:
+                    batch.append(result)
+            total += len(chunk)
+            if batch:
+                batch_added, batch_merged = run_with_busy_retry(
+                    lambda db, batch=batch: write_prepared_accepted_queries(db, batch))
+                added += batch_added
+                merged += batch_merged
+            logger.info(f"Imported {total} records so far ({added} added, {merged} merged, {rejected} rejected).")
+
+    seconds = time.monotonic() - started
+    metrics.increment("log_import.added", added)
+    metrics.increment("log_import.merged", merged)
+    metrics.increment("log_import.rejected", rejected)
+    metrics.observe("log_import.seconds", seconds)
+    return LogImportReport(
+        total=total,
+        added=added,
+        merged=merged,
+        rejected=rejected,
+        seconds=round(seconds, 3),
+        rows_per_second=round(total / seconds, 1) if seconds > 0 else float(total),
+        rejects=rejects,
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point; prints the import report as JSON."""
+    parser = argparse.ArgumentParser(description="Bulk import SQL-to-VQL pairs into the VQLForge query log.")
+    parser.add_argument("path", help="NDJSON or CSV file with source_sql, source_dialect and target_vql.")
+    parser.add_argument("--format", choices=["ndjson", "csv"], help="File format, guessed from the extension if omitted.")
+    parser.add_argument("--dialect", help="Source dialect of records without a source_dialect field.")
+    parser.add_argument("--workers", type=int, help="Worker processes preparing the records.")
+    parser.add_argument("--batch-size", type=int, help="Entries per transaction.")
+    args = parser.parse_args(argv)
+
+    init_sqlite_db()
+    with open(args.path, encoding="utf-8", newline="") as stream:
+        report = import_accepted_queries(
+            stream, args.format or guess_import_format(args.path), args.dialect, args.workers, args.batch_size)
+    print(report.model_dump_json(indent=2))
+    return 0 if report.rejected < report.total or report.total == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
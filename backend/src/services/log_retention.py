@@ -0,0 +1,270 @@
+"""
+Retention, archival and compaction of the accepted query log.
+
+A background job periodically expires accepted queries according to the
+retention settings: entries not seen for `LOG_RETENTION_DAYS`, and the least
+recently seen entries beyond `LOG_RETENTION_MAX_ROWS` overall or beyond the
+per-dialect caps in `LOG_RETENTION_DIALECT_MAX_ROWS`. Expired entries are
+first written to gzip-compressed NDJSON segments in `LOG_ARCHIVE_DIR`, in
+the export format that `/log/import` reads back, and then deleted together
+with their junction, similarity and full-text rows. Freed pages are
+returned to the file system with an incremental VACUUM, and gauges report
+the database size and row counts. Expired memoized forge steps, old forge
+run traces and old finished forge jobs are removed in the same pass.
+
+Incremental VACUUM needs a database created with incremental auto-vacuum,
+which new log databases are. Converting an older database takes a full
+VACUUM, which rewrites the whole file and locks it while it runs, so it is
+opt-in: set `LOG_CONVERT_AUTO_VACUUM` to let the next compaction convert it,
+or convert it in a maintenance window from the command line, which also
+runs a compaction pass:
+
+    python -m src.services.log_retention --convert-auto-vacuum
+
+The `log_db.incremental_auto_vacuum` gauge tells whether a database still
+needs the conversion.
+"""
+
+import argparse
+import asyncio
+import datetime
+import gzip
+import json
+import logging
+import os
+import sys
+import time
+from typing import List
+
+from sqlalchemy import delete, func, select, text
+from sqlalchemy.orm import Session
+
+from src.config import settings
+from src.db import sqlite_session
+from src.db.sqlite_session import init_sqlite_db, run_sqlite, sqlite_session_scope
+from src.schemas.db_log import AcceptedQuery
+from src.services.log_store import export_row_values, export_statement
+from src.services.forge_jobs import purge_finished_jobs
+from src.services.forge_runs import purge_old_forge_runs
+from src.services.step_cache import purge_expired_steps
+from src.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_INCREMENTAL_AUTO_VACUUM = 2
+
+
+def select_expired_ids(db: Session, limit: int) -> List[int]:
+    """Return up to `limit` ids of accepted queries that the retention policies expire.
+
+    The policies are applied one after another, age first, then the
+    per-dialect caps, then the overall cap; a policy only contributes once
+    the previous ones expire nothing. Since the caller deletes each batch
+    before asking for the next, the row caps count only surviving entries
+    and are not undershot.
+    """
+    if settings.LOG_RETENTION_DAYS > 0:
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=settings.LOG_RETENTION_DAYS)
+        expired = list(db.scalars(
+            select(AcceptedQuery.id).where(AcceptedQuery.last_seen < cutoff).order_by(AcceptedQuery.id).limit(limit)))
+        if expired:
+            return expired
+    for dialect, max_rows in settings.LOG_RETENTION_DIALECT_MAX_ROWS.items():
+        if max_rows <= 0:
+            continue
+        expired = list(db.scalars(
+            select(AcceptedQuery.id).where(AcceptedQuery.source_dialect == dialect)
+            .order_by(AcceptedQuery.last_seen.desc(), AcceptedQuery.id.desc())
+            .offset(max_rows).limit(limit)))
+        if expired:
+            return sorted(expired)
+    if settings.LOG_RETENTION_MAX_ROWS > 0:
+        return sorted(db.scalars(
+            select(AcceptedQuery.id)
+            .order_by(AcceptedQuery.last_seen.desc(), AcceptedQuery.id.desc())
+            .offset(settings.LOG_RETENTION_MAX_ROWS).limit(limit)))
+    return []
+
+
+def archive_and_delete(db: Session, entry_ids: List[int], archive_dir: str) -> str:
+    """Write accepted queries to a new archive segment, then delete them in one transaction.
+
+    The segment is synced to disk before the rows are deleted, so a crash
+    can at worst archive entries twice, never lose them.
+
+    Returns:
+        The path of the archive segment.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    stamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    path = os.path.join(archive_dir, f"accepted_queries-{stamp}-{entry_ids[0]}-{entry_ids[-1]}.ndjson.gz")
+    rows = db.execute(export_statement().where(AcceptedQuery.id.in_(entry_ids)).order_by(AcceptedQuery.id))
+    with open(path, "wb") as raw_file:
+        with gzip.GzipFile(fileobj=raw_file, mode="wb") as segment:
+            for row in rows:
+                segment.write((json.dumps(export_row_values(row)) + "\n").encode())
+        raw_file.flush()
+        os.fsync(raw_file.fileno())
+
+    # Junction, signature and bucket rows go via ON DELETE CASCADE, full-text rows via trigger.
+    db.execute(delete(AcceptedQuery).where(AcceptedQuery.id.in_(entry_ids)))
+    db.commit()
+    return path
+
+
+def uses_incremental_auto_vacuum(db: Session) -> bool:
+    return db.execute(text("PRAGMA auto_vacuum")).scalar() == _INCREMENTAL_AUTO_VACUUM
+
+
+def ensure_incremental_auto_vacuum(db: Session) -> bool:
+    """Convert a database created without incremental auto-vacuum with a one-time full VACUUM.
+
+    The VACUUM rewrites the whole database and blocks all other access
+    meanwhile; see the module documentation.
+
+    Returns:
+        True if the database was converted.
+    """
+    if uses_incremental_auto_vacuum(db):
+        return False
+    logger.info("Converting the SQLite log database to incremental auto-vacuum (one-time full VACUUM)...")
+    db.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+    db.execute(text("VACUUM"))
+    return True
+
+
+def reclaim_space(db: Session) -> int:
+    """Return free pages to the file system and truncate the WAL.
+
+    Returns:
+        The number of free pages before reclaiming them.
+    """
+    free_pages = db.execute(text("PRAGMA freelist_count")).scalar() or 0
+    if free_pages:
+        # The pragma frees one page per step; executescript steps it to completion,
+        # whereas a regular execute would only free a single page.
+        db.connection().connection.driver_connection.executescript("PRAGMA incremental_vacuum;")
+    db.execute(text("PRAGMA wal_checkpoint(TRUNCATE)")).all()
+    return free_pages
+
+
+def collect_log_stats(db: Session) -> dict[str, float]:
+    """Return the size and row-count gauges of the log database."""
+    page_size = db.execute(text("PRAGMA page_size")).scalar() or 0
+    stats: dict[str, float] = {
+        "log_db.size_bytes": page_size * (db.execute(text("PRAGMA page_count")).scalar() or 0),
+        "log_db.free_bytes": page_size * (db.execute(text("PRAGMA freelist_count")).scalar() or 0),
+        "log_db.rows.accepted_queries": db.scalar(select(func.count()).select_from(AcceptedQuery)) or 0,
+        "log_db.incremental_auto_vacuum": int(uses_incremental_auto_vacuum(db)),
+    }
+    wal_path = f"{settings.SQLITE_DB_PATH}-wal"
+    stats["log_db.wal_bytes"] = os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+    for dialect, count in db.execute(
+            select(AcceptedQuery.source_dialect, func.count()).group_by(AcceptedQuery.source_dialect)):
+        stats[f"log_db.dialect_rows.{dialect or 'unknown'}"] = count
+    return stats
+
+
+async def compact_log_database() -> dict[str, int]:
+    """Apply the retention policies, archive and delete expired entries and reclaim their space.
+
+    Each batch is archived and deleted in its own unit of work on the SQLite
+    thread pool, so log writes and history reads interleave with a long
+    compaction instead of waiting for it. Expired memoized forge steps, forge
+    run traces older than `FORGE_RUN_RETENTION_DAYS` and forge jobs finished
+    more than `FORGE_JOB_RETENTION_DAYS` ago are deleted in the same pass.
+
+    Returns:
+        The number of archived entries and reclaimed pages.
+    """
+    started = time.monotonic()
+    if settings.LOG_CONVERT_AUTO_VACUUM:
+        await run_sqlite(ensure_incremental_auto_vacuum)
+
+    archived = 0
+    while True:
+        entry_ids = await run_sqlite(lambda db: select_expired_ids(db, settings.LOG_COMPACTION_BATCH_SIZE))
+        if not entry_ids:
+            break
+        path = await run_sqlite(lambda db: archive_and_delete(db, entry_ids, settings.LOG_ARCHIVE_DIR))
+        archived += len(entry_ids)
+        logger.info(f"Archived {len(entry_ids)} expired accepted queries to {path}.")
+
+    expired_steps = await run_sqlite(purge_expired_steps)
+    if settings.FORGE_JOB_RETENTION_DAYS > 0:
+        expired_jobs = await run_sqlite(lambda db: purge_finished_jobs(db, settings.FORGE_JOB_RETENTION_DAYS))
+        metrics.increment("log_retention.expired_forge_jobs", expired_jobs)
+    if settings.FORGE_RUN_RETENTION_DAYS > 0:
+        expired_runs = await run_sqlite(lambda db: purge_old_forge_runs(db, settings.FORGE_RUN_RETENTION_DAYS))
+        metrics.increment("log_retention.expired_forge_runs", expired_runs)
+    reclaimed_pages = await run_sqlite(reclaim_space)
+    for name, value in (await run_sqlite(collect_log_stats)).items():
+        metrics.set_gauge(name, value)
+    metrics.increment("log_retention.archived", archived)
+    metrics.increment("log_retention.expired_steps", expired_steps)
+    metrics.observe("log_retention.seconds", time.monotonic() - started)
+    if archived or reclaimed_pages:
+        logger.info(f"Log compaction archived {archived} entries and reclaimed {reclaimed_pages} pages.")
+    return {"archived": archived, "reclaimed_pages": reclaimed_pages}
+
+
+class LogCompactionJob:
+    """Runs `compact_log_database` in the background every `LOG_COMPACTION_INTERVAL_SECONDS`."""
+
+    def __init__(self, interval_seconds: int) -> None:
+        self.interval_seconds = interval_seconds
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """Start the background job on the running event loop, unless it is disabled."""
+        if self.interval_seconds <= 0 or sqlite_session.sqlite_engine is None:
+            logger.info("Log compaction job is disabled.")
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="log-compaction")
+
+    async def stop(self) -> None:
+        """Cancel the background job and wait for it to finish its current unit of work."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await compact_log_database()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metrics.increment("log_retention.failed")
+                logger.error(f"Log compaction failed: {e}", exc_info=True)
+            await asyncio.sleep(self.interval_seconds)
+
+
+def main(argv: List[str] | None = None) -> int:
+    """Command line entry point; runs one compaction pass and prints its result as JSON."""
+    parser = argparse.ArgumentParser(description="Compact the VQLForge query log database.")
+    parser.add_argument("--convert-auto-vacuum", action="store_true",
+                        help="Convert a database without incremental auto-vacuum first (full VACUUM, locks the database).")
+    args = parser.parse_args(argv)
+
+    init_sqlite_db()
+    if args.convert_auto_vacuum:
+        with sqlite_session_scope() as db:
+            converted = ensure_incremental_auto_vacuum(db)
+        logger.info("Converted the log database to incremental auto-vacuum." if converted
+                    else "The log database already uses incremental auto-vacuum.")
+    print(json.dumps(asyncio.run(compact_log_database())))
+    return 0
+
+
+log_compaction_job = LogCompactionJob(settings.LOG_COMPACTION_INTERVAL_SECONDS)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
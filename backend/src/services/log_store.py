@@ -0,0 +1,399 @@
+"""
+Persistence of accepted SQL-to-VQL pairs.
+
+This module turns accepted-query log requests into rows of the logging
+database: the `accepted_queries` entry itself, its referenced tables in the
+`accepted_query_tables` junction and its signature in the similarity index.
+Repeated acceptances of the same pair are merged into one row that counts
+its occurrences.
+
+It also reads the log back page by page with keyset cursors, searches it
+through the `accepted_queries_fts` full-text index and streams exports as
+NDJSON or CSV. The functions are synchronous and expect to run on
+the SQLite thread pool.
+"""
+
+import base64
+import csv
+import datetime
+import io
+import json
+import logging
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple
+
+from sqlalchemy import insert, select, text, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Query, Session
+from sqlglot import exp, parse_one
+
+from src.schemas.db_log import (
+    AcceptedQuery,
+    AcceptedQueryLogRequest,
+    AcceptedQuerySearchResult,
+    AcceptedQueryTable,
+    QueryLshBucket,
+    QuerySignature,
+)
+from src.db.sqlite_session import sqlite_session_scope
+from src.utils.metrics import metrics
+from src.utils.query_similarity import (
+    accepted_query_fingerprint,
+    minhash_signature,
+    query_shingles,
+    similarity_index_rows,
+)
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class PreparedAcceptedQuery:
+    """An accepted query with everything derived from parsing its source SQL, ready to be written.
+
+    Preparing is the CPU-heavy part of logging; instances are picklable so
+    bulk imports can prepare them in worker processes.
+    """
+    source_sql: str
+    source_dialect: str
+    target_vql: str
+    tables: str  # JSON list of the referenced table names
+    table_refs: List[Tuple[str, Optional[str]]]  # distinct (table name, VDB) pairs for the junction
+    content_hash: str
+    signature: Optional[List[int]]
+
+
+def prepare_accepted_query(source_sql: str, source_dialect: str, target_vql: str) -> PreparedAcceptedQuery:
+    """Parse the source SQL once and derive the tables, the content fingerprint and the similarity signature.
+
+    Raises:
+        sqlglot.errors.ParseError: If the source SQL cannot be parsed.
+    """
+    source_tree = parse_one(source_sql, read=source_dialect)
+    parsed_tables: List[exp.Table] = list(source_tree.find_all(exp.Table))
+    try:
+        signature = minhash_signature(query_shingles(source_sql, source_dialect, source_tree))
+    except Exception as e:
+        logger.warning(f"Could not compute the similarity signature of an accepted query: {e}")
+        signature = None
+    return PreparedAcceptedQuery(
+        source_sql=source_sql,
+        source_dialect=source_dialect,
+        target_vql=target_vql,
+        tables=json.dumps([table.name for table in parsed_tables]),
+        table_refs=sorted({(table.name, table.db or None) for table in parsed_tables if table.name},
+                          key=lambda ref: (ref[0], ref[1] or "")),
+        content_hash=accepted_query_fingerprint(source_dialect, source_sql, target_vql, source_tree),
+        signature=signature,
+    )
+
+
+def _insert_index_rows(db: Session, entries: List[Tuple[int, PreparedAcceptedQuery]]) -> None:
+    """Insert the table junction and similarity index rows of newly added entries with executemany."""
+    table_rows = [
+        {"query_id": entry_id, "table_name": table_name, "vdb": vdb}
+        for entry_id, prepared in entries for table_name, vdb in prepared.table_refs
+    ]
+    signature_rows, bucket_rows = [], []
+    for entry_id, prepared in entries:
+        if prepared.signature is not None:
+            signature_row, buckets = similarity_index_rows(entry_id, prepared.signature)
+            signature_rows.append(signature_row)
+            bucket_rows.extend(buckets)
+    for table, rows in ((AcceptedQueryTable.__table__, table_rows),
+                        (QuerySignature.__table__, signature_rows),
+                        (QueryLshBucket.__table__, bucket_rows)):
+        if rows:
+            db.execute(insert(table), rows)
+
+
+def _upsert_statement(now: datetime.datetime):
+    statement = sqlite_insert(AcceptedQuery.__table__)
+    return statement.on_conflict_do_update(
+        index_elements=[AcceptedQuery.content_hash],
+        set_={"occurrence_count": AcceptedQuery.occurrence_count + statement.excluded.occurrence_count,
+              "last_seen": now},
+    )
+
+
+def _entry_values(prepared: PreparedAcceptedQuery, now: datetime.datetime, occurrence_count: int = 1) -> dict:
+    return {
+        "timestamp": now,
+        "last_seen": now,
+        "source_sql": prepared.source_sql,
+        "source_dialect": prepared.source_dialect,
+        "target_vql": prepared.target_vql,
+        "tables": prepared.tables,
+        "content_hash": prepared.content_hash,
+        "occurrence_count": occurrence_count,
+    }
+
+
+def add_accepted_query(db: Session, request: AcceptedQueryLogRequest) -> AcceptedQuery:
+    """Upsert an accepted query, with its table junction rows and similarity signature, in the session.
+
+    Accepted pairs are deduplicated by their content fingerprint: accepting a
+    pair that is already logged increments its `occurrence_count` and
+    updates `last_seen` instead of adding a row. The upsert is a single
+    `INSERT ... ON CONFLICT` statement, so concurrent writers cannot create
+    duplicates. The caller commits.
+
+    Raises:
+        sqlglot.errors.ParseError: If the source SQL cannot be parsed; nothing
+                                   is written in that case.
+    """
+    prepared = prepare_accepted_query(request.source_sql, request.source_dialect, request.target_vql)
+    now = datetime.datetime.utcnow()
+    statement = (
+        _upsert_statement(now)
+        .values(**_entry_values(prepared, now))
+        .returning(AcceptedQuery.id, AcceptedQuery.occurrence_count)
+    )
+    entry_id, occurrence_count = db.execute(statement).one()
+    if occurrence_count > 1:
+        metrics.increment("log_store.duplicates")
+    else:
+        _insert_index_rows(db, [(entry_id, prepared)])
+    return db.get(AcceptedQuery, entry_id, populate_existing=True)
+
+
+def _upsert_prepared(db: Session, batch: List[PreparedAcceptedQuery]) -> Tuple[dict[str, int], int]:
+    """Upsert a batch of prepared accepted queries with one executemany statement; the caller commits.
+
+    Duplicates within the batch are merged before writing. The upsert
+    returns the occurrence count of every written row: a row this batch
+    inserted counts exactly its occurrences in the batch, while a merged row
+    also counts its earlier ones. Only inserted rows get junction and index
+    rows.
+
+    Returns:
+        The entry id of every content hash in the batch and the number of added entries.
+    """
+    now = datetime.datetime.utcnow()
+    unique: dict[str, PreparedAcceptedQuery] = {}
+    counts: dict[str, int] = {}
+    for prepared in batch:
+        unique.setdefault(prepared.content_hash, prepared)
+        counts[prepared.content_hash] = counts.get(prepared.content_hash, 0) + 1
+    if not unique:
+        return {}, 0
+
+    rows = db.execute(
+        _upsert_statement(now).returning(
+            AcceptedQuery.id, AcceptedQuery.content_hash, AcceptedQuery.occurrence_count),
+        [_entry_values(prepared, now, counts[content_hash]) for content_hash, prepared in unique.items()],
+    ).all()
+    added: List[Tuple[int, PreparedAcceptedQuery]] = [
+        (entry_id, unique[content_hash])
+        for entry_id, content_hash, occurrence_count in rows if occurrence_count == counts[content_hash]
+    ]
+    _insert_index_rows(db, added)
+    return {content_hash: entry_id for entry_id, content_hash, _ in rows}, len(added)
+
+
+def write_prepared_accepted_queries(db: Session, batch: List[PreparedAcceptedQuery]) -> Tuple[int, int]:
+    """Upsert a batch of prepared accepted queries with executemany and commit them in one transaction.
+
+    Returns:
+        The number of added entries and the number merged into existing ones.
+    """
+    _, added = _upsert_prepared(db, batch)
+    db.commit()
+    return added, len(batch) - added
+
+
+def write_accepted_queries(db: Session, requests: List[AcceptedQueryLogRequest]) -> List[int]:
+    """Write a batch of accepted queries in a single transaction.
+
+    All entries are prepared first; those whose source SQL cannot be parsed
+    are skipped and logged. The rest are upserted together and committed
+    once.
+
+    Returns:
+        The ids of the written entries, in request order.
+    """
+    batch: List[PreparedAcceptedQuery] = []
+    for request in requests:
+        try:
+            batch.append(prepare_accepted_query(request.source_sql, request.source_dialect, request.target_vql))
+        except Exception as e:
+            logger.error(f"Skipping accepted query that could not be logged: {e}")
+    entry_ids, added = _upsert_prepared(db, batch)
+    db.commit()
+    if len(batch) > added:
+        metrics.increment("log_store.duplicates", len(batch) - added)
+    return [entry_ids[prepared.content_hash] for prepared in batch]
+
+
+def encode_log_cursor(timestamp: datetime.datetime, entry_id: int) -> str:
+    """Encode the sort key of the last entry of a page into an opaque cursor."""
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{entry_id}".encode()).decode()
+
+
+def decode_log_cursor(cursor: str) -> Tuple[datetime.datetime, int]:
+    """Decode a cursor created by `encode_log_cursor`.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        timestamp, entry_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.datetime.fromisoformat(timestamp), int(entry_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor '{cursor}'.") from e
+
+
+def paginate_accepted_queries(
+    query: Query, cursor: Optional[str], limit: int
+) -> Tuple[List[AcceptedQuery], Optional[str]]:
+    """Return one page of accepted queries, most recent first, using keyset pagination.
+
+    Entries are ordered by (timestamp, id) descending, which the
+    `ix_accepted_queries_timestamp_id` index serves directly, so a page costs
+    the same no matter how deep into the log it is.
+
+    Args:
+        query: An ORM query over `AcceptedQuery`, possibly filtered.
+        cursor: The `next_cursor` of the previous page, or None for the first page.
+        limit: The page size.
+
+    Returns:
+        The entries of the page and the cursor of the next page (None on the last page).
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    if cursor:
+        timestamp, entry_id = decode_log_cursor(cursor)
+        query = query.filter(tuple_(AcceptedQuery.timestamp, AcceptedQuery.id) < tuple_(timestamp, entry_id))
+    entries: List[AcceptedQuery] = (
+        query.order_by(AcceptedQuery.timestamp.desc(), AcceptedQuery.id.desc()).limit(limit + 1).all()
+    )
+    if len(entries) <= limit:
+        return entries, None
+    entries = entries[:limit]
+    return entries, encode_log_cursor(entries[-1].timestamp, entries[-1].id)
+
+
+# Column weights of the bm25 ranking: source_sql, target_vql, tables.
+SEARCH_COLUMN_WEIGHTS = (1.0, 1.0, 2.0)
+SEARCH_SNIPPET_TOKENS = 16
+
+
+def build_fts_query(search: str) -> str:
+    """Turn free-text user input into an FTS5 query matching all of its terms.
+
+    Every whitespace-separated term becomes a quoted FTS5 string, so SQL
+    punctuation and FTS5 operators in the input are matched literally
+    instead of being interpreted. A trailing `*` on a term keeps its meaning
+    as a prefix search.
+    """
+    terms = []
+    for term in search.split():
+        prefix = term.endswith("*") and len(term) > 1
+        term = term.rstrip("*")
+        if term:
+            terms.append('"' + term.replace('"', '""') + '"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+def search_accepted_queries(
+    db: Session,
+    search: str,
+    dialect: Optional[str] = None,
+    limit: int = 20,
+    highlight: Tuple[str, str] = ("<mark>", "</mark>"),
+) -> List[AcceptedQuerySearchResult]:
+    """Search accepted queries with the FTS5 index, best matches first.
+
+    Args:
+        db: The SQLite session.
+        search: Free-text search terms, e.g. a column or function name.
+        dialect: Restrict results to this source dialect, if given.
+        limit: The maximum number of results.
+        highlight: The markers placed around matched terms in the snippets.
+
+    Returns:
+        The matching entries with their bm25 rank and highlighted snippets.
+    """
+    fts_query = build_fts_query(search)
+    if not fts_query:
+        return []
+    weights = ", ".join(str(weight) for weight in SEARCH_COLUMN_WEIGHTS)
+    statement = f"""
+        SELECT accepted_queries.id, accepted_queries.timestamp, accepted_queries.source_dialect,
+               accepted_queries.source_sql, accepted_queries.target_vql, accepted_queries.tables,
+               accepted_queries.occurrence_count, accepted_queries.last_seen,
+               bm25(accepted_queries_fts, {weights}) AS rank,
+               snippet(accepted_queries_fts, 0, :mark_start, :mark_end, '…', {SEARCH_SNIPPET_TOKENS}) AS source_snippet,
+               snippet(accepted_queries_fts, 1, :mark_start, :mark_end, '…', {SEARCH_SNIPPET_TOKENS}) AS target_snippet
+        FROM accepted_queries_fts
+        JOIN accepted_queries ON accepted_queries.id = accepted_queries_fts.rowid
+        WHERE accepted_queries_fts MATCH :query
+          {"AND accepted_queries.source_dialect = :dialect" if dialect else ""}
+        ORDER BY rank
+        LIMIT :limit
+    """
+    rows = db.execute(text(statement), {
+        "query": fts_query, "dialect": dialect, "limit": limit,
+        "mark_start": highlight[0], "mark_end": highlight[1],
+    })
+    return [AcceptedQuerySearchResult(**row._asdict()) for row in rows]
+
+
+EXPORT_COLUMNS = (
+    "id", "timestamp", "source_dialect", "source_sql", "target_vql", "tables", "occurrence_count", "last_seen",
+)
+# Rows fetched from the cursor and written per chunk of the export stream.
+EXPORT_CHUNK_ROWS = 1000
+
+
+def export_statement():
+    """Return the Core select of the exported columns of `accepted_queries`."""
+    return select(*(getattr(AcceptedQuery.__table__.c, name) for name in EXPORT_COLUMNS))
+
+
+def export_row_values(row) -> dict:
+    """Convert an exported row into JSON-serializable values; the format is readable by the bulk import."""
+    values = row._asdict()
+    for name in ("timestamp", "last_seen"):
+        if values[name] is not None:
+            values[name] = values[name].isoformat()
+    return values
+
+
+def export_accepted_queries(export_format: str, dialect: Optional[str] = None) -> Iterator[str]:
+    """Stream all accepted queries as NDJSON or CSV, oldest first.
+
+    Rows are read as plain Core tuples from a streaming cursor and written in
+    chunks, so memory use does not grow with the size of the log. The
+    generator holds its own session until it is exhausted or closed.
+
+    Args:
+        export_format: Either "ndjson" or "csv".
+        dialect: Only export entries of this source dialect, if given.
+
+    Yields:
+        Chunks of the export file.
+    """
+    statement = export_statement().order_by(AcceptedQuery.timestamp, AcceptedQuery.id)
+    if dialect:
+        statement = statement.where(AcceptedQuery.source_dialect == dialect)
+
+    with sqlite_session_scope() as db:
+        result = db.execute(statement.execution_options(stream_results=True, yield_per=EXPORT_CHUNK_ROWS))
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if export_format == "csv":
+            writer.writerow(EXPORT_COLUMNS)
+        for rows in result.partitions():
+            for row in rows:
+                values = export_row_values(row)
+                if export_format == "csv":
+                    writer.writerow(values.values())
+                else:
+                    buffer.write(json.dumps(values) + "\n")
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
@@ -0,0 +1,129 @@
+"""
+Write-behind queue for accepted-query logs.
+
+`POST /log/accepted` only enqueues the request and returns immediately. A
+background task collects queued entries into batches, flushed when the
+batch is full or `LOG_WRITE_FLUSH_INTERVAL` has passed since its first
+entry, and writes each batch in a single SQLite transaction on the SQLite
+thread pool, where the source SQL is also parsed for its tables. On
+shutdown the queue is drained before the SQLite thread pool is stopped.
+"""
+
+import asyncio
+import logging
+import time
+from typing import List
+
+from src.config import settings
+from src.db.sqlite_session import run_sqlite
+from src.schemas.db_log import AcceptedQueryLogRequest
+from src.services.log_store import write_accepted_queries
+from src.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class LogWriterClosedError(RuntimeError):
+    """Raised when an entry is enqueued while the writer is not running."""
+
+
+class AcceptedQueryWriter:
+    """Batches accepted-query log entries and writes them in the background."""
+
+    def __init__(self, batch_size: int, flush_interval: float, max_queue_size: int) -> None:
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self._queue: asyncio.Queue[AcceptedQueryLogRequest | None] | None = None
+        self._task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        """Start the background flush task on the running event loop."""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._task = asyncio.create_task(self._run(), name="accepted-query-writer")
+        logger.info(f"Accepted query log writer started (batch size {self.batch_size}, "
+                    f"flush interval {self.flush_interval}s).")
+
+    def enqueue(self, request: AcceptedQueryLogRequest) -> int:
+        """Queue an accepted query for writing.
+
+        Returns:
+            The number of entries waiting to be written, including this one.
+
+        Raises:
+            LogWriterClosedError: If the writer is not running.
+            asyncio.QueueFull: If the queue has reached `max_queue_size`.
+        """
+        if not self.running or self._queue is None:
+            raise LogWriterClosedError("The accepted query log writer is not running.")
+        self._queue.put_nowait(request)
+        metrics.set_gauge("log_writer.queue_depth", self._queue.qsize())
+        return self._queue.qsize()
+
+    async def drain(self) -> None:
+        """Write all queued entries and stop the background task. Called at application shutdown."""
+        if not self.running or self._queue is None:
+            return
+        logger.info(f"Draining accepted query log writer ({self._queue.qsize()} queued entries)...")
+        await self._queue.put(None)  # sentinel: everything queued before it is still written
+        await self._task
+        self._task = None
+        logger.info("Accepted query log writer stopped.")
+
+    async def _next_batch(self) -> tuple[List[AcceptedQueryLogRequest], bool]:
+        """Wait for the next batch; the flag is True once the shutdown sentinel was received."""
+        assert self._queue is not None
+        first = await self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                entry = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if entry is None:
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+    async def _flush(self, batch: List[AcceptedQueryLogRequest]) -> None:
+        started = time.monotonic()
+        try:
+            entry_ids = await run_sqlite(lambda db: write_accepted_queries(db, batch))
+        except Exception as e:
+            metrics.increment("log_writer.failed", len(batch))
+            logger.error(f"Failed to write a batch of {len(batch)} accepted queries: {e}", exc_info=True)
+            return
+        metrics.increment("log_writer.written", len(entry_ids))
+        metrics.increment("log_writer.rejected", len(batch) - len(entry_ids))
+        metrics.observe("log_writer.batch_size", len(batch))
+        metrics.observe("log_writer.flush_seconds", time.monotonic() - started)
+        logger.info(f"Logged {len(entry_ids)} of {len(batch)} accepted queries in one transaction.")
+
+    async def _run(self) -> None:
+        assert self._queue is not None
+        stopping = False
+        while not stopping:
+            batch, stopping = await self._next_batch()
+            if batch:
+                await self._flush(batch)
+            metrics.set_gauge("log_writer.queue_depth", self._queue.qsize())
+
+
+accepted_query_writer = AcceptedQueryWriter(
+    batch_size=settings.LOG_WRITE_BATCH_SIZE,
+    flush_interval=settings.LOG_WRITE_FLUSH_INTERVAL,
+    max_queue_size=settings.LOG_WRITE_QUEUE_SIZE,
+)
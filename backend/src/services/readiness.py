@@ -0,0 +1,163 @@
+"""
+Readiness of the service, probed in the background.
+
+`/health` only tells that the process answers; `/ready` tells whether it can
+serve requests. A background prober checks every
+`READINESS_PROBE_INTERVAL_SECONDS` that Denodo answers a statement on a
+pooled connection, that the SQLite log database answers a query and that the
+configured LLM provider is reachable, and caches the results. `/ready` only
+reads the cache, so it is O(1) and never opens a connection on the request
+path. A result older than three probe intervals counts as failed, e.g. when
+the prober hangs. An unreachable LLM provider only makes the service unready
+with `READINESS_REQUIRE_LLM`, since translation and validation work without it.
+"""
+
+import asyncio
+import datetime
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+import httpx
+from sqlalchemy import text
+
+from src.config import settings
+from src.db import session, sqlite_session
+from src.db.sqlite_session import run_sqlite
+from src.schemas.common import DependencyStatus, ReadinessResponse
+from src.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+GEMINI_API_URL = "https://generativelanguage.googleapis.com"
+
+
+async def probe_denodo() -> Optional[str]:
+    """Run `SELECT 1` on a pooled Denodo connection; return an error, or None if it answered."""
+    engine = session.engine
+    if engine is None:
+        error = session.denodo_connector.last_error
+        return f"Not connected: {error}" if error else "Not connected yet."
+
+    def ping() -> None:
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+
+    # Not through `run_denodo`: a probe must not wait behind busy statements for a slot.
+    await asyncio.to_thread(ping)
+    return None
+
+
+async def probe_sqlite() -> Optional[str]:
+    """Run a query on the SQLite log database; return an error, or None if it answered."""
+    if sqlite_session.sqlite_engine is None:
+        return "The log database is not initialized."
+    await run_sqlite(lambda db: db.execute(text("SELECT 1")))
+    return None
+
+
+async def probe_llm_provider() -> Optional[str]:
+    """Connect to the configured LLM provider's API; any HTTP response counts as reachable.
+
+    No model is called, so the probe uses no tokens.
+    """
+    if settings.OPENAI_API_KEY:
+        url = settings.AZURE_OPENAI_ENDPOINT
+    elif settings.GEMINI_API_KEY:
+        url = GEMINI_API_URL
+    else:
+        return "No LLM provider is configured."
+    async with httpx.AsyncClient(timeout=settings.READINESS_PROBE_TIMEOUT_SECONDS) as client:
+        await client.head(url)
+    return None
+
+
+class ReadinessProber:
+    """Probes the dependencies of the service in the background and caches their status."""
+
+    def __init__(self, interval_seconds: float, timeout_seconds: float) -> None:
+        self.interval_seconds = interval_seconds
+        self.timeout_seconds = timeout_seconds
+        self.probes: dict[str, tuple[Callable[[], Awaitable[Optional[str]]], bool]] = {
+            "denodo": (probe_denodo, True),
+            "sqlite": (probe_sqlite, True),
+            "llm": (probe_llm_provider, settings.READINESS_REQUIRE_LLM),
+        }
+        self._statuses: dict[str, DependencyStatus] = {}
+        self._running: dict[str, asyncio.Task] = {}
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """Start probing on the running event loop; the first probe runs right away."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="readiness-prober")
+
+    async def stop(self) -> None:
+        tasks = [task for task in (self._task, *self._running.values()) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._running = {}
+
+    def report(self) -> ReadinessResponse:
+        """Return the cached status of each dependency; ready if every critical one is up."""
+        max_age = datetime.timedelta(seconds=3 * self.interval_seconds)
+        now = datetime.datetime.utcnow()
+        checks = []
+        for name, (_, critical) in self.probes.items():
+            status = self._statuses.get(name)
+            if status is None:
+                status = DependencyStatus(name=name, ok=False, critical=critical, detail="Not probed yet.")
+            elif now - status.checked_at > max_age:
+                status = status.model_copy(update={"ok": False, "detail": "The last probe result is outdated."})
+            checks.append(status)
+        return ReadinessResponse(ready=all(check.ok for check in checks if check.critical), checks=checks)
+
+    async def probe_all(self) -> None:
+        """Run all probes concurrently and cache their results."""
+        await asyncio.gather(*(self._probe(name) for name in self.probes))
+        ready = self.report().ready
+        metrics.set_gauge("readiness.ready", int(ready))
+
+    async def _probe(self, name: str) -> None:
+        probe, critical = self.probes[name]
+        started = time.monotonic()
+        running = self._running.get(name)
+        if running is not None and not running.done():
+            # A hung probe, e.g. a Denodo connection that does not time out, is not piled up on.
+            error = "The previous probe has not finished yet."
+        else:
+            task = self._running[name] = asyncio.create_task(probe(), name=f"readiness-probe-{name}")
+            task.add_done_callback(lambda finished: finished.cancelled() or finished.exception())
+            try:
+                error = await asyncio.wait_for(asyncio.shield(task), timeout=self.timeout_seconds)
+            except asyncio.TimeoutError:
+                error = f"No answer within {self.timeout_seconds:g}s."
+            except Exception as e:
+                error = str(e) or type(e).__name__
+        seconds = time.monotonic() - started
+        previous = self._statuses.get(name)
+        if error is not None and (previous is None or previous.ok):
+            logger.warning(f"Readiness probe '{name}' failed: {error}")
+        elif previous is not None and not previous.ok and error is None:
+            logger.info(f"Readiness probe '{name}' succeeded again.")
+        self._statuses[name] = DependencyStatus(
+            name=name, ok=error is None, critical=critical, detail=error,
+            latency_ms=round(seconds * 1000, 1), checked_at=datetime.datetime.utcnow(),
+        )
+        metrics.set_gauge(f"readiness.{name}", int(error is None))
+        metrics.observe(f"readiness.probe_seconds.{name}", seconds)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.probe_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Readiness probing failed: {e}", exc_info=True)
+            await asyncio.sleep(self.interval_seconds)
+
+
+readiness_prober = ReadinessProber(settings.READINESS_PROBE_INTERVAL_SECONDS, settings.READINESS_PROBE_TIMEOUT_SECONDS)
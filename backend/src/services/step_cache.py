@@ -0,0 +1,115 @@
+"""
+Memoization of forge pipeline steps.
+
+Each expensive step of the forge pipeline, the translation, the validation
+with its correction and the explanation, is stored in the SQLite
+`forge_step_cache` table under a hash of the step name and all of its
+inputs. A rerun of the same request replays the known steps from the cache
+and only recomputes from the first step whose inputs differ. Entries
+expire after `FORGE_STEP_CACHE_TTL_SECONDS`, since a validation depends on
+the views in Denodo at that time; expired entries are removed by the log
+compaction job.
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+from typing import Any, Awaitable, Callable, TypeVar
+
+from pydantic import TypeAdapter
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from src.config import settings
+from src.db.sqlite_session import run_sqlite
+from src.schemas.db_log import ForgeStepCacheEntry
+from src.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Bump to invalidate all memoized steps when the pipeline changes their outputs.
+STEP_CACHE_VERSION = 1
+
+T = TypeVar("T")
+
+
+def step_cache_key(step: str, inputs: dict[str, Any]) -> str:
+    """Return the cache key of a step: a hash of its name, its inputs and the cache version."""
+    payload = json.dumps({"version": STEP_CACHE_VERSION, "step": step, "inputs": inputs}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def read_cached_step(db: Session, key: str) -> str | None:
+    """Return the JSON output stored under `key`, unless it does not exist or has expired."""
+    return db.scalar(select(ForgeStepCacheEntry.value).where(
+        ForgeStepCacheEntry.key == key, ForgeStepCacheEntry.expires_at > datetime.datetime.utcnow()))
+
+
+def write_cached_step(db: Session, key: str, step: str, value: str, ttl_seconds: int) -> None:
+    """Store the JSON output of a step under `key`, replacing an older entry."""
+    now = datetime.datetime.utcnow()
+    values = {"key": key, "step": step, "value": value, "created_at": now,
+              "expires_at": now + datetime.timedelta(seconds=ttl_seconds)}
+    db.execute(insert(ForgeStepCacheEntry).values(**values).on_conflict_do_update(
+        index_elements=[ForgeStepCacheEntry.key], set_=values))
+    db.commit()
+
+
+def purge_expired_steps(db: Session) -> int:
+    """Delete expired cache entries and return their number."""
+    deleted = db.execute(
+        delete(ForgeStepCacheEntry).where(ForgeStepCacheEntry.expires_at <= datetime.datetime.utcnow())).rowcount
+    db.commit()
+    return deleted
+
+
+async def memoize_step(
+    step: str,
+    inputs: dict[str, Any],
+    compute: Callable[[], Awaitable[T]],
+    output_type: type[T],
+    cacheable: Callable[[T], bool] = lambda output: True,
+    enabled: bool = True,
+) -> tuple[T, bool]:
+    """Return the memoized output of a step, or compute and memoize it.
+
+    A failing cache read or write is logged and otherwise ignored; the step
+    is then simply computed.
+
+    Args:
+        step: The step name, e.g. "translate".
+        inputs: Everything the step output depends on; must be JSON serializable.
+        compute: Computes the step output on a cache miss.
+        output_type: The type of the output, used to (de)serialize it.
+        cacheable: Decides whether a computed output is stored, e.g. not after a transient failure.
+        enabled: False to bypass the cache for this run, without storing the output.
+
+    Returns:
+        The step output and whether it was replayed from the cache.
+    """
+    ttl_seconds = settings.FORGE_STEP_CACHE_TTL_SECONDS
+    if not enabled or ttl_seconds <= 0:
+        return await compute(), False
+
+    adapter = TypeAdapter(output_type)
+    key = step_cache_key(step, inputs)
+    try:
+        cached = await run_sqlite(lambda db: read_cached_step(db, key))
+    except Exception as e:
+        logger.warning(f"Could not read the memoized '{step}' step: {e}")
+        cached = None
+    if cached is not None:
+        metrics.increment(f"step_cache.hit.{step}")
+        return adapter.validate_json(cached), True
+
+    metrics.increment(f"step_cache.miss.{step}")
+    output = await compute()
+    if cacheable(output):
+        value = adapter.dump_json(output).decode()
+        try:
+            await run_sqlite(lambda db: write_cached_step(db, key, step, value, ttl_seconds))
+        except Exception as e:
+            logger.warning(f"Could not memoize the '{step}' step: {e}")
+    return output, False
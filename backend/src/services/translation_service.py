@@ -14,6 +14,7 @@ from fastapi import HTTPException
 
 from src.schemas.translation import TranslateApiResponse, AIAnalysis
 from src.utils.ai_analyzer import analyze_sql_translation_error
+from src.utils.llm_scheduler import label_usage, over_token_budget
 from src.utils.vdb_transformer import transform_vdb_table_qualification
 from src.utils.dual_transformer import transform_dual_function
 
@@ -31,7 +32,7 @@ async def run_translation(source_sql: str, dialect: str, vdb: str) -> TranslateA
 
     If a `ParseError` occurs, it invokes an AI service to analyze the error
     and the source SQL, aiming to provide a meaningful explanation and a
-    suggested fix.
+    suggested fix, unless the LLM token budget is used up.
 
     Args:
         source_sql: The raw SQL string to be translated.
@@ -51,6 +52,7 @@ async def run_translation(source_sql: str, dialect: str, vdb: str) -> TranslateA
                        the API layer.
     """
     logger.debug(f"Running translation: dialect='{dialect}', vdb='{vdb}', SQL='{source_sql[:100]}...'")
+    label_usage(vdb)
 
     try:
         expression_tree = parse_one(source_sql, read=dialect)
@@ -65,6 +67,9 @@ async def run_translation(source_sql: str, dialect: str, vdb: str) -> TranslateA
 
     except ParseError as pe:
         logger.warning(f"SQL Parsing Error during translation: {pe}", exc_info=True)
+        if over_token_budget("translation_analysis"):
+            return TranslateApiResponse(
+                message=f"SQL parsing failed: {pe}. The AI analysis was skipped, the LLM token budget is used up.")
         try:
             ai_analysis_result: AIAnalysis = await analyze_sql_translation_error(str(pe), source_sql)
             return TranslateApiResponse(error_analysis=ai_analysis_result)
@@ -4,62 +4,182 @@ import logging
 import asyncio
 from fastapi import HTTPException
 import re
+from typing import Collection
+from sqlglot.dialects.dialect import Dialect
+from sqlglot.errors import SqlglotError
+from sqlglot.tokens import TokenType
 from sqlalchemy import text
+from sqlalchemy.engine import Connection
 from sqlalchemy.exc import OperationalError, ProgrammingError, SQLAlchemyError
 
 from src.schemas.validation import VqlValidationApiResponse, VqlValidateRequest
 from src.schemas.translation import AIAnalysis
 from src.utils.ai_analyzer import analyze_vql_validation_error
-from src.db.session import get_engine
+from src.utils.llm_scheduler import label_usage, over_token_budget
+from src.utils.vql_autofix import apply_rule_based_fixes
+from src.db.session import get_engine, run_denodo
+from src.utils.metrics import metrics
+from src.config import settings
 
 logger = logging.getLogger(__name__)
 
 
-async def run_validation(request: VqlValidateRequest) -> VqlValidationApiResponse:
+def _strip_top_level_limit(vql: str) -> str:
+    """Cut the top-level LIMIT and OFFSET clauses out of a VQL query, keeping the rest of its text as written."""
+    tokens = Dialect.get_or_raise("denodo").tokenize(vql)
+    spans: list[tuple[int, int]] = []
+    depth = 0
+    for index, token in enumerate(tokens):
+        if token.token_type == TokenType.L_PAREN:
+            depth += 1
+        elif token.token_type == TokenType.R_PAREN:
+            depth -= 1
+        elif depth == 0 and token.token_type in (TokenType.LIMIT, TokenType.OFFSET):
+            # The clause is the keyword and its row count.
+            end = tokens[index + 1].end if index + 1 < len(tokens) else token.end
+            spans.append((token.start, end + 1))
+    for start, end in reversed(spans):
+        vql = vql[:start] + vql[end:]
+    return vql
+
+
+def _build_queryplan_vql(vql: str) -> str:
+    """Wrap a VQL query in a `DESC QUERYPLAN` statement.
+
+    DESC QUERYPLAN throws a syntax error when the query has LIMIT, so the
+    top-level LIMIT/OFFSET clauses are cut out of the query; the rest is
+    validated exactly as written. If the VQL cannot be tokenized, everything
+    from the first LIMIT on is cut off instead.
+    """
+    try:
+        return f"DESC QUERYPLAN {_strip_top_level_limit(vql)}"
+    except SqlglotError:
+        limit_match = re.search(r"LIMIT\s+\d+", vql)
+        if limit_match:
+            return f"DESC QUERYPLAN {vql[:limit_match.start()]}"
+        return f"DESC QUERYPLAN {vql}"
+
+
+async def _run_queryplan(vql: str) -> Exception | None:
+    """Run `DESC QUERYPLAN` for a VQL query on a Denodo worker thread.
+
+    Returns:
+        None if Denodo accepted the query plan, otherwise the raised exception.
+    """
+    desc_query_plan_vql: str = _build_queryplan_vql(vql)
+
+    # This synchronous function is executed in a separate thread to prevent blocking.
+    def db_call(connection: Connection):
+        try:
+            connection.execute(text(desc_query_plan_vql))
+            return None  # Success case
+        except (OperationalError, ProgrammingError) as e:
+            return e  # Return exception to be handled in async context
+        except SQLAlchemyError as e:
+            return e
+        except Exception as e:
+            return e
+
+    try:
+        return await run_denodo(db_call)
+    except SQLAlchemyError as e:  # the connection itself failed
+        return e
+
+
+async def find_first_valid_candidate(candidates: list[str], known_invalid: Collection[str] = (),
+                                     errors: dict[str, Exception] | None = None) -> int | None:
+    """Validate candidate VQL queries concurrently and return the index of the first valid one.
+
+    All candidates are checked with `DESC QUERYPLAN` at the same time. As soon
+    as one is valid, the remaining checks are cancelled: queued checks are
+    abandoned and running statements are cancelled on the server. If several
+    candidates finish valid at once, the one listed first wins. A check that
+    fails with an exception counts as invalid.
+
+    Args:
+        candidates: The candidate VQL queries, most likely first.
+        known_invalid: Queries that already failed validation; candidates
+                       among them are skipped instead of checked again.
+        errors: If given, the validation error of every candidate found
+                invalid is stored in it, keyed by its VQL.
+
+    Returns:
+        The index of the winning candidate, or None if none is valid.
+
+    Raises:
+        HTTPException: If the database connection is unavailable.
+    """
+    try:
+        get_engine()
+    except ConnectionError:  # not connected (yet)
+        raise HTTPException(
+            status_code=503,
+            detail="Database connection is not available. Check server logs.",
+        )
+    tasks = {asyncio.create_task(_run_queryplan(vql)): index
+             for index, vql in enumerate(candidates) if vql not in known_invalid}
+    pending = set(tasks)
+    winner: int | None = None
+    try:
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            valid = []
+            for task in done:
+                if task.exception() is not None:
+                    logger.warning(f"Could not validate candidate {tasks[task] + 1}: {task.exception()}")
+                elif task.result() is None:
+                    valid.append(tasks[task])
+                elif errors is not None:
+                    errors[candidates[tasks[task]]] = task.result()
+            if valid:
+                winner = min(valid)
+    finally:
+        for task in pending:
+            task.cancel()
+        metrics.increment("speculative.candidates", len(tasks))
+        metrics.increment("speculative.cancelled", len(pending))
+    metrics.increment("speculative.hit" if winner is not None else "speculative.miss")
+    logger.info(f"Validated {len(candidates)} candidate corrections concurrently, winner: {winner}.")
+    return winner
+
+
+async def run_validation(request: VqlValidateRequest, candidates: int = 1,
+                         error: Exception | None = None) -> VqlValidationApiResponse:
     """Validates a VQL query using a `DESC QUERYPLAN` statement.
 
     This check is run in a separate thread to avoid blocking. If validation
-    fails, an AI service is called to analyze the error.
+    fails, the deterministic fix rules are tried first; only if none of them
+    produces a valid query is an AI service called to analyze the error,
+    unless the LLM token budget is used up.
 
     Args:
         request: The VQL and its original SQL context.
+        candidates: The number of candidate corrections to request from the AI.
+        error: The error of an earlier `DESC QUERYPLAN` of the same VQL; if
+               given, the query is not validated again.
 
     Returns:
-        A validation response, with AI analysis on failure.
+        A validation response, with a rule-based or AI analysis on failure.
 
     Raises:
         HTTPException: If the database connection is unavailable.
     """
-    engine = get_engine()
-    if engine is None:
+    try:
+        get_engine()
+    except ConnectionError:  # not connected (yet)
         raise HTTPException(
             status_code=503,
             detail="Database connection is not available. Check server logs.",
         )
-    # DESC QUERYPLAN throws a syntax error when the query has LIMIT
-    limit_match = re.search(r"LIMIT\s+\d+", request.vql)
-    if limit_match:
-        vql_without_limit = request.vql[:limit_match.start()]
-        desc_query_plan_vql: str = f"DESC QUERYPLAN {vql_without_limit}"
-    else:
-        desc_query_plan_vql: str = f"DESC QUERYPLAN {request.vql}"
     logger.info(f"Attempting to validate VQL (via DESC QUERYPLAN): {request.vql[:100]}...")
+    label_usage(request.vdb)
 
-    # This synchronous function is executed in a separate thread to prevent blocking.
-    def db_call():
-        try:
-            with engine.connect() as connection:
-                connection.execute(text(desc_query_plan_vql))
-            return None  # Success case
-        except (OperationalError, ProgrammingError) as e:
-            return e  # Return exception to be handled in async context
-        except SQLAlchemyError as e:
-            return e
-        except Exception as e:
-            return e
+    async def check_vql(vql: str) -> str | None:
+        error = await _run_queryplan(vql)
+        return None if error is None else str(getattr(error, "orig", error))
 
     try:
-        result = await asyncio.to_thread(db_call)
+        result = error if error is not None else await _run_queryplan(request.vql)
         if result is None:
             logger.info("VQL validation successful via DESC QUERYPLAN.")
             return VqlValidationApiResponse(
@@ -72,8 +192,18 @@ async def run_validation(request: VqlValidateRequest) -> VqlValidationApiRespons
     except (OperationalError, ProgrammingError) as e:
         db_error_message = str(getattr(e, "orig", e))
         logger.warning(f"Denodo VQL validation failed: {db_error_message}")
+        if settings.AUTOFIX_ENABLED:
+            rule_based_fix: AIAnalysis | None = await apply_rule_based_fixes(db_error_message, request, check_vql)
+            if rule_based_fix:
+                return VqlValidationApiResponse(validated=False, error_analysis=rule_based_fix)
+        if over_token_budget("validation_analysis"):
+            return VqlValidationApiResponse(
+                validated=False,
+                message=f"Validation Failed: {db_error_message}. The AI analysis was skipped, "
+                        "the LLM token budget is used up.",
+            )
         try:
-            ai_analysis_result: AIAnalysis = await analyze_vql_validation_error(db_error_message, request)
+            ai_analysis_result: AIAnalysis = await analyze_vql_validation_error(db_error_message, request, candidates)
             return VqlValidationApiResponse(
                 validated=False, error_analysis=ai_analysis_result
             )
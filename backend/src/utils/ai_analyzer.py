@@ -1,33 +1,35 @@
 # src/utils/ai_analyzer.py
 
+import datetime
 import logging
 from typing import Type, Set, List
 
+from sqlalchemy.orm import Session
 from sqlalchemy.orm.query import Query
-from sqlalchemy.sql.elements import BinaryExpression
-from sqlalchemy.sql.schema import Column
 from sqlglot import exp, parse_one
 from fastapi import HTTPException
 from pydantic_ai import Agent, RunContext, Tool
-from pydantic_ai.models.google import GoogleModel
-from pydantic_ai.providers.google import GoogleProvider
-from pydantic_ai.models.openai import OpenAIModel
-from pydantic_ai.providers.azure import AzureProvider
 
 from dataclasses import dataclass
-from sqlalchemy.orm import Session
-from sqlalchemy import or_
+from sqlalchemy import select
 
-from src.db.sqlite_session import get_sqlite_session
-from src.schemas.db_log import AcceptedQuery
+from src.db.sqlite_session import run_sqlite
+from src.schemas.db_log import AcceptedQuery, AcceptedQueryTable
+from src.services.log_store import search_accepted_queries
+from src.utils.query_similarity import find_similar_queries, recency_weighted_frequency
 
 from src.config import settings
 from src.schemas.translation import AIAnalysis
 from src.schemas.validation import VqlValidateRequest
 from src.utils.denodo_client import get_available_views_from_denodo, get_denodo_functions_list, get_vdb_names_list, get_view_cols
+from src.utils.context_budget import ContextBudgeter, extract_relevance_terms
+from src.utils.llm_scheduler import Priority, get_scheduler
 
 logger = logging.getLogger(__name__)
 
+# Candidates per history result that are ranked by recency-weighted frequency.
+HISTORY_CANDIDATE_FACTOR = 5
+
 
 @dataclass
 class Deps:
@@ -35,10 +37,27 @@ class Deps:
     vdb: str
     sql: str
     dialect: str
+    vql: str = ""
+    error: str = ""
+
+
+def _budget_tool_output(ctx: RunContext[Deps], tool_name: str, items: list) -> list:
+    """Rank a tool result by relevance to the failing VQL and cap it to the token budget."""
+    terms = extract_relevance_terms(ctx.deps.tables, ctx.deps.error, ctx.deps.vql)
+    return ContextBudgeter(terms, settings.AI_TOOL_TOKEN_BUDGET).fit(tool_name, items)
+
+
+def _provider_name() -> str:
+    """Return the name of the configured LLM provider, used to pick its scheduler."""
+    return "azure" if settings.OPENAI_API_KEY else "google"
 
 
 def _initialize_ai_agent(system_prompt: str, output_type: Type, tools: list[Tool] = []) -> Agent:
+    # The provider SDKs are heavy to import, so only the configured one is loaded, on first use.
     if settings.OPENAI_API_KEY:
+        from pydantic_ai.models.openai import OpenAIModel
+        from pydantic_ai.providers.azure import AzureProvider
+
         logger.info("Using OpenAI model.")
         model = OpenAIModel(
             settings.AI_MODEL_NAME,
@@ -49,6 +68,9 @@ def _initialize_ai_agent(system_prompt: str, output_type: Type, tools: list[Tool
             )
         )
     elif settings.GEMINI_API_KEY:
+        from pydantic_ai.models.google import GoogleModel
+        from pydantic_ai.providers.google import GoogleProvider
+
         logger.info("Using Gemini model.")
         model = GoogleModel(settings.AI_MODEL_NAME,
                             provider=GoogleProvider(api_key=settings.GEMINI_API_KEY))
@@ -69,52 +91,74 @@ def _initialize_ai_agent(system_prompt: str, output_type: Type, tools: list[Tool
 
 async def get_history_query_list(sql: str, tables: Set[str], dialect: str) -> List[str]:
     """
-    Retrieves historical VQL queries from the database based on table names.
-    This function now directly queries the SQLite database.
+    Retrieves historical VQL queries from the database.
+    The most structurally similar accepted queries are looked up in the similarity
+    index first; if there are none, queries referencing the same tables are used,
+    ranked by their recency-weighted frequency.
     """
-    if not tables:
-        return []
-
-    # Manually obtain and manage a database session for this function
-    db: Session = get_sqlite_session()
-    try:
-        conditions: List[BinaryExpression[bool]] = [AcceptedQuery.tables.like(f'%"{table}"%') for table in tables]
+    def read_history(db: Session) -> List[dict[str, str]]:
+        logs: List[AcceptedQuery] = find_similar_queries(db, sql, dialect, settings.HISTORY_TOP_K)
 
-        # Combine conditions with OR logic and execute the query
-        query: Query[AcceptedQuery] = db.query(AcceptedQuery).filter(or_(*conditions))
+        if not logs and tables:
+            matching_ids = select(AcceptedQueryTable.query_id).where(AcceptedQueryTable.table_name.in_(tables))
+            query: Query[AcceptedQuery] = db.query(AcceptedQuery).filter(AcceptedQuery.id.in_(matching_ids))
 
-        if dialect:
-            query = query.filter(AcceptedQuery.source_dialect == dialect)
+            if dialect:
+                query = query.filter(AcceptedQuery.source_dialect == dialect)
 
-        query = query.order_by(AcceptedQuery.timestamp.desc()).limit(10)
+            # Rank the most recently seen candidates by how often they were accepted.
+            candidates: List[AcceptedQuery] = (
+                query.order_by(AcceptedQuery.last_seen.desc())
+                .limit(settings.HISTORY_TOP_K * HISTORY_CANDIDATE_FACTOR).all()
+            )
+            now = datetime.datetime.utcnow()
+            logs = sorted(candidates, key=lambda log: recency_weighted_frequency(log, now), reverse=True)
+            logs = logs[:settings.HISTORY_TOP_K]
 
-        history_vqls: List[dict[str, Column[str]]] = [
+        return [
             {"source_sql": log.source_sql, "target_vql": log.target_vql}
-            for log in query.all()
+            for log in logs
             if log.source_sql and log.target_vql]
-        return history_vqls
+
+    try:
+        # Runs on the SQLite thread pool so a large history lookup does not block the event loop.
+        return await run_sqlite(read_history)
     except Exception as e:
         logger.error(f"Failed to retrieve history queries from DB for tables {tables}: {e}", exc_info=True)
         return []
-    finally:
-        db.close()
 
 
 async def _get_history(ctx: RunContext[Deps]) -> list[str]:
     """Retrieves a list of correct translation and validation of queries. Use this tool always first to find already successful query translations."""
     logger.info("Executing _get_history_query_list tool")
-    return await get_history_query_list(ctx.deps.sql, ctx.deps.tables, ctx.deps.dialect)
+    history = await get_history_query_list(ctx.deps.sql, ctx.deps.tables, ctx.deps.dialect)
+    return _budget_tool_output(ctx, "get_history", history)
 
 
-async def _get_functions() -> list[str]:
+async def _search_history(ctx: RunContext[Deps], search_terms: str) -> list[dict[str, str]]:
+    """Searches successful query translations by full text, e.g. for a column, function or view name. Use this tool when the _get_history tool returned nothing relevant for the identifier in the error."""
+    logger.info(f"Executing _search_history tool for '{search_terms}'")
+    try:
+        matches = await run_sqlite(
+            lambda db: search_accepted_queries(db, search_terms, ctx.deps.dialect, settings.HISTORY_TOP_K))
+    except Exception as e:
+        logger.error(f"Failed to search history queries for '{search_terms}': {e}", exc_info=True)
+        return []
+    history = [{"source_sql": match.source_sql, "target_vql": match.target_vql} for match in matches]
+    return _budget_tool_output(ctx, "search_history", history)
+
+
+async def _get_functions(ctx: RunContext[Deps]) -> list[str]:
     """Retrieves a list of available Denodo functions. Use this tool when an error indicates a function was not found or has incorrect arity."""
     logger.info("Executing _get_functions tool")
-    return await get_denodo_functions_list()
+    functions = await get_denodo_functions_list()
+    return _budget_tool_output(ctx, "get_functions", functions)
 
 
 async def _get_views(ctx: RunContext[Deps]) -> list[str]:
     """Retrieves a list of available Denodo views. Use this tool when an error suggests a table or view is missing or misspelled."""
-    return await get_available_views_from_denodo(ctx.deps.vdb)
+    views = await get_available_views_from_denodo(ctx.deps.vdb)
+    return _budget_tool_output(ctx, "get_views", views)
 
 
 async def _get_vdbs() -> list[str]:
@@ -124,7 +168,8 @@ async def _get_vdbs() -> list[str]:
 
 async def _get_view_metadata(ctx: RunContext[Deps]) -> list[dict[str, str]]:
     """Retrieves a list of columns for the views. Use this tool when an error refers to field not found in view error."""
-    return await get_view_cols(ctx.deps.tables)
+    columns = await get_view_cols(ctx.deps.tables)
+    return _budget_tool_output(ctx, "get_view_metadata", columns)
 
 
 def _extract_tables(input_vql: str) -> set[str]:
@@ -138,19 +183,46 @@ def _extract_tables(input_vql: str) -> set[str]:
     return tables
 
 
-async def analyze_vql_validation_error(error: str, request: VqlValidateRequest) -> AIAnalysis:
+def _pretty_vql(vql: str) -> str:
+    try:
+        return parse_one(vql).sql(pretty=True)
+    except Exception:
+        return vql
+
+
+async def analyze_vql_validation_error(error: str, request: VqlValidateRequest, candidates: int = 1) -> AIAnalysis:
+    """Analyze a Denodo validation error and suggest a corrected VQL.
+
+    Args:
+        error: The error message returned by Denodo.
+        request: The VQL that failed and its original SQL context.
+        candidates: The number of candidate corrections to request; all but
+                    the first are returned in `alternative_suggestions`.
+
+    Raises:
+        HTTPException: 503 if the AI service fails or returns no analysis.
+    """
     agent = _initialize_ai_agent(
         "You are an SQL Validation assistant for Denodo VQL", AIAnalysis, tools=[
-            Tool(_get_functions), Tool(_get_views), Tool(_get_vdbs), Tool(_get_view_metadata), Tool(_get_history)]
+            Tool(_get_functions), Tool(_get_views), Tool(_get_vdbs), Tool(_get_view_metadata), Tool(_get_history),
+            Tool(_search_history)]
     )
 
+    alternatives_instruction = (
+        f"""
+                4.  Provide up to {candidates - 1} alternative corrected VQL queries in the `alternative_suggestions` field,
+                    each fixing the error in a different way (e.g. another view, column or function), most likely first.
+                    They are validated together with `sql_suggestion`."""
+        if candidates > 1 else "")
+
     prompt: str = f"""You are an expert Denodo VQL Assistant. Your task is to analyze Denodo VQL validation errors.
                 1.  Categorize the error into one of the following types: "Missing View", "Missing Column", "Invalid Function", "Syntax Error", "Permissions Error", "Other". Set this category in the `error_category` field.
                 2.  Explain concisely in the `explanation` field why the `Input VQL` failed based on the `Error`.
-                3.  Provide an accurate, corrected VQL suggestion in the `sql_suggestion` field.
+                3.  Provide an accurate, corrected VQL suggestion in the `sql_suggestion` field.{alternatives_instruction}
 
                 Do not explain what you are doing in the explanation, just provide the direct cause of the error.
                 At first always check the _get_history tool if the same or similar query was already successfully translated and validated.
+                If it returns nothing relevant, use the _search_history tool with the identifier from the error to find translations that used it.
                 If a table/view is missing, use the _get_views tool to find available views and suggest a likely replacement.
                 If a function is not found, use the _get_functions tool to check for available Denodo functions.
                 If a database name (VDB) is invalid, use _get_vdbs tool to check for valid database names.
@@ -162,12 +234,17 @@ async def analyze_vql_validation_error(error: str, request: VqlValidateRequest)
                 ```vql
                 {request.vql}```"""
     vql_tables: set[str] = _extract_tables(request.vql)
-    deps = Deps(tables=vql_tables, vdb=request.vdb, sql=request.sql, dialect=request.dialect)
+    deps = Deps(tables=vql_tables, vdb=request.vdb, sql=request.sql, dialect=request.dialect,
+                vql=request.vql, error=error)
     try:
-        response = await agent.run(prompt, deps=deps)
+        response = await get_scheduler(_provider_name()).run(agent, prompt, deps=deps)
         if response and response.output:
             sql_suggestion = parse_one(response.output.sql_suggestion).sql(pretty=True)
             response.output.sql_suggestion = sql_suggestion
+            response.output.alternative_suggestions = [
+                _pretty_vql(alternative) for alternative in response.output.alternative_suggestions[:candidates - 1]
+                if alternative.strip()
+            ]
             logger.info(f"AI Validation Analysis Category: {response.output.error_category}")
             logger.info(f"AI Validation Analysis Explanation: {response.output.explanation}")
             logger.info(f"AI Validation Analysis Suggestion: {response.output.sql_suggestion}")
@@ -203,7 +280,7 @@ async def analyze_sql_translation_error(exception_message: str, input_sql: str)
                 ```sql
                 {input_sql}```"""
     try:
-        response = await agent.run(prompt)
+        response = await get_scheduler(_provider_name()).run(agent, prompt)
         if response and response.output:
             logger.info(f"AI Translation Analysis Explanation: {response.output.explanation}")
             logger.info(f"AI Translation Analysis Suggestion: {response.output.sql_suggestion}")
@@ -220,10 +297,19 @@ async def analyze_sql_translation_error(exception_message: str, input_sql: str)
         )
 
 
-async def explain_vql_differences(source_sql: str, source_dialect: str, final_vql: str) -> str:
+# Returned by `explain_vql_differences` instead of an explanation when the AI fails.
+EXPLANATION_FAILURE_MESSAGES = (
+    "AI analysis of the VQL differences failed to produce an explanation.",
+    "An error occurred while generating the explanation of VQL differences.",
+)
+
+
+async def explain_vql_differences(source_sql: str, source_dialect: str, final_vql: str,
+                                  detected_changes: str = "") -> str:
     """
     Uses an AI agent to analyze and explain the differences between a source SQL query
-    and its translated VQL counterpart.
+    and its translated VQL counterpart. Changes already detected by the deterministic
+    AST diff are passed in so the AI only adds what is missing.
     """
     agent = _initialize_ai_agent(
         "You are an expert in SQL dialects and Denodo VQL. Your task is to explain the differences between a source SQL query and its translated VQL counterpart.",
@@ -236,6 +322,7 @@ async def explain_vql_differences(source_sql: str, source_dialect: str, final_vq
                 3.  Keep the explanation clear and easy for a developer to understand.
                 4.  If there are no significant changes, state that the VQL is a direct equivalent.
                 5.  Do not populate the `sql_suggestion` or `error_category` fields.
+                6.  The changes listed under `Already Detected Changes` are shown to the user already. Do not repeat them, only add what is missing.
 
                 **Source SQL ({source_dialect}):**
                 ```sql
@@ -246,17 +333,20 @@ async def explain_vql_differences(source_sql: str, source_dialect: str, final_vq
                 ```vql
                 {final_vql}
                 ```
+
+                **Already Detected Changes:**
+                {detected_changes or "None"}
                 """
     try:
-        response = await agent.run(prompt)
+        response = await get_scheduler(_provider_name()).run(agent, prompt, priority=Priority.EXPLANATION)
         if response and response.output and response.output.explanation:
             explanation_text = response.output.explanation
             logger.info(f"AI VQL Diff Explanation generated: {explanation_text[:150]}...")
             return explanation_text
         else:
             logger.error(f"AI agent returned unexpected response for VQL diff explanation: {response}")
-            return "AI analysis of the VQL differences failed to produce an explanation."
+            return EXPLANATION_FAILURE_MESSAGES[0]
     except Exception as agent_error:
         logger.error(f"Error calling AI Agent for VQL diff explanation: {agent_error}", exc_info=True)
         # Return a user-friendly error message, not the raw exception
-        return "An error occurred while generating the explanation of VQL differences."
+        return EXPLANATION_FAILURE_MESSAGES[1]
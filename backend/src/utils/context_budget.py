@@ -0,0 +1,152 @@
+"""
+Relevance ranking and token budgeting for AI agent tool outputs.
+
+Tool results such as the list of Denodo views or the translation history can
+grow with the size of the catalog. Before they are handed back to the agent,
+the items are ranked by how relevant they are to the failing VQL (referenced
+tables, identifiers from the error message) and truncated to a token budget.
+"""
+
+import json
+import logging
+import re
+from difflib import SequenceMatcher
+from typing import Any
+
+from src.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Rough average of characters per token for SQL-heavy JSON payloads.
+CHARS_PER_TOKEN = 4
+
+_IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_][\w$]*")
+_QUOTED_PATTERN = re.compile(r"['\"`]([^'\"`]{2,})['\"`]")
+_STOPWORDS = {
+    "and", "are", "as", "by", "can", "cannot", "column", "does", "error", "exist", "exists", "field",
+    "for", "from", "function", "group", "has", "in", "into", "invalid", "is", "join", "not", "found",
+    "of", "on", "or", "order", "select", "syntax", "table", "the", "to", "view", "was", "where", "with",
+}
+
+# Weights of the different sources of relevance terms.
+TABLE_WEIGHT = 3.0
+ERROR_WEIGHT = 2.0
+QUOTED_ERROR_WEIGHT = 4.0
+VQL_WEIGHT = 1.0
+
+
+def estimate_tokens(value: Any) -> int:
+    """Estimate the number of prompt tokens a JSON-serializable value will use."""
+    return len(json.dumps(value, default=str)) // CHARS_PER_TOKEN + 1
+
+
+def extract_relevance_terms(tables: set[str], error: str = "", vql: str = "") -> dict[str, float]:
+    """Collect weighted, lower-cased relevance terms for ranking tool results.
+
+    Args:
+        tables: Table or view names referenced by the failing VQL.
+        error: The Denodo error message, if any.
+        vql: The failing VQL.
+
+    Returns:
+        A mapping of term to weight; the highest weight wins for duplicate terms.
+    """
+    terms: dict[str, float] = {}
+
+    def add(term: str, weight: float) -> None:
+        term = term.strip().lower()
+        if len(term) < 3 or term in _STOPWORDS:
+            return
+        terms[term] = max(terms.get(term, 0.0), weight)
+
+    for identifier in _IDENTIFIER_PATTERN.findall(vql):
+        add(identifier, VQL_WEIGHT)
+    for identifier in _IDENTIFIER_PATTERN.findall(error):
+        add(identifier, ERROR_WEIGHT)
+    for quoted in _QUOTED_PATTERN.findall(error):
+        add(quoted, QUOTED_ERROR_WEIGHT)
+    for table in tables:
+        add(table, TABLE_WEIGHT)
+    return terms
+
+
+def _item_name(item: Any) -> str:
+    """Return the most name-like field of a tool result item, used for fuzzy matching."""
+    if isinstance(item, str):
+        return item.lower()
+    if isinstance(item, dict):
+        for key in ("name", "view_name", "column_name"):
+            if item.get(key):
+                return str(item[key]).lower()
+    return ""
+
+
+def score_item(item: Any, terms: dict[str, float]) -> float:
+    """Score a tool result item against the relevance terms.
+
+    Substring hits anywhere in the serialized item add the term weight; the
+    name of the item is additionally compared fuzzily so that misspelled
+    views or functions from the error message still rank their likely
+    replacements first.
+    """
+    if not terms:
+        return 0.0
+    text = item.lower() if isinstance(item, str) else json.dumps(item, default=str).lower()
+    score = sum(weight for term, weight in terms.items() if term in text)
+
+    name = _item_name(item)
+    if name:
+        best_ratio = 0.0
+        for term in terms:
+            matcher = SequenceMatcher(None, term, name)
+            if matcher.real_quick_ratio() > best_ratio and matcher.quick_ratio() > best_ratio:
+                best_ratio = max(best_ratio, matcher.ratio())
+        if best_ratio >= 0.75:
+            score += best_ratio * TABLE_WEIGHT
+    return score
+
+
+class ContextBudgeter:
+    """Ranks tool results by relevance and caps them to a token budget."""
+
+    def __init__(self, terms: dict[str, float], token_budget: int) -> None:
+        self.terms = terms
+        self.token_budget = token_budget
+
+    def fit(self, tool_name: str, items: list[Any]) -> list[Any]:
+        """Return the most relevant items that fit into the token budget.
+
+        Items keep their original order among equal scores, so results that
+        were already sorted (e.g. history by recency) stay stable. The tokens
+        saved by the truncation are logged and recorded in the metrics.
+
+        Args:
+            tool_name: The name of the tool, used for logging and metrics.
+            items: The complete tool result.
+
+        Returns:
+            The ranked and truncated list of items.
+        """
+        if not items:
+            return items
+        ranked = sorted(items, key=lambda item: score_item(item, self.terms), reverse=True)
+
+        kept: list[Any] = []
+        used_tokens = 0
+        total_tokens = 0
+        for item in ranked:
+            item_tokens = estimate_tokens(item)
+            total_tokens += item_tokens
+            if used_tokens + item_tokens <= self.token_budget:
+                kept.append(item)
+                used_tokens += item_tokens
+
+        saved_tokens = total_tokens - used_tokens
+        metrics.increment(f"context_budget.calls.{tool_name}")
+        metrics.increment(f"context_budget.tokens_used.{tool_name}", used_tokens)
+        metrics.increment(f"context_budget.tokens_saved.{tool_name}", saved_tokens)
+        logger.info(
+            f"Tool '{tool_name}' output budgeted: kept {len(kept)}/{len(items)} items, "
+            f"{used_tokens} tokens used, {saved_tokens} tokens saved."
+        )
+        return kept
@@ -0,0 +1,435 @@
+"""
+Priority-aware scheduling of LLM requests.
+
+Every AI agent run goes through a shared scheduler per provider, which
+enforces a concurrency limit and token-bucket budgets for requests per
+minute (RPM) and tokens per minute (TPM). Waiting requests are admitted in
+priority order (interactive forge > batch > explanations), so a batch job
+cannot starve interactive users of the provider quota. Rate-limited (HTTP
+429) runs are retried with exponential backoff. Cancelled runs, e.g. of a
+client that disconnected, leave the queue or free their slot immediately.
+
+The scheduler also accounts for the usage pydantic-ai reports for every
+run: request and response tokens, tool calls and the model. It is logged,
+aggregated in the metrics by model, endpoint and VDB, and added to the
+context's `current_usage`, e.g. of a forge run. Optional runs such as
+explanations and error analyses check `over_token_budget` first and are
+skipped once the budget of the current request or of the day is used up.
+"""
+
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+import random
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, MutableMapping
+
+from src.config import settings
+from src.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Rough average of characters per token, used to estimate prompt sizes.
+CHARS_PER_TOKEN = 4
+
+
+class Priority(IntEnum):
+    """Priority classes of LLM requests; lower values are admitted first."""
+    INTERACTIVE = 0
+    BATCH = 1
+    EXPLANATION = 2
+
+
+# Default priority for LLM requests made in the current context. Batch
+# pipelines set this to `Priority.BATCH` for everything they run.
+current_priority: ContextVar[Priority] = ContextVar("llm_priority", default=Priority.INTERACTIVE)
+
+
+@dataclass
+class RunUsage:
+    """The usage of one agent run; estimated from the prompt if the provider reported none."""
+    model: str
+    request_tokens: int
+    response_tokens: int
+    tool_calls: int
+    estimated: bool = False
+
+    @property
+    def total_tokens(self) -> int:
+        return self.request_tokens + self.response_tokens
+
+
+@dataclass
+class TokenUsage:
+    """Usage of the LLM requests made while it is the context's `current_usage`.
+
+    `endpoint` and `vdb` label the usage in the metrics; `budget` is the
+    number of tokens the unit of work may use, None for no limit.
+    """
+    tokens: int = 0
+    runs: int = 0
+    request_tokens: int = 0
+    response_tokens: int = 0
+    tool_calls: int = 0
+    endpoint: str = ""
+    vdb: str = ""
+    budget: int | None = None
+
+    @property
+    def exhausted(self) -> bool:
+        return self.budget is not None and self.tokens >= self.budget
+
+    def add(self, run: RunUsage) -> None:
+        self.tokens += run.total_tokens
+        self.runs += 1
+        self.request_tokens += run.request_tokens
+        self.response_tokens += run.response_tokens
+        self.tool_calls += run.tool_calls
+
+
+# Accumulates the token usage of a unit of work, e.g. an HTTP request or a forge
+# run. Tasks started from that context share the same object, so their runs are
+# counted as well.
+current_usage: ContextVar[TokenUsage | None] = ContextVar("llm_usage", default=None)
+
+
+class DailyTokenCounter:
+    """Counts the LLM tokens used by this worker process per UTC day."""
+
+    def __init__(self) -> None:
+        self.day: datetime.date | None = None
+        self.tokens = 0
+
+    def _roll_over(self) -> None:
+        today = datetime.datetime.utcnow().date()
+        if today != self.day:
+            self.day, self.tokens = today, 0
+
+    def add(self, tokens: int) -> None:
+        self._roll_over()
+        self.tokens += tokens
+
+    def used(self) -> int:
+        self._roll_over()
+        return self.tokens
+
+
+daily_usage = DailyTokenCounter()
+
+
+def metric_label(value: str) -> str:
+    """Make a value usable as the last segment of a dotted metric name."""
+    return value.replace(".", "_") or "unknown"
+
+
+def label_usage(vdb: str | None) -> None:
+    """Label the current usage with the VDB a request works on, unless it already has one."""
+    usage = current_usage.get()
+    if usage is not None and vdb and not usage.vdb:
+        usage.vdb = vdb
+
+
+def over_token_budget(purpose: str) -> bool:
+    """Return whether an optional LLM run for `purpose` is to be skipped because a token budget is used up.
+
+    The budget of the current usage, e.g. of the request or forge run, and
+    the daily budget `LLM_DAILY_TOKEN_BUDGET` are checked.
+    """
+    usage = current_usage.get()
+    if usage is not None and usage.exhausted:
+        budget = "request"
+    elif 0 < settings.LLM_DAILY_TOKEN_BUDGET <= daily_usage.used():
+        budget = "daily"
+    else:
+        return False
+    metrics.increment(f"llm.budget_skipped.{metric_label(purpose)}")
+    logger.warning(f"Skipped the LLM run for {purpose}: the {budget} token budget is used up.")
+    return True
+
+
+class TokenBucket:
+    """A token bucket refilled continuously up to `per_minute` tokens per minute; 0 or less is unlimited."""
+
+    def __init__(self, per_minute: int) -> None:
+        self.unlimited = per_minute <= 0
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Return the seconds until `amount` tokens are available (0 if available now)."""
+        if self.unlimited:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float) -> None:
+        """Take `amount` tokens; a negative amount returns tokens to the bucket."""
+        if self.unlimited:
+            return
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    sequence: int
+    tokens: int = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    enqueued_at: float = field(compare=False, default_factory=time.monotonic)
+
+
+def estimate_prompt_tokens(prompt: str) -> int:
+    """Estimate the tokens of a run: the prompt plus an allowance for the response."""
+    return len(prompt) // CHARS_PER_TOKEN + settings.LLM_RESPONSE_TOKEN_ALLOWANCE
+
+
+def _count_tool_calls(result: Any) -> int:
+    try:
+        messages = result.all_messages()
+    except Exception:
+        return 0
+    return sum(1 for message in messages for part in getattr(message, "parts", ())
+               if getattr(part, "part_kind", None) == "tool-call")
+
+
+def _run_usage(agent: Any, result: Any, prompt: str) -> RunUsage:
+    """Return the usage of a pydantic-ai run, estimated from the prompt if none was reported.
+
+    Newer pydantic-ai versions report `input_tokens` and `output_tokens`,
+    older ones `request_tokens` and `response_tokens`.
+    """
+    model = getattr(getattr(agent, "model", None), "model_name", None) or settings.AI_MODEL_NAME
+    try:
+        usage = result.usage()
+    except Exception:
+        usage = None
+    request_tokens = getattr(usage, "input_tokens", None) or getattr(usage, "request_tokens", None)
+    response_tokens = getattr(usage, "output_tokens", None) or getattr(usage, "response_tokens", None)
+    tool_calls = getattr(usage, "tool_calls", None)
+    if tool_calls is None:
+        tool_calls = _count_tool_calls(result)
+    if not request_tokens and not response_tokens:
+        total = getattr(usage, "total_tokens", None)
+        if total:  # only the total was reported
+            return RunUsage(model, int(total), 0, tool_calls)
+        return RunUsage(model, len(prompt) // CHARS_PER_TOKEN, settings.LLM_RESPONSE_TOKEN_ALLOWANCE, tool_calls,
+                        estimated=True)
+    return RunUsage(model, int(request_tokens or 0), int(response_tokens or 0), tool_calls)
+
+
+def _is_rate_limited(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 429
+
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    """Honour a `Retry-After` header if present, otherwise back off exponentially with jitter."""
+    headers = getattr(error, "headers", None) or {}
+    retry_after = headers.get("retry-after") or headers.get("Retry-After")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return settings.LLM_RETRY_BASE_DELAY * (2 ** attempt) * (1 + random.random() * 0.5)
+
+
+class LLMScheduler:
+    """Admits LLM runs of one provider by priority within concurrency and rate budgets."""
+
+    def __init__(self, provider: str, max_concurrency: int, rpm_limit: int, tpm_limit: int) -> None:
+        self.provider = provider
+        self.max_concurrency = max_concurrency
+        self._rpm = TokenBucket(rpm_limit)
+        self._tpm = TokenBucket(tpm_limit)
+        self._waiters: list[_Waiter] = []
+        self._sequence = itertools.count()
+        self._active = 0
+        self._timer: asyncio.TimerHandle | None = None
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.future.done())
+
+    def _update_gauges(self) -> None:
+        metrics.set_gauge(f"llm_scheduler.queue_depth.{self.provider}", self.queue_depth)
+        metrics.set_gauge(f"llm_scheduler.active.{self.provider}", self._active)
+
+    def _dispatch(self) -> None:
+        """Admit waiters in priority order while concurrency and rate budgets allow it."""
+        self._timer = None
+        while self._waiters and self._active < self.max_concurrency:
+            waiter = self._waiters[0]
+            if waiter.future.done():  # cancelled while queued
+                heapq.heappop(self._waiters)
+                continue
+            delay = max(self._rpm.wait_time(1), self._tpm.wait_time(waiter.tokens))
+            if delay > 0:
+                # The head of the queue keeps its place; lower priorities must not overtake it.
+                self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                break
+            heapq.heappop(self._waiters)
+            self._rpm.consume(1)
+            self._tpm.consume(waiter.tokens)
+            self._active += 1
+            waiter.future.set_result(None)
+            metrics.observe(f"llm_scheduler.wait_seconds.{Priority(waiter.priority).name.lower()}",
+                            time.monotonic() - waiter.enqueued_at)
+        self._update_gauges()
+
+    async def _acquire(self, priority: Priority, tokens: int) -> None:
+        waiter = _Waiter(priority=int(priority), sequence=next(self._sequence), tokens=tokens,
+                         future=asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiters, waiter)
+        if self._timer is None:
+            self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release()  # admitted right before the cancellation arrived
+            else:
+                metrics.increment(f"llm_scheduler.cancelled_queued.{self.provider}")
+            self._update_gauges()
+            raise
+
+    def _release(self) -> None:
+        self._active -= 1
+        if self._timer is None:
+            self._dispatch()
+        else:
+            self._update_gauges()
+
+    async def run(self, agent: Any, prompt: str, *, deps: Any = None, priority: Priority | None = None) -> Any:
+        """Run an agent with the given prompt once admitted by the scheduler.
+
+        Args:
+            agent: The pydantic-ai agent.
+            prompt: The user prompt.
+            deps: Optional dependencies for the agent's tools.
+            priority: The priority class; defaults to the context's `current_priority`.
+
+        Returns:
+            The agent run result.
+
+        Raises:
+            Exception: Whatever the agent raises once retries are exhausted.
+        """
+        priority = current_priority.get() if priority is None else priority
+        estimated_tokens = estimate_prompt_tokens(prompt)
+
+        for attempt in range(settings.LLM_MAX_RETRIES + 1):
+            await self._acquire(priority, estimated_tokens)
+            started = time.monotonic()
+            try:
+                result = await agent.run(prompt, deps=deps)
+            except Exception as e:
+                if _is_rate_limited(e) and attempt < settings.LLM_MAX_RETRIES:
+                    delay = _retry_delay(e, attempt)
+                    metrics.increment(f"llm_scheduler.rate_limited.{self.provider}")
+                    logger.warning(f"LLM provider '{self.provider}' rate limited the request, retrying in {delay:.1f}s.")
+                    self._release()
+                    await asyncio.sleep(delay)
+                    continue
+                self._release()
+                raise
+            except asyncio.CancelledError:
+                self._release()
+                metrics.increment(f"llm_scheduler.cancelled.{self.provider}")
+                metrics.observe(f"llm_scheduler.cancelled_run_seconds.{self.provider}", time.monotonic() - started)
+                raise
+            except BaseException:
+                self._release()
+                raise
+
+            self._release()
+            seconds = time.monotonic() - started
+            metrics.observe(f"llm_scheduler.run_seconds.{self.provider}", seconds)
+            usage = _run_usage(agent, result, prompt)
+            if not usage.estimated:
+                # Correct the TPM budget by the difference between estimate and actual usage.
+                self._tpm.consume(usage.total_tokens - estimated_tokens)
+            self._account(usage, seconds)
+            return result
+        raise RuntimeError("LLM scheduler exhausted its retries.")  # unreachable, the loop returns or raises
+
+    def _account(self, run: RunUsage, seconds: float) -> None:
+        """Log the usage of a run and add it to the metrics, the daily count and the current usage."""
+        model = metric_label(run.model)
+        metrics.increment(f"llm.runs.{model}")
+        metrics.increment(f"llm.tokens.request.{model}", run.request_tokens)
+        metrics.increment(f"llm.tokens.response.{model}", run.response_tokens)
+        metrics.increment(f"llm.tool_calls.{model}", run.tool_calls)
+        daily_usage.add(run.total_tokens)
+        metrics.set_gauge("llm.daily_tokens", daily_usage.used())
+
+        usage = current_usage.get()
+        if usage is not None:
+            usage.add(run)
+            if usage.endpoint:
+                metrics.increment(f"llm.tokens.endpoint.{metric_label(usage.endpoint)}", run.total_tokens)
+                metrics.observe(f"llm.run_seconds.endpoint.{metric_label(usage.endpoint)}", seconds)
+            if usage.vdb:
+                metrics.increment(f"llm.tokens.vdb.{metric_label(usage.vdb)}", run.total_tokens)
+                metrics.observe(f"llm.run_seconds.vdb.{metric_label(usage.vdb)}", seconds)
+        logger.info(f"LLM run on '{self.provider}' ({run.model}) took {seconds:.1f}s and used "
+                    f"{run.request_tokens} request and {run.response_tokens} response tokens"
+                    f"{' (estimated)' if run.estimated else ''} with {run.tool_calls} tool calls.")
+
+    def stats(self) -> dict[str, Any]:
+        """Return the current queue depth and number of active runs."""
+        return {"provider": self.provider, "queue_depth": self.queue_depth, "active": self._active}
+
+
+_schedulers: dict[str, LLMScheduler] = {}
+
+
+def get_scheduler(provider: str) -> LLMScheduler:
+    """Return the shared scheduler for an LLM provider, creating it on first use."""
+    scheduler = _schedulers.get(provider)
+    if scheduler is None:
+        scheduler = LLMScheduler(
+            provider,
+            max_concurrency=settings.LLM_MAX_CONCURRENCY,
+            rpm_limit=settings.LLM_RPM_LIMIT,
+            tpm_limit=settings.LLM_TPM_LIMIT,
+        )
+        _schedulers[provider] = scheduler
+    return scheduler
+
+
+class LLMUsageMiddleware:
+    """ASGI middleware giving every HTTP request its own `current_usage`, labelled with its path.
+
+    The request may use `LLM_REQUEST_TOKEN_BUDGET` tokens; forge runs set
+    up their own usage and budget.
+    """
+
+    def __init__(self, app: Callable[..., Awaitable[None]]) -> None:
+        self.app = app
+
+    async def __call__(self, scope: MutableMapping[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        endpoint = scope["path"].strip("/").replace("/", "_") or "root"
+        token = current_usage.set(TokenUsage(endpoint=endpoint, budget=settings.LLM_REQUEST_TOKEN_BUDGET or None))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_usage.reset(token)
@@ -0,0 +1,60 @@
+"""
+In-process metrics registry.
+
+Counters, gauges and timing observations are kept in memory for the lifetime
+of the worker process and exposed through the `/metrics` endpoint. Metric
+names are dotted strings; a per-label breakdown is encoded as the last
+segment (e.g. `context_budget.tokens_saved.get_views`).
+"""
+
+import threading
+
+
+class MetricsRegistry:
+    """A thread-safe store for counters, gauges and timing observations."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: dict[str, float] = {}
+        self._gauges: dict[str, float] = {}
+        self._timings: dict[str, dict[str, float]] = {}
+
+    def increment(self, name: str, value: float = 1.0) -> None:
+        """Add `value` to the counter `name`."""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0.0) + value
+
+    def counter(self, name: str) -> float:
+        """Return the current value of the counter `name`."""
+        with self._lock:
+            return self._counters.get(name, 0.0)
+
+    def set_gauge(self, name: str, value: float) -> None:
+        """Set the gauge `name` to `value`."""
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, value: float) -> None:
+        """Record a single observation (e.g. a duration in seconds) for `name`."""
+        with self._lock:
+            timing = self._timings.setdefault(name, {"count": 0.0, "sum": 0.0, "max": 0.0})
+            timing["count"] += 1
+            timing["sum"] += value
+            timing["max"] = max(timing["max"], value)
+
+    def timing(self, name: str) -> dict[str, float]:
+        """Return the count, sum and max of the observations for `name`."""
+        with self._lock:
+            return dict(self._timings.get(name, {"count": 0.0, "sum": 0.0, "max": 0.0}))
+
+    def snapshot(self) -> dict[str, dict]:
+        """Return a copy of all metrics, safe to serialize."""
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "timings": {name: dict(values) for name, values in self._timings.items()},
+            }
+
+
+metrics = MetricsRegistry()
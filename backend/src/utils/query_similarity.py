@@ -0,0 +1,259 @@
+"""
+Structural similarity index over accepted queries.
+
+Each accepted query's source SQL is parsed with sqlglot and normalized into
+a sequence of AST tokens (node types, table, column and function names;
+literal values are dropped). Shingles of that sequence are summarized in a
+MinHash signature, which is split into locality-sensitive hashing (LSH)
+bands. The band buckets are persisted in an indexed SQLite table, so the
+candidates for a new query are found with index lookups instead of a scan
+over the whole log, and only the candidates are ranked by their estimated
+Jaccard similarity.
+
+The module also provides the content fingerprint used to deduplicate
+accepted queries and the recency-weighted frequency used to rank them.
+"""
+
+import datetime
+import hashlib
+import logging
+import random
+import struct
+from typing import List
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import Session
+from sqlglot import exp, parse_one
+
+from src.config import settings
+from src.schemas.db_log import AcceptedQuery, QueryLshBucket, QuerySignature
+
+logger = logging.getLogger(__name__)
+
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERMUTATIONS // LSH_BANDS
+SHINGLE_SIZE = 3
+# Upper bound of LSH candidates that are ranked exactly for a single lookup.
+MAX_CANDIDATES = 500
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 64) - 1
+_SIGNATURE_FORMAT = f"<{NUM_PERMUTATIONS}Q"
+
+# Fixed seed: signatures are persisted and must stay comparable across restarts.
+_random = random.Random(1)
+_PERMUTATIONS: list[tuple[int, int]] = [
+    (_random.randrange(1, _MERSENNE_PRIME), _random.randrange(0, _MERSENNE_PRIME))
+    for _ in range(NUM_PERMUTATIONS)
+]
+
+
+def _hash64(value: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(), "little")
+
+
+def _node_token(node: exp.Expression) -> str | None:
+    """Map an AST node to its normalized token; identifiers and literal values are dropped."""
+    if isinstance(node, (exp.Identifier, exp.Literal)):
+        return None
+    if isinstance(node, exp.Table):
+        return f"T:{node.name.lower()}"
+    if isinstance(node, exp.Column):
+        return f"C:{node.name.lower()}"
+    if isinstance(node, exp.Anonymous):
+        return f"F:{node.name.lower()}"
+    if isinstance(node, exp.Func):
+        return f"F:{node.sql_name().lower()}"
+    return node.key
+
+
+def query_shingles(sql: str, dialect: str | None = None, tree: exp.Expression | None = None) -> set[str]:
+    """Return the normalized AST shingles of a SQL query.
+
+    Args:
+        sql: The SQL query.
+        dialect: The dialect to parse the query with.
+        tree: The already parsed query, to avoid parsing it again.
+
+    Raises:
+        sqlglot.errors.ParseError: If the query cannot be parsed.
+    """
+    tree = tree if tree is not None else parse_one(sql, read=dialect or None)
+    tokens = [token for token in (_node_token(node) for node in tree.dfs()) if token]
+    shingles = {" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(max(len(tokens) - SHINGLE_SIZE + 1, 1))}
+    # Tables and functions also count on their own, independent of their position.
+    shingles.update(token for token in tokens if token.startswith(("T:", "F:")))
+    return shingles
+
+
+def minhash_signature(shingles: set[str]) -> list[int]:
+    """Compute the MinHash signature of a set of shingles."""
+    hashes = [_hash64(shingle.encode()) for shingle in shingles]
+    if not hashes:
+        return [_MAX_HASH] * NUM_PERMUTATIONS
+    return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def lsh_buckets(signature: list[int]) -> list[tuple[int, int]]:
+    """Split a signature into (band, bucket) pairs; buckets fit a signed SQLite INTEGER."""
+    buckets = []
+    for band in range(LSH_BANDS):
+        rows = signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]
+        buckets.append((band, _hash64(struct.pack(f"<{LSH_ROWS}Q", *rows)) >> 1))
+    return buckets
+
+
+def estimate_similarity(signature_a: list[int], signature_b: list[int]) -> float:
+    """Estimate the Jaccard similarity of two queries from their signatures."""
+    return sum(1 for a, b in zip(signature_a, signature_b) if a == b) / NUM_PERMUTATIONS
+
+
+def _pack(signature: list[int]) -> bytes:
+    return struct.pack(_SIGNATURE_FORMAT, *signature)
+
+
+def _unpack(data: bytes) -> list[int]:
+    return list(struct.unpack(_SIGNATURE_FORMAT, data))
+
+
+def accepted_query_fingerprint(
+    source_dialect: str, source_sql: str, target_vql: str, source_tree: exp.Expression | None = None
+) -> str:
+    """Return the content hash identifying an accepted SQL-to-VQL pair.
+
+    The source SQL is canonicalized by rendering its AST, so formatting and
+    keyword casing do not create distinct entries; if it cannot be parsed,
+    its whitespace-normalized text is used. The target VQL is whitespace-normalized.
+
+    Args:
+        source_dialect: The source SQL dialect.
+        source_sql: The source SQL.
+        target_vql: The accepted VQL translation.
+        source_tree: The already parsed source SQL, to avoid parsing it again.
+    """
+    try:
+        tree = source_tree if source_tree is not None else parse_one(source_sql, read=source_dialect or None)
+        canonical_sql = tree.sql(dialect=source_dialect or None)
+    except Exception:
+        canonical_sql = " ".join(source_sql.split())
+    content = "\x1f".join(((source_dialect or "").lower(), canonical_sql, " ".join(target_vql.split())))
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def recency_weighted_frequency(query: AcceptedQuery, now: datetime.datetime | None = None) -> float:
+    """Score an accepted query by how often it was accepted, halving the weight every half-life since it was last seen."""
+    now = now or datetime.datetime.utcnow()
+    last_seen = query.last_seen or query.timestamp or now
+    age_days = max((now - last_seen).total_seconds(), 0.0) / 86400
+    return (query.occurrence_count or 1) * 0.5 ** (age_days / settings.HISTORY_RECENCY_HALF_LIFE_DAYS)
+
+
+def index_accepted_query(db: Session, query: AcceptedQuery) -> bool:
+    """Add an accepted query to the similarity index within the caller's transaction.
+
+    The query must already have an id (i.e. be flushed). Queries that cannot
+    be parsed are skipped.
+
+    Returns:
+        True if the query was indexed.
+    """
+    try:
+        signature = minhash_signature(query_shingles(query.source_sql, query.source_dialect))
+    except Exception as e:
+        logger.warning(f"Could not index accepted query {query.id} for similarity search: {e}")
+        return False
+    signature_row, bucket_rows = similarity_index_rows(query.id, signature)
+    db.add(QuerySignature(**signature_row))
+    db.add_all(QueryLshBucket(**bucket_row) for bucket_row in bucket_rows)
+    return True
+
+
+def similarity_index_rows(query_id: int, signature: list[int]) -> tuple[dict, list[dict]]:
+    """Return the `query_signatures` row and `query_lsh_buckets` rows of a signature, e.g. for executemany."""
+    return (
+        {"query_id": query_id, "signature": _pack(signature)},
+        [{"query_id": query_id, "band": band, "bucket": bucket} for band, bucket in lsh_buckets(signature)],
+    )
+
+
+def backfill_similarity_index(db: Session, batch_size: int = 500) -> int:
+    """Index all accepted queries that do not have a signature yet.
+
+    Returns:
+        The number of queries that were indexed.
+    """
+    indexed = 0
+    last_id = 0
+    while True:
+        batch: List[AcceptedQuery] = (
+            db.query(AcceptedQuery)
+            .outerjoin(QuerySignature, QuerySignature.query_id == AcceptedQuery.id)
+            .filter(QuerySignature.query_id.is_(None), AcceptedQuery.id > last_id)
+            .order_by(AcceptedQuery.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+        for query in batch:
+            indexed += index_accepted_query(db, query)
+        last_id = batch[-1].id
+        db.commit()
+    if indexed:
+        logger.info(f"Backfilled the similarity index with {indexed} accepted queries.")
+    return indexed
+
+
+def find_similar_queries(db: Session, sql: str, dialect: str | None, k: int) -> List[AcceptedQuery]:
+    """Return the k accepted queries most structurally similar to a SQL query.
+
+    Candidates sharing at least one LSH bucket, in the requested dialect,
+    are looked up via the bucket index and ranked by their estimated Jaccard
+    similarity; equally similar candidates are ranked by their
+    recency-weighted frequency. Candidates less similar than
+    `HISTORY_MIN_SIMILARITY` are dropped.
+
+    Args:
+        db: The SQLite session.
+        sql: The source SQL to find similar translations for.
+        dialect: Restrict results to this source dialect, if given.
+        k: The maximum number of results.
+
+    Returns:
+        The most similar accepted queries, best match first. Empty if the SQL
+        cannot be parsed or no candidate shares a bucket.
+    """
+    try:
+        signature = minhash_signature(query_shingles(sql, dialect))
+    except Exception as e:
+        logger.warning(f"Could not compute the similarity signature of the query: {e}")
+        return []
+
+    bucket_filter = or_(*(
+        and_(QueryLshBucket.band == band, QueryLshBucket.bucket == bucket)
+        for band, bucket in lsh_buckets(signature)
+    ))
+    candidate_ids = select(QueryLshBucket.query_id).where(bucket_filter)
+    if dialect:
+        # Filtered before the limit, so other dialects do not use up the candidates.
+        candidate_ids = (
+            candidate_ids.join(AcceptedQuery, AcceptedQuery.id == QueryLshBucket.query_id)
+            .where(AcceptedQuery.source_dialect == dialect)
+        )
+    candidate_ids = candidate_ids.distinct().order_by(QueryLshBucket.query_id.desc()).limit(MAX_CANDIDATES)
+    query = (
+        db.query(AcceptedQuery, QuerySignature.signature)
+        .join(QuerySignature, QuerySignature.query_id == AcceptedQuery.id)
+        .filter(AcceptedQuery.id.in_(candidate_ids))
+    )
+
+    now = datetime.datetime.utcnow()
+    scored = ((estimate_similarity(signature, _unpack(candidate_signature)), accepted)
+              for accepted, candidate_signature in query.all())
+    ranked = sorted(
+        (pair for pair in scored if pair[0] >= settings.HISTORY_MIN_SIMILARITY),
+        key=lambda pair: (pair[0], recency_weighted_frequency(pair[1], now)),
+        reverse=True,
+    )
+    return [accepted for _, accepted in ranked[:k]]
@@ -0,0 +1,72 @@
+"""
+Server-Sent Events (SSE) encoding for the forge streams.
+
+Messages are serialized with orjson. The forge and batch streams use a
+compact protocol: the first "step" event of a step carries the whole
+`AgentStep` and a numeric step `id`; later updates of the same step carry
+only the `id` and the fields that changed. The final "result" event lists
+the step ids in `steps` instead of repeating the whole `process_log`.
+Streams send a heartbeat comment while they are idle, so proxies neither
+buffer nor drop them.
+"""
+
+from typing import Any, Optional
+
+import orjson
+
+HEARTBEAT_MESSAGE = ": heartbeat\n\n"
+# Response headers that keep proxies (e.g. nginx) from buffering or caching a stream.
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def format_sse(data: dict, event: str | None = None, event_id: int | None = None) -> str:
+    """Format a dictionary into a Server-Sent Event (SSE) message string.
+
+    Args:
+        data: The dictionary payload to send.
+        event: An optional event name for the SSE message.
+        event_id: An optional event id, sent back by a reconnecting client as `Last-Event-ID`.
+
+    Returns:
+        A string formatted as a compliant SSE message.
+    """
+    message = f"data: {orjson.dumps(data).decode()}\n\n"
+    if event:
+        message = f"event: {event}\n{message}"
+    if event_id is not None:
+        message = f"id: {event_id}\n{message}"
+    return message
+
+
+class StepDeltaEncoder:
+    """Encodes the forge events of one stream as step deltas; steps are told apart by item and step name."""
+
+    def __init__(self) -> None:
+        self._step_ids: dict[tuple[Optional[str], str], int] = {}
+        self._sent: dict[int, dict[str, Any]] = {}
+
+    def encode(self, event: str, data: dict[str, Any]) -> Optional[tuple[str, dict[str, Any]]]:
+        """Return the compact form of an event, or None if a step update changes nothing."""
+        item_id = data.get("item_id")
+        if event == "step":
+            key = (item_id, data["step_name"])
+            step_id = self._step_ids.get(key)
+            if step_id is None:
+                step_id = self._step_ids[key] = len(self._step_ids)
+                self._sent[step_id] = data
+                return event, {"id": step_id, **data}
+            previous = self._sent[step_id]
+            self._sent[step_id] = data
+            delta = {name: value for name, value in data.items() if previous.get(name) != value}
+            if not delta:
+                return None
+            if item_id is not None:
+                delta["item_id"] = item_id
+            return event, {"id": step_id, **delta}
+
+        if event == "result" and "process_log" in data:
+            compact = {name: value for name, value in data.items() if name != "process_log"}
+            compact["steps"] = [self._step_ids[(item_id, step["step_name"])] for step in data["process_log"]
+                                if (item_id, step["step_name"]) in self._step_ids]
+            return event, compact
+        return event, data
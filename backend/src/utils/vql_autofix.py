@@ -0,0 +1,189 @@
+"""
+Deterministic, rule-based fixes for common VQL validation errors.
+
+Many Denodo validation failures are mechanical: views that are not qualified
+with a VDB, Oracle `NVL`/`DECODE` remnants, reserved words used as
+identifiers, or `FETCH FIRST` instead of `LIMIT`. This module keeps a registry
+of error-pattern -> AST-rewrite rules which are tried, and re-validated,
+before an AI analysis is requested. Per-rule hit rates are recorded in the
+metrics so the number of saved LLM calls is visible.
+"""
+
+import logging
+import re
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from sqlglot import exp, parse_one
+from sqlglot.errors import SqlglotError
+
+from src.schemas.translation import AIAnalysis
+from src.schemas.validation import VqlValidateRequest
+from src.utils.metrics import metrics
+from src.utils.vdb_transformer import transform_vdb_table_qualification
+
+logger = logging.getLogger(__name__)
+
+RewriteFunction = Callable[[str, re.Match, VqlValidateRequest], str | None]
+
+
+@dataclass(frozen=True)
+class FixRule:
+    name: str
+    pattern: re.Pattern
+    rewrite: RewriteFunction
+    error_category: str
+    explanation: str
+
+
+FIX_RULES: list[FixRule] = []
+
+
+def fix_rule(name: str, pattern: str, error_category: str, explanation: str) -> Callable[[RewriteFunction], RewriteFunction]:
+    """Register a rewrite function as a fix rule for errors matching `pattern`."""
+    def decorator(rewrite: RewriteFunction) -> RewriteFunction:
+        FIX_RULES.append(FixRule(
+            name=name,
+            pattern=re.compile(pattern, re.IGNORECASE),
+            rewrite=rewrite,
+            error_category=error_category,
+            explanation=explanation,
+        ))
+        return rewrite
+    return decorator
+
+
+def _parse_vql(vql: str, dialect: str = "denodo") -> exp.Expression | None:
+    try:
+        return parse_one(vql, read=dialect)
+    except SqlglotError:
+        return None
+
+
+@fix_rule(
+    name="oracle_functions",
+    pattern=r"\b(NVL2?|DECODE)\b",
+    error_category="Invalid Function",
+    explanation="The query still uses Oracle functions (NVL, NVL2, DECODE). They were rewritten to their Denodo equivalents.",
+)
+def _rewrite_oracle_functions(vql: str, match: re.Match, request: VqlValidateRequest) -> str | None:
+    function_call = rf"\b{match.group(1)}\s*\("
+    if not re.search(function_call, vql, re.IGNORECASE):
+        return None  # re-rendering alone would not fix anything
+    # The Oracle reader turns NVL into COALESCE and DECODE into a CASE expression.
+    tree = _parse_vql(vql, dialect="oracle")
+    if tree is None:
+        return None
+    rewritten_vql = tree.sql(dialect="denodo", pretty=True)
+    if re.search(function_call, rewritten_vql, re.IGNORECASE):
+        return None
+    return rewritten_vql
+
+
+@fix_rule(
+    name="quote_reserved_word",
+    pattern=r"(?:encountered|near|unexpected(?: token)?)\s*:?\s*['\"]?(\w+)['\"]?",
+    error_category="Syntax Error",
+    explanation="A reserved word is used as an identifier. The identifier was quoted.",
+)
+def _quote_reserved_word(vql: str, match: re.Match, request: VqlValidateRequest) -> str | None:
+    word = match.group(1).lower()
+    tree = _parse_vql(vql)
+    if tree is None:
+        return None
+    quoted = False
+    for identifier in tree.find_all(exp.Identifier):
+        if not identifier.quoted and identifier.name.lower() == word:
+            identifier.set("quoted", True)
+            quoted = True
+    return tree.sql(dialect="denodo", pretty=True) if quoted else None
+
+
+@fix_rule(
+    name="fetch_to_limit",
+    pattern=r"\bFETCH\b",
+    error_category="Syntax Error",
+    explanation="Denodo does not support FETCH FIRST ... ROWS ONLY. The clause was rewritten to LIMIT.",
+)
+def _fetch_to_limit(vql: str, match: re.Match, request: VqlValidateRequest) -> str | None:
+    tree = _parse_vql(vql)
+    if tree is None:
+        return None
+    rewritten = False
+    for fetch in list(tree.find_all(exp.Fetch)):
+        count = fetch.args.get("count")
+        if count is None:
+            continue
+        fetch.replace(exp.Limit(expression=count.copy()))
+        rewritten = True
+    return tree.sql(dialect="denodo", pretty=True) if rewritten else None
+
+
+@fix_rule(
+    name="qualify_views",
+    pattern=r"\b(?:not found|does not exist)\b",
+    error_category="Missing View",
+    explanation="The query references views that are not qualified with the VDB. The views were qualified with the selected VDB.",
+)
+def _qualify_views(vql: str, match: re.Match, request: VqlValidateRequest) -> str | None:
+    if not request.vdb:
+        return None
+    tree = _parse_vql(vql)
+    if tree is None:
+        return None
+    qualified_tree = tree.transform(transform_vdb_table_qualification, request.vdb)
+    return qualified_tree.sql(dialect="denodo", pretty=True) if qualified_tree != tree else None
+
+
+def _record_hit_rate(rule_name: str) -> None:
+    matched = metrics.counter(f"autofix.matched.{rule_name}")
+    if matched:
+        metrics.set_gauge(f"autofix.hit_rate.{rule_name}", metrics.counter(f"autofix.hit.{rule_name}") / matched)
+
+
+async def apply_rule_based_fixes(error: str, request: VqlValidateRequest,
+                                 check_vql: Callable[[str], Awaitable[str | None]]) -> AIAnalysis | None:
+    """Try the registered fix rules for a validation error.
+
+    Every rule whose pattern matches the error rewrites the VQL; a rewrite
+    that changes the query is re-validated with `check_vql`. The first
+    rewrite that validates is returned as an analysis with the corrected VQL
+    as suggestion, in the same shape as an AI analysis.
+
+    Args:
+        error: The Denodo error message.
+        request: The original validation request.
+        check_vql: Validates a VQL string and returns the error message, or
+                   None if the VQL is valid.
+
+    Returns:
+        An `AIAnalysis` with the validated fix, or None if no rule applied.
+    """
+    for rule in FIX_RULES:
+        match = rule.pattern.search(error)
+        if not match:
+            continue
+        metrics.increment(f"autofix.matched.{rule.name}")
+        try:
+            fixed_vql = rule.rewrite(request.vql, match, request)
+        except Exception as e:
+            logger.error(f"Fix rule '{rule.name}' failed: {e}", exc_info=True)
+            fixed_vql = None
+
+        if fixed_vql and fixed_vql.strip() != request.vql.strip():
+            remaining_error = await check_vql(fixed_vql)
+            if remaining_error is None:
+                logger.info(f"Fix rule '{rule.name}' corrected the VQL without an AI call.")
+                metrics.increment(f"autofix.hit.{rule.name}")
+                metrics.increment("autofix.llm_calls_saved")
+                _record_hit_rate(rule.name)
+                return AIAnalysis(
+                    explanation=rule.explanation,
+                    sql_suggestion=fixed_vql,
+                    error_category=rule.error_category,
+                    fix_rule=rule.name,
+                )
+            logger.info(f"Fix rule '{rule.name}' applied but the VQL is still invalid: {remaining_error}")
+        metrics.increment(f"autofix.miss.{rule.name}")
+        _record_hit_rate(rule.name)
+    return None
@@ -0,0 +1,212 @@
+"""
+Deterministic explanation of the differences between source SQL and final VQL.
+
+This module compares the source and target ASTs with sqlglot and describes the
+transformations VQLForge applies itself (VDB qualification, the Oracle `DUAL`
+rewrite, function renames by the Denodo generator) as well as the remaining
+structural edits, without calling an AI service.
+"""
+
+import logging
+import re
+
+from sqlglot import exp, parse_one
+from sqlglot.diff import Insert, Remove, Update, diff
+from sqlglot.errors import ParseError
+
+logger = logging.getLogger(__name__)
+
+NO_CHANGES_EXPLANATION = "- The VQL is a direct equivalent of the source SQL; no significant transformations were applied."
+
+# Clause-level nodes reported from the sqlglot AST diff, with their display names.
+_CLAUSE_NAMES: dict[type[exp.Expression], str] = {
+    exp.Where: "`WHERE` clause",
+    exp.Join: "join",
+    exp.Group: "`GROUP BY` clause",
+    exp.Having: "`HAVING` clause",
+    exp.Order: "`ORDER BY` clause",
+    exp.Limit: "`LIMIT` clause",
+    exp.Subquery: "subquery",
+}
+
+_CALL_NAME_PATTERN = re.compile(r"^\s*(?:([A-Za-z_][\w.]*)\s*\(|(CASE|CAST)\b)", re.IGNORECASE)
+
+
+def _call_name(rendered: str) -> str | None:
+    """Return the function or keyword name a rendered expression starts with."""
+    match = _CALL_NAME_PATTERN.match(rendered)
+    if not match:
+        return None
+    return (match.group(1) or match.group(2)).upper()
+
+
+def _describe_table_changes(source_tree: exp.Expression, target_tree: exp.Expression) -> list[str]:
+    """Describe VDB qualification, the DUAL rewrite and added or removed tables."""
+    source_tables: dict[str, exp.Table] = {t.name.lower(): t for t in source_tree.find_all(exp.Table) if t.name}
+    target_tables: dict[str, exp.Table] = {t.name.lower(): t for t in target_tree.find_all(exp.Table) if t.name}
+    target_has_dual_function = any(
+        node.name.lower() == "dual" for node in target_tree.find_all(exp.Anonymous)
+    )
+
+    bullets: list[str] = []
+    qualified: dict[str, list[str]] = {}
+    removed: list[str] = []
+    for name, source_table in source_tables.items():
+        target_table = target_tables.get(name)
+        if target_table is None:
+            if name == "dual" and target_has_dual_function:
+                bullets.append("- Replaced the Oracle `DUAL` table with the Denodo `dual()` function.")
+            else:
+                removed.append(source_table.name)
+            continue
+        if not source_table.db and target_table.db:
+            qualified.setdefault(target_table.db, []).append(target_table.name)
+        elif source_table.db and target_table.db and source_table.db.lower() != target_table.db.lower():
+            bullets.append(
+                f"- Moved `{source_table.name}` from database `{source_table.db}` to `{target_table.db}`."
+            )
+
+    for vdb, tables in qualified.items():
+        table_list = ", ".join(f"`{table}`" for table in tables)
+        bullets.append(f"- Qualified {table_list} with the VDB `{vdb}`.")
+    if removed:
+        bullets.append(f"- Removed references to {', '.join(f'`{table}`' for table in removed)}.")
+    added = [target_tables[name].sql(dialect="denodo") for name in target_tables if name not in source_tables]
+    if added:
+        bullets.append(f"- Added references to {', '.join(f'`{table}`' for table in added)}.")
+    return bullets
+
+
+def _describe_function_renames(source_tree: exp.Expression, source_dialect: str, final_vql: str) -> list[str]:
+    """Describe functions that the Denodo generator renders under a different name."""
+    bullets: list[str] = []
+    seen: set[tuple[str, str]] = set()
+    final_vql_upper = final_vql.upper()
+    for node in source_tree.find_all(exp.Func):
+        if isinstance(node, exp.Anonymous):
+            continue
+        source_name = _call_name(node.sql(dialect=source_dialect))
+        target_name = _call_name(node.sql(dialect="denodo"))
+        if not source_name or not target_name or source_name == target_name:
+            continue
+        if (source_name, target_name) in seen or target_name not in final_vql_upper:
+            continue
+        seen.add((source_name, target_name))
+        bullets.append(f"- Rewrote `{source_name}` as the Denodo equivalent `{target_name}`.")
+    return bullets
+
+
+def _describe_column_changes(source_tree: exp.Expression, target_tree: exp.Expression) -> list[str]:
+    """Describe column references that only appear on one side."""
+    source_columns = {c.name.lower(): c.name for c in source_tree.find_all(exp.Column) if c.name}
+    target_columns = {c.name.lower(): c.name for c in target_tree.find_all(exp.Column) if c.name}
+    bullets: list[str] = []
+    removed = [name for key, name in source_columns.items() if key not in target_columns]
+    added = [name for key, name in target_columns.items() if key not in source_columns]
+    if removed:
+        bullets.append(f"- Removed column references {', '.join(f'`{c}`' for c in removed)}.")
+    if added:
+        bullets.append(f"- Added column references {', '.join(f'`{c}`' for c in added)}.")
+    return bullets
+
+
+def _normalize(tree: exp.Expression) -> exp.Expression:
+    """Undo VDB qualification and the `dual()` rewrite so they do not show up in the AST diff."""
+    def strip(node: exp.Expression) -> exp.Expression:
+        if isinstance(node, exp.Table):
+            if isinstance(node.this, exp.Anonymous) and node.this.name.lower() == "dual":
+                return exp.to_table("dual")
+            node = node.copy()
+            node.set("db", None)
+            node.set("catalog", None)
+        return node
+    return tree.transform(strip)
+
+
+def _enclosing_clause(node: exp.Expression) -> exp.Expression | None:
+    """Return the nearest clause-level ancestor of a node, if any."""
+    parent = node.parent
+    while parent is not None and type(parent) not in _CLAUSE_NAMES:
+        parent = parent.parent
+    return parent
+
+
+def _describe_clause_changes(source_tree: exp.Expression, target_tree: exp.Expression) -> list[str]:
+    """Describe clauses added, removed or modified beyond the deterministic translation.
+
+    The source tree is rendered with the Denodo generator and re-parsed first,
+    so the sqlglot AST diff only reports edits that the translation itself
+    does not explain, e.g. AI corrections made in the forge loop.
+    """
+    try:
+        translated_tree = parse_one(source_tree.sql(dialect="denodo"), read="denodo")
+    except ParseError:
+        translated_tree = source_tree
+    edits = diff(_normalize(translated_tree), _normalize(target_tree), delta_only=True)
+
+    removed: set[str] = set()
+    added: set[str] = set()
+    modified: set[str] = set()
+    edited_clause_ids: set[int] = {
+        id(edit.expression) for edit in edits
+        if isinstance(edit, (Insert, Remove)) and type(edit.expression) in _CLAUSE_NAMES
+    }
+    for edit in edits:
+        if not isinstance(edit, (Insert, Remove, Update)):
+            continue
+        node = edit.expression
+        clause = _enclosing_clause(node)
+        if type(node) in _CLAUSE_NAMES and (clause is None or id(clause) not in edited_clause_ids):
+            (removed if isinstance(edit, Remove) else added).add(_CLAUSE_NAMES[type(node)])
+        elif clause is not None and id(clause) not in edited_clause_ids:
+            modified.add(_CLAUSE_NAMES[type(clause)])
+
+    bullets: list[str] = []
+    for name in _CLAUSE_NAMES.values():
+        if name in modified or (name in removed and name in added):
+            bullets.append(f"- Modified the {name}.")
+        elif name in removed:
+            bullets.append(f"- Removed the {name}.")
+        elif name in added:
+            bullets.append(f"- Added the {name}.")
+    return bullets
+
+
+def describe_vql_differences(source_sql: str, source_dialect: str, final_vql: str) -> str:
+    """Explain the differences between a source SQL query and its final VQL.
+
+    The explanation is computed locally from the sqlglot ASTs of both queries
+    and is returned as a Markdown bulleted list, so it is deterministic and
+    does not need an AI service.
+
+    Args:
+        source_sql: The original SQL query.
+        source_dialect: The sqlglot dialect of the source SQL.
+        final_vql: The final, validated VQL.
+
+    Returns:
+        A Markdown bulleted list of the detected changes, a note that the VQL
+        is a direct equivalent, or an empty string if either query could not
+        be parsed.
+    """
+    try:
+        source_tree = parse_one(source_sql, read=source_dialect)
+        target_tree = parse_one(final_vql, read="denodo")
+    except ParseError as e:
+        logger.warning(f"Could not parse queries for the VQL diff explanation: {e}")
+        return ""
+
+    try:
+        bullets: list[str] = [
+            *_describe_table_changes(source_tree, target_tree),
+            *_describe_function_renames(source_tree, source_dialect, final_vql),
+            *_describe_column_changes(source_tree, target_tree),
+            *_describe_clause_changes(source_tree, target_tree),
+        ]
+    except Exception as e:
+        logger.error(f"Error while computing the VQL diff explanation: {e}", exc_info=True)
+        return ""
+
+    if not bullets:
+        return NO_CHANGES_EXPLANATION
+    return "\n".join(bullets)
@@ -0,0 +1,42 @@
+"""
+Shared fixtures of the backend tests.
+
+The settings are read from the environment when `src.config` is imported, so
+the required ones get placeholder values here, before any test module
+imports the application. The tests never connect to Denodo or an LLM.
+"""
+
+import os
+from typing import Iterator
+
+for name in ("DENODO_HOST", "DENODO_DB", "DENODO_USER", "DENODO_PW", "GEMINI_API_KEY", "OPENAI_API_KEY",
+             "AZURE_OPENAI_ENDPOINT", "AI_MODEL_NAME", "APP_VDB_CONF"):
+    os.environ.setdefault(name, "test")
+
+import pytest
+from sqlalchemy.orm import Session
+
+from src.config import settings
+from src.db import sqlite_session
+
+
+@pytest.fixture
+def log_db_path(tmp_path, monkeypatch) -> str:
+    """Point the SQLite log database at a fresh file; the engine globals are restored afterwards."""
+    path = str(tmp_path / "log.db")
+    monkeypatch.setattr(settings, "SQLITE_DB_PATH", path)
+    monkeypatch.setattr(sqlite_session, "sqlite_engine", None)
+    monkeypatch.setattr(sqlite_session, "SqliteSessionLocal", None)
+    yield path
+    sqlite_session.shutdown_sqlite_executor()
+    if sqlite_session.sqlite_engine is not None:
+        sqlite_session.sqlite_engine.dispose()
+
+
+@pytest.fixture
+def log_db(log_db_path) -> Iterator[Session]:
+    """Initialize a fresh log database, with all migrations applied, and open a session on it."""
+    sqlite_session.init_sqlite_db()
+    assert sqlite_session.sqlite_engine is not None
+    with sqlite_session.sqlite_session_scope() as db:
+        yield db
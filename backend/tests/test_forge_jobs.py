@@ -0,0 +1,182 @@
+import asyncio
+import datetime
+
+import pytest
+from sqlalchemy import func, select, update
+
+from src.schemas.agent import AgenticModeRequest
+from src.schemas.db_log import ForgeJob, ForgeJobEvent
+from src.services import forge_jobs
+from src.services.forge_jobs import (
+    JOB_COMPLETED,
+    JOB_FAILED,
+    JOB_QUEUED,
+    JOB_RUNNING,
+    JobLeaseLost,
+    claim_next_job,
+    create_job,
+    purge_finished_jobs,
+    read_job_events,
+    record_job_event,
+    recover_expired_jobs,
+    release_jobs,
+)
+
+REQUEST = AgenticModeRequest(sql="SELECT a FROM t", dialect="oracle", vdb="admin", vql="SELECT a FROM t")
+
+
+def _job(db, job_id: str) -> ForgeJob:
+    db.expire_all()
+    return db.get(ForgeJob, job_id)
+
+
+def _expire_lease(db, job_id: str) -> None:
+    db.execute(update(ForgeJob).where(ForgeJob.id == job_id)
+               .values(lease_expires_at=datetime.datetime.utcnow() - datetime.timedelta(seconds=1)))
+    db.commit()
+
+
+def _event_count(db, job_id: str) -> int:
+    return db.scalar(select(func.count()).select_from(ForgeJobEvent).where(ForgeJobEvent.job_id == job_id))
+
+
+def test_claim_leases_the_oldest_queued_job(log_db):
+    first, second = create_job(log_db, REQUEST), create_job(log_db, REQUEST)
+
+    assert claim_next_job(log_db, "worker-a", 60)[0] == first
+    assert claim_next_job(log_db, "worker-b", 60)[0] == second
+    assert claim_next_job(log_db, "worker-a", 60) is None
+    job = _job(log_db, first)
+    assert (job.status, job.owner, job.attempts) == (JOB_RUNNING, "worker-a", 1)
+    assert job.lease_expires_at > datetime.datetime.utcnow()
+
+
+def test_only_the_lease_owner_records_events(log_db):
+    job_id = create_job(log_db, REQUEST)
+    claim_next_job(log_db, "worker-a", 60)
+
+    with pytest.raises(JobLeaseLost):
+        record_job_event(log_db, job_id, "worker-b", 60, "step", {"step_name": "Translate"})
+    record_job_event(log_db, job_id, "worker-a", 60, "step", {"step_name": "Translate"})
+    record_job_event(log_db, job_id, "worker-a", 60, "result", {"final_vql": "SELECT a FROM t"})
+
+    job = _job(log_db, job_id)
+    assert (job.status, job.owner, job.lease_expires_at) == (JOB_COMPLETED, None, None)
+    assert [event for _, event, _ in read_job_events(log_db, job_id)[1]] == ["step", "result"]
+
+
+def test_recover_requeues_only_jobs_with_an_expired_lease(log_db):
+    create_job(log_db, REQUEST)
+    create_job(log_db, REQUEST)
+    live = claim_next_job(log_db, "worker-a", 60)[0]
+    expired = claim_next_job(log_db, "worker-b", 60)[0]
+    record_job_event(log_db, live, "worker-a", 60, "step", {})
+    record_job_event(log_db, expired, "worker-b", 60, "step", {})
+    _expire_lease(log_db, expired)
+
+    assert recover_expired_jobs(log_db, max_attempts=3) == (1, 0)
+
+    assert (_job(log_db, live).status, _job(log_db, live).owner) == (JOB_RUNNING, "worker-a")
+    assert (_job(log_db, expired).status, _job(log_db, expired).owner) == (JOB_QUEUED, None)
+    assert _event_count(log_db, live) == 1
+    assert _event_count(log_db, expired) == 0
+    # The previous owner can no longer write to the job.
+    with pytest.raises(JobLeaseLost):
+        record_job_event(log_db, expired, "worker-b", 60, "step", {})
+
+
+def test_recover_fails_a_job_after_max_attempts(log_db):
+    job_id = create_job(log_db, REQUEST)
+    for attempt in range(3):
+        claim_next_job(log_db, f"worker-{attempt}", 60)
+        _expire_lease(log_db, job_id)
+        recovered = recover_expired_jobs(log_db, max_attempts=3)
+
+    assert recovered == (0, 1)
+    job = _job(log_db, job_id)
+    assert (job.status, job.attempts) == (JOB_FAILED, 3)
+    assert job.finished_at is not None
+    status, events = read_job_events(log_db, job_id)
+    assert status == JOB_FAILED
+    assert [event for _, event, _ in events] == ["error"]
+
+
+def test_release_requeues_the_owners_jobs_without_counting_the_attempt(log_db):
+    create_job(log_db, REQUEST)
+    create_job(log_db, REQUEST)
+    mine = claim_next_job(log_db, "worker-a", 60)[0]
+    theirs = claim_next_job(log_db, "worker-b", 60)[0]
+    record_job_event(log_db, mine, "worker-a", 60, "step", {})
+
+    assert release_jobs(log_db, "worker-a") == 1
+
+    job = _job(log_db, mine)
+    assert (job.status, job.owner, job.attempts) == (JOB_QUEUED, None, 0)
+    assert _event_count(log_db, mine) == 0
+    assert _job(log_db, theirs).status == JOB_RUNNING
+
+
+def test_purge_deletes_old_finished_jobs_with_their_events(log_db):
+    for _ in range(3):
+        create_job(log_db, REQUEST)
+    finished = []
+    for _ in range(2):
+        finished.append(claim_next_job(log_db, "worker-a", 60)[0])
+        record_job_event(log_db, finished[-1], "worker-a", 60, "result", {})
+    old, recent = finished
+    queued = log_db.scalar(select(ForgeJob.id).where(ForgeJob.status == JOB_QUEUED))
+    log_db.execute(update(ForgeJob).where(ForgeJob.id.in_([old, queued]))
+                   .values(finished_at=datetime.datetime.utcnow() - datetime.timedelta(days=10)))
+    log_db.commit()
+
+    assert purge_finished_jobs(log_db, retention_days=7) == 1
+
+    assert _job(log_db, old) is None
+    assert _event_count(log_db, old) == 0
+    assert _job(log_db, recent) is not None
+    assert _job(log_db, queued) is not None
+
+
+def test_workers_run_a_queued_job_to_its_result(log_db, monkeypatch):
+    async def pipeline(request):
+        yield "step", {"step_name": "Translate"}
+        yield "result", {"final_vql": request.vql}
+
+    monkeypatch.setattr(forge_jobs, "run_forge_pipeline", pipeline)
+    job_id = create_job(log_db, REQUEST)
+
+    async def run() -> None:
+        workers = forge_jobs.ForgeJobWorkers(1, poll_interval=0.05, lease_seconds=60, max_attempts=3)
+        await workers.start()
+        try:
+            events = [event async for _, event, _ in workers.stream_events(job_id)]
+        finally:
+            await workers.stop()
+        assert events == ["step", "result"]
+
+    asyncio.run(asyncio.wait_for(run(), timeout=10))
+    job = _job(log_db, job_id)
+    assert (job.status, job.owner) == (JOB_COMPLETED, None)
+
+
+def test_stopping_the_workers_requeues_their_running_job(log_db, monkeypatch):
+    async def pipeline(request):
+        yield "step", {"step_name": "Translate"}
+        await asyncio.sleep(60)
+        yield "result", {}
+
+    monkeypatch.setattr(forge_jobs, "run_forge_pipeline", pipeline)
+    job_id = create_job(log_db, REQUEST)
+
+    async def run() -> None:
+        workers = forge_jobs.ForgeJobWorkers(1, poll_interval=0.05, lease_seconds=60, max_attempts=3)
+        await workers.start()
+        async for _, event, _ in workers.stream_events(job_id):
+            if event == "step":
+                break
+        await workers.stop()
+
+    asyncio.run(asyncio.wait_for(run(), timeout=10))
+    job = _job(log_db, job_id)
+    assert (job.status, job.owner, job.attempts) == (JOB_QUEUED, None, 0)
+    assert _event_count(log_db, job_id) == 0
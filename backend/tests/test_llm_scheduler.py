@@ -0,0 +1,29 @@
+import asyncio
+
+from src.utils.llm_scheduler import LLMScheduler, Priority, TokenBucket
+
+
+def test_a_bucket_refills_at_its_rate():
+    bucket = TokenBucket(60)
+    bucket.consume(60)
+
+    assert 0.9 < bucket.wait_time(1) <= 1.0
+
+
+def test_a_limit_of_zero_is_unlimited():
+    bucket = TokenBucket(0)
+    bucket.consume(1000)
+
+    assert bucket.wait_time(1000) == 0.0
+
+
+def test_scheduler_without_rate_limits_admits_every_run():
+    scheduler = LLMScheduler("test", max_concurrency=2, rpm_limit=0, tpm_limit=0)
+
+    async def run() -> None:
+        for _ in range(5):
+            await asyncio.wait_for(scheduler._acquire(Priority.INTERACTIVE, 500), timeout=1)
+            scheduler._release()
+
+    asyncio.run(run())
+    assert scheduler.queue_depth == 0
@@ -0,0 +1,87 @@
+import io
+import json
+
+from sqlalchemy import delete, func, select
+
+from src.schemas.db_log import AcceptedQuery, AcceptedQueryTable, QueryLshBucket, QuerySignature
+from src.services.log_import import import_accepted_queries
+from src.services.log_store import prepare_accepted_query, write_prepared_accepted_queries
+
+
+def _count(db, model) -> int:
+    return db.scalar(select(func.count()).select_from(model))
+
+
+def _ndjson(*records) -> io.StringIO:
+    return io.StringIO("\n".join(record if isinstance(record, str) else json.dumps(record) for record in records))
+
+
+def _pair(sql: str, dialect: str = "oracle") -> dict:
+    return {"source_sql": sql, "source_dialect": dialect, "target_vql": sql}
+
+
+def test_write_prepared_merges_duplicates_within_and_across_batches(log_db):
+    first = [prepare_accepted_query("SELECT a FROM t", "oracle", "SELECT a FROM t"),
+             prepare_accepted_query("SELECT b FROM u", "oracle", "SELECT b FROM u"),
+             prepare_accepted_query("select a from t", "oracle", "SELECT a FROM t")]
+    assert write_prepared_accepted_queries(log_db, first) == (2, 1)
+
+    second = [prepare_accepted_query("SELECT a FROM t", "oracle", "SELECT a FROM t"),
+              prepare_accepted_query("SELECT c FROM v", "oracle", "SELECT c FROM v")]
+    assert write_prepared_accepted_queries(log_db, second) == (1, 1)
+
+    counts = dict(log_db.execute(select(AcceptedQuery.source_sql, AcceptedQuery.occurrence_count)).tuples().all())
+    assert counts == {"SELECT a FROM t": 3, "SELECT b FROM u": 1, "SELECT c FROM v": 1}
+    assert _count(log_db, AcceptedQueryTable) == 3
+    assert _count(log_db, QuerySignature) == 3
+
+
+def test_write_prepared_does_not_reindex_existing_entries_without_signature(log_db):
+    prepared = prepare_accepted_query("SELECT a FROM t", "oracle", "SELECT a FROM t")
+    write_prepared_accepted_queries(log_db, [prepared])
+    # An entry logged before the similarity index existed, not backfilled yet.
+    log_db.execute(delete(QueryLshBucket))
+    log_db.execute(delete(QuerySignature))
+    log_db.commit()
+
+    assert write_prepared_accepted_queries(log_db, [prepared]) == (0, 1)
+    assert _count(log_db, AcceptedQueryTable) == 1
+    assert _count(log_db, QuerySignature) == 0
+
+
+def test_import_reports_added_merged_and_rejected_records(log_db):
+    report = import_accepted_queries(_ndjson(
+        _pair("SELECT a FROM t"),
+        _pair("SELECT b FROM u"),
+        {"source_sql": "select a from t", "source_dialect": "oracle", "target_vql": "SELECT a FROM t"},
+        "{not json",
+        {"source_sql": "SELECT c FROM v", "target_vql": "SELECT c FROM v"},
+        _pair("SELECT ((("),
+    ), "ndjson", workers=1, batch_size=2)
+
+    assert (report.total, report.added, report.merged, report.rejected) == (6, 2, 1, 3)
+    assert [reject.line for reject in report.rejects] == [4, 5, 6]
+    assert "source_dialect" in report.rejects[1].reason
+    assert _count(log_db, AcceptedQuery) == 2
+
+
+def test_import_uses_the_default_dialect_and_reads_csv(log_db):
+    stream = io.StringIO("source_sql,source_dialect,target_vql\n"
+                         "SELECT a FROM t,,SELECT a FROM t\n"
+                         "SELECT b FROM u,mysql,SELECT b FROM u\n")
+
+    report = import_accepted_queries(stream, "csv", default_dialect="oracle", workers=1)
+
+    assert (report.total, report.added, report.rejected) == (2, 2, 0)
+    dialects = dict(log_db.execute(select(AcceptedQuery.source_sql, AcceptedQuery.source_dialect)).tuples().all())
+    assert dialects == {"SELECT a FROM t": "oracle", "SELECT b FROM u": "mysql"}
+
+
+def test_reimporting_a_file_only_merges(log_db):
+    records = [_pair(f"SELECT a{number} FROM t") for number in range(5)]
+    import_accepted_queries(_ndjson(*records), "ndjson", workers=1)
+
+    report = import_accepted_queries(_ndjson(*records), "ndjson", workers=1)
+
+    assert (report.added, report.merged) == (0, 5)
+    assert _count(log_db, AcceptedQueryTable) == 5
@@ -0,0 +1,71 @@
+from sqlalchemy import event, func, select
+
+from src.db import sqlite_session
+from src.schemas.db_log import AcceptedQuery, AcceptedQueryLogRequest, AcceptedQueryTable, QuerySignature
+from src.services.log_store import add_accepted_query, write_accepted_queries
+
+
+def _count(db, model) -> int:
+    return db.scalar(select(func.count()).select_from(model))
+
+
+def test_repeated_acceptance_is_merged_into_one_entry(log_db):
+    first = add_accepted_query(log_db, AcceptedQueryLogRequest(
+        source_sql="SELECT id, name FROM customers WHERE id = 1", source_dialect="oracle",
+        target_vql="SELECT id, name FROM customers WHERE id = 1"))
+    log_db.commit()
+    # Formatting and keyword case do not make a different pair.
+    second = add_accepted_query(log_db, AcceptedQueryLogRequest(
+        source_sql="select id,  name\nfrom customers where id = 1", source_dialect="oracle",
+        target_vql="SELECT id, name  FROM customers WHERE id = 1"))
+    log_db.commit()
+
+    assert second.id == first.id
+    assert second.occurrence_count == 2
+    assert second.last_seen >= first.timestamp
+    assert _count(log_db, AcceptedQuery) == 1
+    assert _count(log_db, AcceptedQueryTable) == 1
+    assert _count(log_db, QuerySignature) == 1
+
+
+def test_different_dialects_or_translations_are_separate_entries(log_db):
+    sql = "SELECT id FROM customers"
+    add_accepted_query(log_db, AcceptedQueryLogRequest(source_sql=sql, source_dialect="oracle", target_vql=sql))
+    add_accepted_query(log_db, AcceptedQueryLogRequest(source_sql=sql, source_dialect="mysql", target_vql=sql))
+    add_accepted_query(log_db, AcceptedQueryLogRequest(
+        source_sql=sql, source_dialect="oracle", target_vql="SELECT id FROM crm.customers"))
+    log_db.commit()
+
+    assert _count(log_db, AcceptedQuery) == 3
+
+
+def test_write_accepted_queries_skips_unparsable_entries(log_db):
+    entry_ids = write_accepted_queries(log_db, [
+        AcceptedQueryLogRequest(source_sql="SELECT a FROM t", source_dialect="oracle", target_vql="SELECT a FROM t"),
+        AcceptedQueryLogRequest(source_sql="SELECT (((", source_dialect="oracle", target_vql="SELECT 1"),
+        AcceptedQueryLogRequest(source_sql="SELECT a FROM t", source_dialect="oracle", target_vql="SELECT a FROM t"),
+    ])
+
+    assert len(entry_ids) == 2 and entry_ids[0] == entry_ids[1]
+    assert log_db.get(AcceptedQuery, entry_ids[0]).occurrence_count == 2
+
+
+def test_write_accepted_queries_commits_the_batch_once(log_db):
+    transactions: list[str] = []
+    engine = sqlite_session.sqlite_engine
+    listeners = {"commit": lambda conn: transactions.append("commit"),
+                 "savepoint": lambda conn, name: transactions.append("savepoint")}
+    for name, listener in listeners.items():
+        event.listen(engine, name, listener)
+    try:
+        entry_ids = write_accepted_queries(log_db, [
+            AcceptedQueryLogRequest(source_sql=f"SELECT a{number} FROM t", source_dialect="oracle",
+                                    target_vql=f"SELECT a{number} FROM t")
+            for number in range(5)
+        ])
+    finally:
+        for name, listener in listeners.items():
+            event.remove(engine, name, listener)
+
+    assert len(set(entry_ids)) == 5
+    assert transactions == ["commit"]
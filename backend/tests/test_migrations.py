@@ -0,0 +1,91 @@
+import datetime
+import sqlite3
+
+from sqlalchemy import text
+
+from src.db import sqlite_session
+from src.db.migrations import MIGRATIONS, run_migrations
+from src.schemas.db_log import AcceptedQuery
+
+# The accepted query log as the first release created it, before any migration.
+BASELINE_SCHEMA = """
+    CREATE TABLE accepted_queries (
+        id INTEGER NOT NULL PRIMARY KEY,
+        timestamp DATETIME,
+        source_dialect VARCHAR,
+        source_sql TEXT,
+        target_vql TEXT,
+        tables TEXT
+    );
+    CREATE INDEX ix_accepted_queries_id ON accepted_queries (id);
+    CREATE INDEX ix_accepted_queries_source_dialect ON accepted_queries (source_dialect);
+"""
+
+
+def _columns(db, table: str) -> set[str]:
+    return {row[1] for row in db.execute(text(f"PRAGMA table_info({table})"))}
+
+
+def _create_baseline_database(path: str, rows: list[tuple]) -> None:
+    connection = sqlite3.connect(path)
+    connection.executescript(BASELINE_SCHEMA)
+    connection.executemany(
+        "INSERT INTO accepted_queries (id, timestamp, source_dialect, source_sql, target_vql, tables) "
+        "VALUES (?, ?, ?, ?, ?, ?)", rows)
+    connection.commit()
+    connection.close()
+
+
+def test_fresh_database_records_all_migrations(log_db):
+    applied = [row[0] for row in log_db.execute(text("SELECT name FROM schema_migrations ORDER BY name"))]
+
+    assert applied == [name for name, _ in MIGRATIONS]
+    assert {"owner", "lease_expires_at"} <= _columns(log_db, "forge_jobs")
+    assert {"request_tokens", "budget_exhausted"} <= _columns(log_db, "forge_runs")
+
+
+def test_migrations_are_applied_only_once(log_db):
+    run_migrations(sqlite_session.sqlite_engine)
+
+    count = log_db.execute(text("SELECT COUNT(*) FROM schema_migrations")).scalar()
+    assert count == len(MIGRATIONS)
+
+
+def test_upgrade_from_baseline_merges_duplicates_and_fills_indexes(log_db_path):
+    _create_baseline_database(log_db_path, [
+        (1, "2024-01-01 10:00:00.000000", "oracle", "SELECT a FROM orders", "SELECT a FROM orders", '["orders"]'),
+        # The same pair, formatted differently, accepted later.
+        (2, "2024-03-01 10:00:00.000000", "oracle", "select  a\nfrom orders", "SELECT a  FROM orders", '["orders"]'),
+        (3, "2024-02-01 10:00:00.000000", "oracle", "SELECT b FROM customers", "SELECT b FROM customers",
+         '["customers"]'),
+    ])
+
+    sqlite_session.init_sqlite_db()
+
+    with sqlite_session.sqlite_session_scope() as db:
+        entries = {entry.id: entry for entry in db.query(AcceptedQuery)}
+        assert set(entries) == {1, 3}
+        assert entries[1].occurrence_count == 2
+        assert entries[1].last_seen == datetime.datetime(2024, 3, 1, 10)
+        assert entries[3].occurrence_count == 1
+        assert all(entry.content_hash for entry in entries.values())
+
+        junction = set(db.execute(text("SELECT query_id, table_name FROM accepted_query_tables")))
+        assert junction == {(1, "orders"), (3, "customers")}
+        matches = db.execute(text(
+            "SELECT rowid FROM accepted_queries_fts WHERE accepted_queries_fts MATCH 'customers'")).scalars().all()
+        assert matches == [3]
+        applied = db.execute(text("SELECT COUNT(*) FROM schema_migrations")).scalar()
+        assert applied == len(MIGRATIONS)
+
+
+def test_upgrade_adds_lease_columns_to_existing_forge_jobs(log_db):
+    # A database from before forge jobs were leased.
+    log_db.execute(text("ALTER TABLE forge_jobs DROP COLUMN owner"))
+    log_db.execute(text("ALTER TABLE forge_jobs DROP COLUMN lease_expires_at"))
+    log_db.execute(text("DELETE FROM schema_migrations WHERE name = '0007_add_forge_job_leases'"))
+    log_db.commit()
+
+    run_migrations(sqlite_session.sqlite_engine)
+
+    assert {"owner", "lease_expires_at"} <= _columns(log_db, "forge_jobs")
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy.exc import OperationalError
+
+from src.config import settings
+from src.schemas.translation import AIAnalysis
+from src.schemas.validation import VqlValidateRequest
+from src.services import validation_service
+from src.services.validation_service import find_first_valid_candidate, run_validation
+from src.utils.metrics import metrics
+
+
+@pytest.fixture
+def checked(monkeypatch) -> list[str]:
+    """Replace the `DESC QUERYPLAN` check; the delay and outcome of each query are read from its text."""
+    queries: list[str] = []
+
+    async def run_queryplan(vql: str) -> Exception | None:
+        queries.append(vql)
+        kind, delay = vql.split(":")
+        await asyncio.sleep(float(delay))
+        if kind == "raise":
+            raise RuntimeError("connection reset")
+        return None if kind == "valid" else ValueError(f"{vql} is invalid")
+
+    monkeypatch.setattr(validation_service, "get_engine", lambda: object())
+    monkeypatch.setattr(validation_service, "_run_queryplan", run_queryplan)
+    return queries
+
+
+def _find(candidates: list[str], known_invalid=(), errors=None) -> int | None:
+    return asyncio.run(asyncio.wait_for(find_first_valid_candidate(candidates, known_invalid, errors), timeout=5))
+
+
+def test_the_first_valid_candidate_to_finish_wins(checked):
+    assert _find(["invalid:0", "valid:0.5", "valid:0.01"]) == 2
+
+
+def test_candidates_valid_at_the_same_time_are_ranked_by_order(checked):
+    assert _find(["invalid:0", "valid:0", "valid:0"]) == 1
+
+
+def test_remaining_checks_are_cancelled_once_a_candidate_is_valid(checked):
+    cancelled = metrics.counter("speculative.cancelled")
+
+    assert _find(["valid:0", "valid:10", "invalid:10"]) == 0
+    assert metrics.counter("speculative.cancelled") - cancelled == 2
+
+
+def test_a_failing_check_counts_as_invalid(checked):
+    assert _find(["raise:0", "valid:0.01"]) == 1
+    assert _find(["raise:0", "invalid:0"]) is None
+
+
+def test_known_invalid_candidates_are_not_checked_again(checked):
+    assert _find(["valid:0", "valid:0.01"], known_invalid={"valid:0"}) == 1
+    assert checked == ["valid:0.01"]
+
+
+def test_errors_of_invalid_candidates_are_returned(checked):
+    errors: dict[str, Exception] = {}
+
+    assert _find(["invalid:0", "raise:0", "invalid:0.01"], errors=errors) is None
+    assert sorted(errors) == ["invalid:0", "invalid:0.01"]
+    assert str(errors["invalid:0"]) == "invalid:0 is invalid"
+
+
+def test_a_known_error_is_analyzed_without_validating_again(checked, monkeypatch):
+    monkeypatch.setattr(settings, "AUTOFIX_ENABLED", False)
+    analyzed: list[str] = []
+
+    async def analyze(error_message, request, candidates):
+        analyzed.append(error_message)
+        return AIAnalysis(explanation="", sql_suggestion="SELECT 1")
+
+    monkeypatch.setattr(validation_service, "analyze_vql_validation_error", analyze)
+    error = OperationalError("DESC QUERYPLAN", {}, Exception("View orders not found"))
+    request = VqlValidateRequest(sql="SELECT a FROM orders", vql="SELECT a FROM orders", vdb="admin", dialect="oracle")
+
+    response = asyncio.run(run_validation(request, error=error))
+
+    assert not response.validated
+    assert response.error_analysis.sql_suggestion == "SELECT 1"
+    assert analyzed == ["View orders not found"]
+    assert checked == []
+
+
+def test_unavailable_connection_is_reported(monkeypatch):
+    def get_engine():
+        raise ConnectionError("not connected")
+
+    monkeypatch.setattr(validation_service, "get_engine", get_engine)
+
+    with pytest.raises(HTTPException) as raised:
+        _find(["valid:0"])
+    assert raised.value.status_code == 503
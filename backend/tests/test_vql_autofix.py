@@ -0,0 +1,138 @@
+import asyncio
+import re
+
+import pytest
+from sqlglot.dialects.dialect import Dialect
+
+from src.schemas.validation import VqlValidateRequest
+from src.services.validation_service import _build_queryplan_vql
+from src.utils import vql_autofix
+from src.utils.vql_autofix import FixRule, apply_rule_based_fixes
+
+
+def _has_denodo_dialect() -> bool:
+    try:
+        Dialect.get_or_raise("denodo")
+    except ValueError:
+        return False
+    return True
+
+
+# The rewrites render VQL with the denodo dialect of the sqlglot-vql fork.
+requires_denodo = pytest.mark.skipif(not _has_denodo_dialect(), reason="needs the denodo dialect of sqlglot-vql")
+
+
+def _request(vql: str, vdb: str = "admin") -> VqlValidateRequest:
+    return VqlValidateRequest(sql=vql, vql=vql, vdb=vdb, dialect="oracle")
+
+
+def _fix(error: str, vql: str, valid: bool = True) -> tuple[str | None, list[str]]:
+    """Run the fix rules with a validator that accepts (or rejects) every rewrite; return the fix and the checked VQL."""
+    checked: list[str] = []
+
+    async def check_vql(fixed_vql: str) -> str | None:
+        checked.append(fixed_vql)
+        return None if valid else "still invalid"
+
+    analysis = asyncio.run(apply_rule_based_fixes(error, _request(vql), check_vql))
+    return (analysis.sql_suggestion if analysis else None), checked
+
+
+def _rule(name: str, rewrite) -> FixRule:
+    return FixRule(name=name, pattern=re.compile("boom"), rewrite=rewrite, error_category="Other", explanation="")
+
+
+@requires_denodo
+def test_oracle_functions_are_rewritten():
+    fixed, _ = _fix("Unknown function NVL", "SELECT NVL(discount, 0) AS discount FROM orders")
+
+    assert "COALESCE(" in fixed.upper()
+    assert "NVL(" not in fixed.upper()
+
+
+@requires_denodo
+def test_decode_becomes_a_case_expression():
+    fixed, _ = _fix("Unknown function DECODE", "SELECT DECODE(status, 1, 'open', 'closed') AS s FROM orders")
+
+    assert "CASE" in fixed.upper()
+    assert "DECODE" not in fixed.upper()
+
+
+def test_oracle_rule_does_not_fire_without_the_function_call():
+    fixed, checked = _fix("Unknown function NVL", "SELECT discount FROM orders")
+
+    assert fixed is None
+    assert checked == []
+
+
+@requires_denodo
+def test_fetch_first_becomes_limit():
+    fixed, _ = _fix("Syntax error: unexpected FETCH", "SELECT a FROM orders ORDER BY a FETCH FIRST 5 ROWS ONLY")
+
+    assert re.search(r"LIMIT\s+5", fixed, re.IGNORECASE)
+    assert "FETCH" not in fixed.upper()
+
+
+@requires_denodo
+def test_reserved_word_is_quoted():
+    fixed, _ = _fix("Syntax error: Exception parsing query near 'label'", "SELECT id, label FROM orders")
+
+    assert '"label"' in fixed
+
+
+@requires_denodo
+def test_views_are_qualified_with_the_vdb():
+    fixed, _ = _fix("View orders not found", "SELECT a FROM orders")
+
+    assert re.search(r"\badmin\.orders\b", fixed)
+
+
+def test_first_validating_rule_wins(monkeypatch):
+    monkeypatch.setattr(vql_autofix, "FIX_RULES", [
+        _rule("unchanged", lambda vql, match, request: vql),
+        _rule("failing", lambda vql, match, request: 1 / 0),
+        _rule("rewrite", lambda vql, match, request: vql + " -- fixed"),
+        _rule("never_tried", lambda vql, match, request: vql + " -- other"),
+    ])
+    checked: list[str] = []
+
+    async def check_vql(fixed_vql: str) -> str | None:
+        checked.append(fixed_vql)
+        return None
+
+    analysis = asyncio.run(apply_rule_based_fixes("boom", _request("SELECT 1"), check_vql))
+
+    assert analysis.fix_rule == "rewrite"
+    assert analysis.sql_suggestion == "SELECT 1 -- fixed"
+    # An unchanged rewrite is not validated again.
+    assert checked == ["SELECT 1 -- fixed"]
+
+
+def test_rewrite_that_stays_invalid_is_not_suggested(monkeypatch):
+    monkeypatch.setattr(vql_autofix, "FIX_RULES", [_rule("rewrite", lambda vql, match, request: vql + " -- fixed")])
+
+    fixed, checked = _fix("boom", "SELECT 1", valid=False)
+
+    assert fixed is None
+    assert checked == ["SELECT 1 -- fixed"]
+
+
+def test_unmatched_error_validates_nothing(monkeypatch):
+    monkeypatch.setattr(vql_autofix, "FIX_RULES", [_rule("rewrite", lambda vql, match, request: vql + " -- fixed")])
+
+    assert _fix("Permission denied", "SELECT 1") == (None, [])
+
+
+@requires_denodo
+def test_queryplan_keeps_the_query_text_and_strips_only_the_top_level_limit():
+    vql = "SELECT a\nFROM (SELECT a FROM orders LIMIT 3) AS o\nORDER BY a  LIMIT 10 OFFSET 5"
+
+    assert _build_queryplan_vql(vql).rstrip() == (
+        "DESC QUERYPLAN SELECT a\nFROM (SELECT a FROM orders LIMIT 3) AS o\nORDER BY a")
+    assert _build_queryplan_vql("select  A from orders") == "DESC QUERYPLAN select  A from orders"
+
+
+@requires_denodo
+def test_queryplan_falls_back_to_cutting_at_limit_on_tokenizer_errors():
+    assert _build_queryplan_vql("SELECT 'unterminated FROM orders LIMIT 5").rstrip() == (
+        "DESC QUERYPLAN SELECT 'unterminated FROM orders")
@@ -95,6 +95,9 @@ export const forgeSql = async (requestBody, { onMessage, onError, onClose }) =>
         const reader = response.body.getReader();
         const decoder = new TextDecoder();
         let buffer = '';
+        // Steps arrive as deltas: the first event of a step has all fields, later ones only
+        // the changed fields. The result lists step ids instead of the full process log.
+        const stepsById = new Map();
 
         while (true) {
             const { done, value } = await reader.read();
@@ -107,7 +110,7 @@ export const forgeSql = async (requestBody, { onMessage, onError, onClose }) =>
 
             for (let i = 0; i < parts.length - 1; i++) {
                 const part = parts[i];
-                if (!part) continue;
+                if (!part || part.startsWith(':')) continue; // empty part or heartbeat comment
 
                 let event = 'message'; // Default event type
                 let data = '';
@@ -123,7 +126,13 @@ export const forgeSql = async (requestBody, { onMessage, onError, onClose }) =>
                 }
 
                 try {
-                    const parsedData = JSON.parse(data);
+                    let parsedData = JSON.parse(data);
+                    if (event === 'step' && parsedData.id !== undefined) {
+                        parsedData = { ...stepsById.get(parsedData.id), ...parsedData };
+                        stepsById.set(parsedData.id, parsedData);
+                    } else if (event === 'result' && Array.isArray(parsedData.steps)) {
+                        parsedData.process_log = parsedData.steps.map(id => stepsById.get(id)).filter(Boolean);
+                    }
                     onMessage({ event, data: parsedData });
                 } catch (e) {
                     console.error("Failed to parse SSE data:", data, e);